@@ -11,22 +11,26 @@
 # contents:
 #   i2cScanner
 #   EVMatrix library
+#   MatrixAnimation
+#   MotorMove
+#   MotorControl
+#   PIDParams
+#   StallDetector
 #   MXTMMX library
 #   NXTCam5 library
 
-from pybricks.hubs import EV3Brick
-from pybricks.iodevices import I2CDevice
-from pybricks.iodevices import  AnalogSensor
-from pybricks.iodevices import UARTDevice
-from pybricks.parameters import Port, Stop, Direction, Button, Color
-from pybricks.tools import wait, StopWatch, DataLog
-from pybricks.media.ev3dev import Font
+from transport import EV3Brick, I2CDevice, AnalogSensor, UARTDevice
+from transport import Port, Stop, Direction, Button, Color
+from transport import wait, StopWatch, DataLog, Font
+from transport import ticks_us, ticks_diff
 
 import os
 import sys
 import time
+from array import array
 
 from i2c import i2c
+from i2c_decode import u8, u16
 
 ## i2cScanner: this function provides scanning possibility for forgoten addresses
 def i2cScanner():
@@ -69,6 +73,12 @@ class EV3Matrix(i2c):
     #  @param i2c_address Address of your LED Matrix.
     def __init__(self, port, i2c_address=0x22):
         i2c.__init__(self, port, i2c_address)  
+        ## Framebuffer, one byte per row, bit n is column n. Drawn with draw_*(), sent by flush().
+        self.frame = bytearray(8)
+        ## Frame currently shown on the matrix
+        self.shown = bytearray(8)
+        ## Is shown known? Text, mirror and blink change the display behind our back.
+        self.shown_valid = False
 
     ## Changes i2c address of your LED Matrix.
     #  @param new_add Address to which user want to change.
@@ -82,6 +92,7 @@ class EV3Matrix(i2c):
     ## Sets blink mode
     #  @param self The object pointer.
     def blink_mode(self):
+        self.shown_valid = False
         self.writeByte(self.command_reg,'B')
     
     ## Turns on or of one columns on LED Matrix
@@ -89,9 +100,11 @@ class EV3Matrix(i2c):
     #  @param column The column which should be changed.
     #  @param on_off Bool to turn on or of lights.
     def column(self, column, on_off):
-        for i in range(8):
-            self.writeArray(self.row_reg,[i,column,on_off])        
-            self.writeByte(self.command_reg,'P') 
+        bits = 0xFF if on_off else 0
+        self.draw_column(column, bits)
+        self.send('C', 0, column, bits)
+        if self.shown_valid:
+            self.draw_column(column, bits, self.shown)
 
     ## Writes text to LED Matrix
     #  @param self The object pointer.
@@ -99,6 +112,7 @@ class EV3Matrix(i2c):
     #  @param data Which data to write.
     #  @param brightness Sets brightness to certain level.
     def text(self, font = 0, data = ' ', brightness = 2):
+        self.shown_valid = False
         self.writeArray(self.brightness_reg ,[brightness, font, ord(data)])        
         self.writeByte(self.command_reg,'F')
     
@@ -121,39 +135,271 @@ class EV3Matrix(i2c):
     #  @param column Desired column.
     #  @param on_off Bool to turn on or of lights.
     def pixel(self, row, column, on_off):
-        self.writeArray(self.row_reg,[row, column, on_off])        
-        self.writeByte(self.command_reg,'P')
+        self.draw_pixel(row, column, on_off)
+        self.send('P', row, column, on_off)
+        if self.shown_valid:
+            self.draw_pixel(row, column, on_off, self.shown)
     
     ## Turns on or of one row on LED Matrix.
     #  @param self The object pointer.
     #  @param row The row which should be changed.
     #  @param on_off Bool to turn on or of lights.
     def row(self, row_data, on_off):
-        for i in range(8):
-            self.writeArray(self.row_reg,[row_data,i,on_off])        
-            self.writeByte(self.command_reg,'P') 
+        bits = 0xFF if on_off else 0
+        self.draw_row(row_data, bits)
+        self.send('R', row_data, 0, bits)
+        if self.shown_valid:
+            self.draw_row(row_data, bits, self.shown)
 
     ## Mirrors/flips data on LED Matrix.
     #  @param self The object pointer.
     def mirror(self):
+        self.shown_valid = False
         self.writeByte(self.command_reg,'V')  
 
     ## Turns all pixels on.
     #  @param self The object pointer.
     def full(self):
-        for i in range(8):
-            for j in range(8):
-                self.writeArray(self.row_reg,[i,j,1])        
-                self.writeByte(self.command_reg,'P')
+        self.draw_fill(True)
+        self.flush()
 
     ## Turns all pixels off.
     #  @param self The object pointer.
     def clear(self):
+        self.draw_fill(False)
+        self.flush()
+
+    ## Sends a pixel ('P'), row ('R') or column ('C') command. Row and column take a bitmap as value.
+    #  @param self The object pointer.
+    #  @param cmd The command.
+    #  @param row Row register value.
+    #  @param column Column register value.
+    #  @param value Value register value.
+    def send(self, cmd, row, column, value):
+        self.writeArray(self.row_reg,[row, column, value])
+        self.writeByte(self.command_reg,cmd)
+
+    ## Sets a pixel in the framebuffer.
+    #  @param self The object pointer.
+    #  @param row Desired row.
+    #  @param column Desired column.
+    #  @param on_off Bool to turn on or of lights.
+    #  @param frame Frame to draw into, the framebuffer by default.
+    def draw_pixel(self, row, column, on_off = True, frame = None):
+        if frame is None:
+            frame = self.frame
+        if on_off:
+            frame[row] = frame[row] | (1 << column)
+        else:
+            frame[row] = frame[row] & ~(1 << column) & 0xFF
+
+    ## Sets a row of the framebuffer.
+    #  @param self The object pointer.
+    #  @param row The row which should be changed.
+    #  @param bits Bitmap of the row, bit n is column n.
+    #  @param frame Frame to draw into, the framebuffer by default.
+    def draw_row(self, row, bits, frame = None):
+        if frame is None:
+            frame = self.frame
+        frame[row] = bits & 0xFF
+
+    ## Sets a column of the framebuffer.
+    #  @param self The object pointer.
+    #  @param column The column which should be changed.
+    #  @param bits Bitmap of the column, bit n is row n.
+    #  @param frame Frame to draw into, the framebuffer by default.
+    def draw_column(self, column, bits, frame = None):
+        for i in range(8):
+            self.draw_pixel(i, column, (bits >> i) & 1, frame)
+
+    ## Sets the whole framebuffer.
+    #  @param self The object pointer.
+    #  @param rows 8 row bitmaps.
+    def draw_frame(self, rows):
+        self.frame[0:8] = bytes(rows)
+
+    ## Turns all pixels of the framebuffer on or off.
+    #  @param self The object pointer.
+    #  @param on_off Bool to turn on or of lights.
+    def draw_fill(self, on_off):
+        value = 0xFF if on_off else 0
         for i in range(8):
-            for j in range(8):
-                self.writeArray(self.row_reg,[i,j,0])        
-                self.writeByte(self.command_reg,'P')
-                print(self.readString(self.data_buffer_reg,12),"***")
+            self.frame[i] = value
+
+    ## Plans the commands turning frame shown into frame: a row command for every changed row,
+    #  replaced by column commands where a column covers changes of several rows.
+    #  @param self The object pointer.
+    #  @param frame Target frame.
+    #  @param shown Frame on the matrix, None if unknown.
+    #  @return List of (cmd, row, column, value) commands.
+    def plan(self, frame, shown):
+        if shown is None:
+            return [('R', i, 0, frame[i]) for i in range(8)]
+        diff = [frame[i] ^ shown[i] for i in range(8)]
+        columns = 0
+        cost = 8 - diff.count(0)
+        improved = True
+        while improved:
+            improved = False
+            for c in range(8):
+                trial = columns | (1 << c)
+                if trial == columns:
+                    continue
+                trial_cost = bin(trial).count('1')
+                for d in diff:
+                    if d & ~trial:
+                        trial_cost = trial_cost + 1
+                if trial_cost < cost:
+                    cost = trial_cost
+                    columns = trial
+                    improved = True
+        commands = []
+        for c in range(8):
+            if columns & (1 << c):
+                bits = 0
+                for i in range(8):
+                    bits = bits | (((frame[i] >> c) & 1) << i)
+                commands.append(('C', 0, c, bits))
+        for i in range(8):
+            if diff[i] & ~columns:
+                commands.append(('R', i, 0, frame[i]))
+        return commands
+
+    ## Sends the framebuffer to the matrix with the minimal number of row/column commands.
+    #  @param self The object pointer.
+    #  @return Number of commands sent (2 I2C transactions each).
+    def flush(self):
+        commands = self.plan(self.frame, self.shown if self.shown_valid else None)
+        for cmd, row, column, value in commands:
+            self.send(cmd, row, column, value)
+        self.shown[0:8] = self.frame
+        self.shown_valid = True
+        return len(commands)
+
+## 5x7 font for MatrixAnimation.scroll_text, 5 column bitmaps per character, bit n is row n
+FONT_CHARS = " !-.:?0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+FONT5X7 = bytes([
+    0x00,0x00,0x00,0x00,0x00, 0x00,0x00,0x5F,0x00,0x00, 0x08,0x08,0x08,0x08,0x08,
+    0x00,0x60,0x60,0x00,0x00, 0x00,0x36,0x36,0x00,0x00, 0x02,0x01,0x51,0x09,0x06,
+    0x3E,0x51,0x49,0x45,0x3E, 0x00,0x42,0x7F,0x40,0x00, 0x42,0x61,0x51,0x49,0x46,
+    0x21,0x41,0x45,0x4B,0x31, 0x18,0x14,0x12,0x7F,0x10, 0x27,0x45,0x45,0x45,0x39,
+    0x3C,0x4A,0x49,0x49,0x30, 0x01,0x71,0x09,0x05,0x03, 0x36,0x49,0x49,0x49,0x36,
+    0x06,0x49,0x49,0x29,0x1E, 0x7E,0x11,0x11,0x11,0x7E, 0x7F,0x49,0x49,0x49,0x36,
+    0x3E,0x41,0x41,0x41,0x22, 0x7F,0x41,0x41,0x22,0x1C, 0x7F,0x49,0x49,0x49,0x41,
+    0x7F,0x09,0x09,0x09,0x01, 0x3E,0x41,0x49,0x49,0x7A, 0x7F,0x08,0x08,0x08,0x7F,
+    0x00,0x41,0x7F,0x41,0x00, 0x20,0x40,0x41,0x3F,0x01, 0x7F,0x08,0x14,0x22,0x41,
+    0x7F,0x40,0x40,0x40,0x40, 0x7F,0x02,0x0C,0x02,0x7F, 0x7F,0x04,0x08,0x10,0x7F,
+    0x3E,0x41,0x41,0x41,0x3E, 0x7F,0x09,0x09,0x09,0x06, 0x3E,0x41,0x51,0x21,0x5E,
+    0x7F,0x09,0x19,0x29,0x46, 0x46,0x49,0x49,0x49,0x31, 0x01,0x01,0x7F,0x01,0x01,
+    0x3F,0x40,0x40,0x40,0x3F, 0x1F,0x20,0x40,0x20,0x1F, 0x3F,0x40,0x38,0x40,0x3F,
+    0x63,0x14,0x08,0x14,0x63, 0x07,0x08,0x70,0x08,0x07, 0x61,0x51,0x49,0x45,0x43,
+])
+
+## MatrixAnimation: plays a sequence of 8x8 frames on an EV3Matrix at a fixed frame rate.
+#  Every transition is compiled into its row/column commands once, playback only sends them.
+#  @code
+#  anim = MatrixAnimation(matrix, MatrixAnimation.scroll_text("HELLO"), fps = 15)
+#  anim.play()
+#  print(anim.achieved_fps, anim.dropped)
+#  @endcode
+class MatrixAnimation():
+
+    ## Initialize the animation.
+    #  @param self The object pointer.
+    #  @param matrix The EV3Matrix to play on.
+    #  @param frames List of frames, each 8 row bitmaps (bit n is column n).
+    #  @param fps Target frame rate.
+    def __init__(self, matrix, frames, fps = 10):
+        self.matrix = matrix
+        self.frames = [bytes(frame) for frame in frames]
+        self.fps = fps
+        ## transitions[i]: commands from frame i-1 (the last frame for i = 0) to frame i
+        self.transitions = []
+        ## Frame rate reached by the last play()
+        self.achieved_fps = 0
+        ## Frames skipped by the last play() to keep the pace
+        self.dropped = 0
+        self.compile()
+
+    ## Builds scrolling text frames from the 5x7 font, one frame per column step.
+    #  @param text The text, lower case letters are shown as upper case.
+    #  @param spacing Empty columns between characters.
+    @staticmethod
+    def scroll_text(text, spacing = 1):
+        strip = bytearray(8)
+        for ch in text.upper():
+            i = FONT_CHARS.find(ch)
+            if i < 0:
+                i = FONT_CHARS.find('?')
+            strip.extend(FONT5X7[5 * i:5 * i + 5])
+            strip.extend(bytes(spacing))
+        strip.extend(bytes(8))
+        frames = []
+        for offset in range(len(strip) - 7):
+            rows = bytearray(8)
+            for c in range(8):
+                column = strip[offset + c]
+                for r in range(8):
+                    if (column >> r) & 1:
+                        rows[r] = rows[r] | (1 << c)
+            frames.append(bytes(rows))
+        return frames
+
+    ## Compiles the command stream of every transition.
+    #  @param self The object pointer.
+    def compile(self):
+        n = len(self.frames)
+        self.transitions = [self.matrix.plan(self.frames[i], self.frames[i - 1]) for i in range(n)]
+
+    ## Commands of the heaviest transition, size the frame rate so it fits the bus (2 transactions per command).
+    #  @param self The object pointer.
+    def max_commands(self):
+        return max([len(t) for t in self.transitions]) if self.transitions else 0
+
+    ## Plays the animation with deadline based pacing. Late frames are dropped instead of slowing down.
+    #  @param self The object pointer.
+    #  @param loops How many times to play all frames.
+    #  @return Achieved frames per second, 0 if there is nothing to play.
+    def play(self, loops = 1):
+        matrix = self.matrix
+        n = len(self.frames)
+        total = n * loops
+        self.dropped = 0
+        if total <= 0:
+            self.achieved_fps = 0
+            return 0
+        period = 1000 / self.fps
+        watch = StopWatch()
+        shown = bytes(matrix.shown) if matrix.shown_valid else None
+        sent = 0
+        k = 0
+        sequential = False
+        while k < total:
+            frame = self.frames[k % n]
+            commands = self.transitions[k % n] if sequential else matrix.plan(frame, shown)
+            for cmd, row, column, value in commands:
+                matrix.send(cmd, row, column, value)
+            shown = frame
+            sent = sent + 1
+            now = watch.time()
+            late = int(now // period)
+            if late > k + 1 and k + 1 < total:
+                # frame k+1 missed its slot, continue with the frame due now
+                late = min(late, total - 1)
+                self.dropped = self.dropped + late - (k + 1)
+                k = late
+                sequential = False
+            else:
+                k = k + 1
+                sequential = True
+                if now < k * period:
+                    wait(k * period - now)
+        elapsed = watch.time()
+        matrix.frame[0:8] = shown
+        matrix.shown[0:8] = shown
+        matrix.shown_valid = True
+        self.achieved_fps = sent * 1000 / elapsed if elapsed else 0
+        return self.achieved_fps
 
 ## NXTCam5: this class provides functions for NXTCam5.
 #  for read and write operations.
@@ -226,52 +472,81 @@ class NXTCam5(i2c):
     x_lo_right_8th_reg = 0x69
     y_lo_right_8th_reg = 0x6A
 
+    ## Tracking modes and their commands
+    tracking_modes = {"object": 'B', "face": 'F', "eye": 'e', "line": 'L', "QRcode": 'Q'}
+
     ## Initialize the class with the i2c address of your NXTCam5.
     #  @param self The object pointer.
     #  @param port Port where NXTCam5 is connected.
     #  @param i2c_address Address of your NXTCam5.
     def __init__(self, port,i2c_address=0x02):
         i2c.__init__(self,port, i2c_address)  
+        ## Command of the active tracking mode, None if not known
+        self.mode = None
+        ## Object table, 8 objects of 5 bytes: color, x/y top left, x/y bottom right
+        self.object_table = bytearray(40)
+        ## Number of valid objects in object_table
+        self.object_count = 0
+
+    ## Sends a mode command and remembers it as active mode.
+    #  @param self The object pointer.
+    #  @param cmd The command.
+    #  @param tracking Is cmd a tracking mode? Other commands make the active mode unknown.
+    def mode_command(self, cmd, tracking = True):
+        self.writeByte(self.command_reg, cmd)
+        self.mode = cmd if tracking else None
+
+    ## Selects tracking mode, the command is only sent when the mode is not already active.
+    #  @param self The object pointer.
+    #  @param mode Tracking mode: object, face, eye, line or QRcode.
+    #  @return False for an unknown mode.
+    def select_mode(self, mode):
+        cmd = self.tracking_modes.get(mode)
+        if cmd is None:
+            return False
+        if cmd != self.mode:
+            self.mode_command(cmd)
+        return True
 
     ## Selects object tracking mode.
     #  @param self The object pointer.
     def select_object_tracking_mode(self):
-        self.writeByte(0x41,'B') 
+        self.mode_command('B') 
 
     ## Selects face tracking mode.
     #  @param self The object pointer.
     def select_face_tracking_mode(self):
-        self.writeByte(0x41,'F') 
+        self.mode_command('F') 
 
     ## Starts capturing continuous movie.
     #  @param self The object pointer.
     def begin_capture_continuos_movie(self):
-        self.writeByte(0x41,'R') 
+        self.mode_command('R', False) 
 
     ## Records short clip.
     #  @param self The object pointer.
     def capture_short_clip(self):
-        self.writeByte(0x41,'M') 
+        self.mode_command('M', False) 
 
     ## Captures picture.
     #  @param self The object pointer. 
     def capture_still_picture(self):
-        self.writeByte(0x41,'P') 
+        self.mode_command('P', False) 
 
     ## Selects eye tracking mode.
     #  @param self The object pointer. 
     def select_eye_tracking_mode(self):
-        self.writeByte(0x41,'e')   
+        self.mode_command('e')   
 
     ## Selects QRcode tracking mode.
     #  @param self The object pointer. 
     def select_QRcode_tracking_mode(self):
-        self.writeByte(0x41,'Q')   
+        self.mode_command('Q')   
 
     ## Selects line tracking mode.
     #  @param self The object pointer. 
     def select_line_tracking_mode(self):
-        self.writeByte(0x41,'L') 
+        self.mode_command('L') 
     
     ## Locks tracing buffer.
     #  @param self The object pointer.
@@ -287,123 +562,513 @@ class NXTCam5(i2c):
     ## Counts visible objects.
     #  @param self The object pointer.
     def count_objects(self):
-        self.select_object_tracking_mode()
+        self.select_mode("object")
         return self.readByte(self.count_obj_reg)
 
+    ## Reads object count and all 8 object records (0x42-0x6A) in one transaction into object_table.
+    #  @param self The object pointer.
+    #  @param mode Sets the mode of tracing.
+    #  @return Number of objects, None for an unknown mode.
+    def read_object_table(self, mode = "object"):
+        if not self.select_mode(mode):
+            return None
+        data = self.readArray(self.count_obj_reg, self.y_lo_right_8th_reg - self.count_obj_reg + 1)
+        self.object_table[0:40] = data[1:41]
+        self.object_count = min(data[0], 8)
+        return self.object_count
+
     ## Gets info for first object.
     #  @param self The object pointer.
     #  @param mode Sets the mode of tracing.
     def get_1st_object_info(self, mode = "object"): #mode: object, face, eye, line
-        info = []
-        if mode == "object":
-            self.select_object_tracking_mode()
-        elif mode == "face":
-            self.select_face_tracking_mode()
-        elif mode == "eye":
-            self.select_eye_tracking_mode()
-        elif mode == "line":
-            self.select_line_tracking_mode()
-        else:
+        if not self.select_mode(mode):
             return("no valid mode selected")
-        info.append(self.readByte(self.clr_1st_reg)) #TODO:Colors in bigger numbers. maybe readINT????
-        info.append(self.readByte(self.x_up_left_1st_reg))
-        info.append(self.readByte(self.y_up_left_1st_reg))
-        info.append(self.readByte(self.x_lo_right_1st_reg))
-        info.append(self.readByte(self.y_lo_right_1st_reg))
-        return info 
+        return list(self.readArray(self.clr_1st_reg, 5)) #TODO:Colors in bigger numbers. maybe readINT????
 
     ## Gets info for all objects.
     #  @param self The object pointer.
     #  @param mode Sets the mode of tracing.
     def get_all_object_info(self, mode = "object"):
-        info = []
-        all_info = []
-
-        if mode == "object":
-            self.select_object_tracking_mode()
-        elif mode == "face":
-            self.select_face_tracking_mode()
-        elif mode == "eye":
-            self.select_eye_tracking_mode()
-        elif mode == "line":
-            self.select_line_tracking_mode()
-        else:
+        if self.read_object_table(mode) is None:
             return("no valid mode selected")
+        table = self.object_table
+        return [list(table[5 * i:5 * i + 5]) for i in range(self.object_count)]
+
+
+## MotorMove: completion handle of a NXTMMX motor move, returned by the run_time/run_angle/run_rotation/run_target methods.
+#  done() only talks to the NXTMMX when the move could have finished: the poll interval
+#  follows the remaining time, estimated from the run time or from the measured encoder speed.
+#  @code
+#  move = mux.motor1_run_angle(50, 720, wait = False)
+#  while not move.done():
+#      matrix.flush()
+#  @endcode
+class MotorMove():
+
+    ## Shortest and longest poll interval in ms
+    min_poll_ms = 5
+    max_poll_ms = 100
+    ## Expected encoder speed in degrees per second per speed unit, used until the speed is measured
+    deg_per_speed = 9
+
+    ## Initialize the handle, the move must already be started.
+    #  @param self The object pointer.
+    #  @param mux The NXTMMX.
+    #  @param motor Motor number, 1 or 2.
+    #  @param busy Status register bits set while the move runs.
+    #  @param speed The speed of the move.
+    #  @param target Encoder target of a positional move.
+    #  @param run_ms Duration of a timed move in ms.
+    #  @param timeout Time in ms after which the motor is stopped and the move given up, None to wait forever.
+    def __init__(self, mux, motor, busy, speed, target = None, run_ms = None, timeout = None):
+        self.mux = mux
+        self.motor = motor
+        self.busy = busy
+        self.status_reg = mux.m1_read_status_reg + motor - 1
+        self.encoder_reg = mux.m1_read_encoder_reg + 4 * (motor - 1)
+        if target is not None:
+            target = target & 0xFFFFFFFF
+            if target & 0x80000000: target = target - 0x100000000
+        self.target = target
+        self.run_ms = run_ms
+        self.timeout = timeout
+        ## Encoder speed in degrees per ms
+        self.rate = abs(speed) * self.deg_per_speed / 1000
+        self.last_angle = None
+        self.last_ms = 0
+        ## Number of status reads
+        self.polls = 0
+        self.finished = False
+        self.timed_out = False
+        self.watch = StopWatch()
+        self.next_ms = self.min_poll_ms if run_ms is None else min(run_ms, self.max_poll_ms)
+
+    ## Check the move without blocking.
+    #  @param self The object pointer.
+    #  @return True when the move is finished or timed out.
+    def done(self):
+        if self.finished:
+            return True
+        now = self.watch.time()
+        if self.timeout is not None and now >= self.timeout:
+            self.cancel()
+            self.timed_out = True
+            return True
+        if now < self.next_ms:
+            return False
+        self.polls = self.polls + 1
+        if self.target is None:
+            status = self.mux.motor1_get_status(0) if self.motor == 1 else self.mux.motor2_get_status(0)
+            remaining = (self.run_ms - now) if self.run_ms is not None else self.max_poll_ms
+        else:
+            # encoders and status in one transaction
+            self.mux.refresh(self.encoder_reg, self.status_reg)
+            status = self.mux.readByte(self.status_reg)
+            angle = self.mux.readLongSigned(self.encoder_reg)
+            self.mux.invalidate()
+            if self.last_angle is not None and now > self.last_ms and angle != self.last_angle:
+                self.rate = abs(angle - self.last_angle) / (now - self.last_ms)
+            self.last_angle = angle
+            self.last_ms = now
+            remaining = abs(self.target - angle) / self.rate // 2 if self.rate else self.max_poll_ms
+        if not status & self.busy:
+            self.finished = True
+            return True
+        self.next_ms = now + min(max(remaining, self.min_poll_ms), self.max_poll_ms)
+        return False
+
+    ## Block until the move is finished, sleeping between the polls.
+    #  @param self The object pointer.
+    #  @return False if the move timed out.
+    def wait(self):
+        while not self.done():
+            wait(max(self.next_ms - self.watch.time(), 1))
+        return not self.timed_out
+
+    ## Stop the motor (float) and finish the move.
+    #  @param self The object pointer.
+    def cancel(self):
+        if not self.finished:
+            if self.motor == 1:
+                self.mux.motor1_stop()
+            else:
+                self.mux.motor2_stop()
+            self.finished = True
+
+    ## Time since the start of the move in ms.
+    #  @param self The object pointer.
+    def elapsed(self):
+        return self.watch.time()
+
+
+## MotorPairMove: completion handle of a synchronized move of both NXTMMX motors.
+#  Same interface as MotorMove, finished when both motors are.
+class MotorPairMove():
+
+    def __init__(self, move1, move2):
+        self.moves = (move1, move2)
+
+    ## Check both motors without blocking.
+    #  @param self The object pointer.
+    def done(self):
+        done1 = self.moves[0].done()
+        done2 = self.moves[1].done()
+        return done1 and done2
+
+    ## Block until both motors finished.
+    #  @param self The object pointer.
+    #  @return False if a motor timed out.
+    def wait(self):
+        while not self.done():
+            pending = [move for move in self.moves if not move.finished]
+            wait(max(min([move.next_ms - move.watch.time() for move in pending]), 1))
+        return not self.timed_out
+
+    ## Stop both motors (float).
+    #  @param self The object pointer.
+    def cancel(self):
+        self.moves[0].cancel()
+        self.moves[1].cancel()
+
+    @property
+    def finished(self):
+        return self.moves[0].finished and self.moves[1].finished
+
+    @property
+    def timed_out(self):
+        return self.moves[0].timed_out or self.moves[1].timed_out
+
+    @property
+    def polls(self):
+        return self.moves[0].polls + self.moves[1].polls
 
-        num_objects = self.count_objects()
-
-        if num_objects > 0:
-            info.append(self.readByte(self.clr_1st_reg)) 
-            info.append(self.readByte(self.x_up_left_1st_reg))
-            info.append(self.readByte(self.y_up_left_1st_reg))
-            info.append(self.readByte(self.x_lo_right_1st_reg))
-            info.append(self.readByte(self.y_lo_right_1st_reg))
-            all_info.append(info)
-            info = []
-
-        if num_objects > 1:
-            info.append(self.readByte(self.clr_2nd_reg)) 
-            info.append(self.readByte(self.x_up_left_2nd_reg))
-            info.append(self.readByte(self.y_up_left_2nd_reg))
-            info.append(self.readByte(self.x_lo_right_2nd_reg))
-            info.append(self.readByte(self.y_lo_right_2nd_reg))
-            all_info.append(info)
-            info = []
-
-        if num_objects > 2:
-            info.append(self.readByte(self.clr_3rd_reg))
-            info.append(self.readByte(self.x_up_left_3rd_reg))
-            info.append(self.readByte(self.y_up_left_3rd_reg))
-            info.append(self.readByte(self.x_lo_right_3rd_reg))
-            info.append(self.readByte(self.y_lo_right_3rd_reg))
-            all_info.append(info)
-            info = []
-
-        if num_objects > 3:
-            info.append(self.readByte(self.clr_4th_reg))
-            info.append(self.readByte(self.x_up_left_4th_reg))
-            info.append(self.readByte(self.y_up_left_4th_reg))
-            info.append(self.readByte(self.x_lo_right_4th_reg))
-            info.append(self.readByte(self.y_lo_right_4th_reg))
-            all_info.append(info)
-            info = []
-
-        if num_objects > 4:
-            info.append(self.readByte(self.clr_5th_reg)) 
-            info.append(self.readByte(self.x_up_left_5th_reg))
-            info.append(self.readByte(self.y_up_left_5th_reg))
-            info.append(self.readByte(self.x_lo_right_5th_reg))
-            info.append(self.readByte(self.y_lo_right_5th_reg))
-            all_info.append(info)
-            info = []
-
-        if num_objects > 5:
-            info.append(self.readByte(self.clr_6th_reg)) 
-            info.append(self.readByte(self.x_up_left_6th_reg))
-            info.append(self.readByte(self.y_up_left_6th_reg))
-            info.append(self.readByte(self.x_lo_right_6th_reg))
-            info.append(self.readByte(self.y_lo_right_6th_reg))
-            all_info.append(info)
-            info = []
-
-        if num_objects > 6:
-            info.append(self.readByte(self.clr_7th_reg)) 
-            info.append(self.readByte(self.x_up_left_7th_reg))
-            info.append(self.readByte(self.y_up_left_7th_reg))
-            info.append(self.readByte(self.x_lo_right_7th_reg))
-            info.append(self.readByte(self.y_lo_right_7th_reg))
-            all_info.append(info)
-            info = []
-            
-        if num_objects > 7:
-            info.append(self.readByte(self.clr_8th_reg)) 
-            info.append(self.readByte(self.x_up_left_8th_reg))
-            info.append(self.readByte(self.y_up_left_8th_reg))
-            info.append(self.readByte(self.x_lo_right_8th_reg))
-            info.append(self.readByte(self.y_lo_right_8th_reg))
-            all_info.append(info)
-
-        return all_info 
+    def elapsed(self):
+        return self.moves[0].elapsed()
+
+
+## MotorControl: fixed rate host side position control of the NXTMMX motors.
+#  Every tick reads both encoders in one transaction, computes feedforward + PID speeds towards
+#  the (moving) setpoints and writes the speeds of the controlled motors in one transaction.
+#  @code
+#  ctl = mux.motor_controller(period_ms = 10)
+#  mux.motor1_track_target(0, velocity = 90)
+#  ctl.run(2000)
+#  print(ctl.jitter_max_us, ctl.jitter_mean_us(), ctl.overruns)
+#  @endcode
+class MotorControl():
+
+    ## Speed units per degree per second, inverse of the motor speed at speed 1
+    kf = 1 / 9
+
+    ## Initialize the controller.
+    #  @param self The object pointer.
+    #  @param mux The NXTMMX.
+    #  @param period_ms Control period in ms.
+    #  @param kp Proportional gain, speed units per degree of error.
+    #  @param ki Integral gain, speed units per degree second.
+    #  @param kd Derivative gain, speed units per degree per second.
+    def __init__(self, mux, period_ms = 10, kp = 1.0, ki = 0.5, kd = 0.02):
+        self.mux = mux
+        self.period_ms = period_ms
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        ## Limit of the integral term in speed units
+        self.integral_limit = 30
+        ## Setpoint per motor, None if the motor is not controlled
+        self.target = [None, None]
+        ## Setpoint velocity per motor in degrees per second, the setpoint moves by it every tick
+        self.velocity = [0, 0]
+        self.integral = [0.0, 0.0]
+        self.last_error = [None, None]
+        ## Last encoder readings and control errors
+        self.angle = [0, 0]
+        self.error = [0, 0]
+        self.speed = [0, 0]
+        # command block 0x46-0x51: speed, time, command B, command A of Motor 1, encoder target and block of Motor 2
+        self.block = bytearray(mux.m2_command_reg_A - mux.m1_speed_reg + 1)
+        self.next_us = None
+        self.clear_stats()
+
+    ## Reset the jitter statistics.
+    #  @param self The object pointer.
+    def clear_stats(self):
+        ## Number of ticks
+        self.ticks = 0
+        ## Ticks started more than a period late, their deadlines were skipped
+        self.overruns = 0
+        ## Largest tick start lateness in us
+        self.jitter_max_us = 0
+        self.jitter_sum_us = 0
+
+    ## Mean tick start lateness in us.
+    #  @param self The object pointer.
+    def jitter_mean_us(self):
+        return self.jitter_sum_us / self.ticks if self.ticks else 0
+
+    ## Let a motor track a target angle.
+    #  @param self The object pointer.
+    #  @param motor Motor number, 1 or 2.
+    #  @param target_angle The setpoint.
+    #  @param velocity Setpoint velocity in degrees per second.
+    def track(self, motor, target_angle, velocity = 0):
+        m = motor - 1
+        if self.target[m] is None:
+            self.integral[m] = 0.0
+            self.last_error[m] = None
+        self.target[m] = target_angle
+        self.velocity[m] = velocity
+
+    ## Stop controlling a motor, it keeps its last speed.
+    #  @param self The object pointer.
+    #  @param motor Motor number, 1 or 2.
+    def release(self, motor):
+        self.target[motor - 1] = None
+
+    ## One control step: read encoders, compute and write the speeds.
+    #  @param self The object pointer.
+    def tick(self):
+        self.angle[0], self.angle[1] = self.mux.motors_get_angle()
+        dt = self.period_ms / 1000
+        command_A = self.mux.status_speed_control | 0x80
+        for m in range(2):
+            target = self.target[m]
+            if target is None:
+                continue
+            error = target - self.angle[m]
+            last = self.last_error[m]
+            derivative = (error - last) / dt if last is not None else 0
+            self.last_error[m] = error
+            self.error[m] = error
+            output = self.kf * self.velocity[m] + self.kp * error + self.kd * derivative
+            integral = self.integral[m]
+            if -100 < output + integral < 100:
+                # integrate only while the output is not saturated (anti windup)
+                integral = min(max(integral + self.ki * error * dt, -self.integral_limit), self.integral_limit)
+                self.integral[m] = integral
+            speed = output + integral
+            speed = int(min(max(speed, -100), 100) + (0.5 if speed > 0 else -0.5))
+            self.speed[m] = speed
+            base = 8 * m
+            self.block[base] = speed & 0xFF
+            self.block[base + 3] = command_A
+            # the setpoint moves on for the next tick
+            self.target[m] = target + self.velocity[m] * dt
+        if self.target[0] is not None and self.target[1] is not None:
+            self.mux.writeArray(self.mux.m1_speed_reg, self.block)
+        elif self.target[0] is not None:
+            self.mux.writeArray(self.mux.m1_speed_reg, self.block[0:4])
+        elif self.target[1] is not None:
+            self.mux.writeArray(self.mux.m2_speed_reg, self.block[8:12])
+        self.ticks = self.ticks + 1
+
+    ## Run a tick if its deadline has come, without blocking.
+    #  @param self The object pointer.
+    #  @return True if a tick was run.
+    def poll(self):
+        now = ticks_us()
+        if self.next_us is None:
+            self.next_us = now
+        late = ticks_diff(now, self.next_us)
+        if late < 0:
+            return False
+        if late > self.jitter_max_us:
+            self.jitter_max_us = late
+        self.jitter_sum_us = self.jitter_sum_us + late
+        period_us = self.period_ms * 1000
+        if late >= period_us:
+            # too late, skip the missed deadlines instead of catching up in a burst
+            self.overruns = self.overruns + 1
+            self.next_us = now
+        self.tick()
+        self.next_us = self.next_us + period_us
+        return True
+
+    ## Run the control loop at the fixed rate, sleeping until every deadline.
+    #  @param self The object pointer.
+    #  @param duration_ms Run time in ms, None to run until stop returns True.
+    #  @param stop Function called after every tick, the loop ends when it returns True.
+    def run(self, duration_ms = None, stop = None):
+        watch = StopWatch()
+        self.next_us = None
+        while duration_ms is None or watch.time() < duration_ms:
+            if self.poll():
+                if stop is not None and stop():
+                    break
+                continue
+            wait((ticks_diff(self.next_us, ticks_us()) + 999) // 1000)
+
+
+## PIDParams: the PID settings of a NXTMMX, registers 0x7A-0x87, read and written as one block.
+#  @code
+#  pid = mux.read_pid()
+#  pid.encoder_kp = 80
+#  mux.write_pid(pid)
+#  @endcode
+class PIDParams():
+
+    ## Field names in register order, six 16 bit gains followed by two bytes
+    FIELDS = ('encoder_kp', 'encoder_ki', 'encoder_kd', 'speed_kp', 'speed_ki', 'speed_kd', 'pass_count', 'tolerance')
+    ## Size of the register block in bytes
+    SIZE = 14
+
+    def __init__(self, encoder_kp = 0, encoder_ki = 0, encoder_kd = 0, speed_kp = 0, speed_ki = 0, speed_kd = 0, pass_count = 0, tolerance = 0):
+        self.encoder_kp = encoder_kp
+        self.encoder_ki = encoder_ki
+        self.encoder_kd = encoder_kd
+        self.speed_kp = speed_kp
+        self.speed_ki = speed_ki
+        self.speed_kd = speed_kd
+        self.pass_count = pass_count
+        self.tolerance = tolerance
+
+    ## Decode the register block.
+    #  @param data The 14 bytes read from 0x7A.
+    @staticmethod
+    def from_bytes(data):
+        return PIDParams(u16(data, 0), u16(data, 2), u16(data, 4), u16(data, 6), u16(data, 8), u16(data, 10), u8(data, 12), u8(data, 13))
+
+    ## Encode the register block, raises ValueError for values out of range.
+    #  @param self The object pointer.
+    def to_bytes(self):
+        data = bytearray(self.SIZE)
+        for i in range(len(self.FIELDS)):
+            value = getattr(self, self.FIELDS[i])
+            if i < 6:
+                if not 0 <= value <= 0xFFFF:
+                    raise ValueError("%s out of range: %d" % (self.FIELDS[i], value))
+                data[2 * i] = value & 0xFF
+                data[2 * i + 1] = value >> 8
+            else:
+                if not 0 <= value <= 0xFF:
+                    raise ValueError("%s out of range: %d" % (self.FIELDS[i], value))
+                data[6 + i] = value
+        return data
+
+    def copy(self):
+        return PIDParams.from_bytes(self.to_bytes())
+
+    def __eq__(self, other):
+        return isinstance(other, PIDParams) and self.to_bytes() == other.to_bytes()
+
+    def __repr__(self):
+        return "PIDParams(" + ", ".join(["%s = %d" % (name, getattr(self, name)) for name in self.FIELDS]) + ")"
+
+
+## StallDetector: detects stalled NXTMMX motors from their encoder speed over a time window and the overload bit.
+#  Samples both encoders and status registers in one transaction every sample_ms, a motor is stalled when it
+#  turned slower than min_speed over the last window_ms or reported overload for overload_ms.
+#  Stalled motors are stopped (brake, then float) and their angle is recorded.
+#  @code
+#  stall = StallDetector(mux)
+#  mux.motors_tank_move(30, 30)
+#  stall.watch(1)
+#  stall.watch(2)
+#  print(stall.run(timeout = 5000))
+#  @endcode
+class StallDetector():
+
+    ## Initialize the detector.
+    #  @param self The object pointer.
+    #  @param mux The NXTMMX.
+    #  @param window_ms Length of the speed window in ms.
+    #  @param min_speed Slowest speed of a running motor in degrees per second.
+    #  @param sample_ms Sampling interval in ms.
+    #  @param overload_ms Time the overload bit must stay set in ms.
+    def __init__(self, mux, window_ms = 200, min_speed = 30, sample_ms = 10, overload_ms = 100):
+        self.mux = mux
+        self.window_ms = window_ms
+        self.min_speed = min_speed
+        self.sample_ms = sample_ms
+        self.overload_ms = overload_ms
+        self.size = window_ms // sample_ms + 1
+        # sample ring: times in ms and angles of both motors
+        self.times = array('i', [0] * self.size)
+        self.angles = (array('i', [0] * self.size), array('i', [0] * self.size))
+        self.active = [False, False]
+        self.started = [0, 0]
+        self.overload_since = [None, None]
+        ## Stall angle per motor, None while not stalled
+        self.stalled = [None, None]
+        self.watch_time = StopWatch()
+        self.count = 0
+        self.next_ms = 0
+
+    ## Start watching a motor, the motor must already run.
+    #  @param self The object pointer.
+    #  @param motor Motor number, 1 or 2.
+    def watch(self, motor):
+        m = motor - 1
+        self.active[m] = True
+        self.stalled[m] = None
+        self.overload_since[m] = None
+        self.started[m] = self.watch_time.time()
+
+    ## Take a sample if it is due, without blocking.
+    #  @param self The object pointer.
+    #  @return True when no motor is watched any more.
+    def poll(self):
+        now = self.watch_time.time()
+        if now >= self.next_ms and (self.active[0] or self.active[1]):
+            self.next_ms = now + self.sample_ms
+            self.sample(now)
+        return not (self.active[0] or self.active[1])
+
+    def sample(self, now):
+        mux = self.mux
+        mux.refresh(mux.m1_read_encoder_reg, mux.m2_read_status_reg)
+        angles = (mux.readLongSigned(mux.m1_read_encoder_reg), mux.readLongSigned(mux.m2_read_encoder_reg))
+        status = (mux.readByte(mux.m1_read_status_reg), mux.readByte(mux.m2_read_status_reg))
+        mux.invalidate()
+        pos = self.count % self.size
+        self.count = self.count + 1
+        self.times[pos] = now
+        # the oldest sample of the ring, window_ms old once the ring is full
+        oldest = self.count % self.size
+        for m in range(2):
+            self.angles[m][pos] = angles[m]
+            if not self.active[m]:
+                continue
+            stalled = False
+            if status[m] & (mux.status_overload | mux.status_stalled):
+                if self.overload_since[m] is None:
+                    self.overload_since[m] = now
+                stalled = now - self.overload_since[m] >= self.overload_ms
+            else:
+                self.overload_since[m] = None
+            then = self.times[oldest]
+            if self.count >= self.size and then >= self.started[m]:
+                stalled = stalled or abs(angles[m] - self.angles[m][oldest]) * 1000 < self.min_speed * (now - then)
+            if stalled:
+                self.stop(m + 1, angles[m])
+
+    def stop(self, motor, angle):
+        if motor == 1:
+            self.mux.motor1_brake()
+            self.mux.motor1_stop()
+        else:
+            self.mux.motor2_brake()
+            self.mux.motor2_stop()
+        self.active[motor - 1] = False
+        self.stalled[motor - 1] = angle
+
+    ## Sample at the fixed rate until all watched motors stalled.
+    #  @param self The object pointer.
+    #  @param timeout Time in ms after which watched motors are stopped anyway, None waits forever.
+    #  @return Stall angles [motor 1, motor 2], None for motors that did not stall.
+    def run(self, timeout = None):
+        start = self.watch_time.time()
+        while not self.poll():
+            now = self.watch_time.time()
+            if timeout is not None and now - start >= timeout:
+                for m in range(2):
+                    if self.active[m]:
+                        if m == 0: self.mux.motor1_stop()
+                        else: self.mux.motor2_stop()
+                        self.active[m] = False
+                break
+            wait(max(self.next_ms - now, 1))
+        return self.stalled
 
 
 ## NXTMMX: this class provides functions for NXTMMX.
@@ -473,11 +1138,27 @@ class NXTMMX(i2c):
     ## Voltage register for EV3
     voltage_reg = 0x90
 
+    ## Status register bits
+    status_speed_control = 0x01
+    status_ramping = 0x02
+    status_powered = 0x04
+    status_position_control = 0x08
+    status_brake = 0x10
+    status_overload = 0x20
+    status_timed = 0x40
+    status_stalled = 0x80
+
+    ## Lifetime of the status snapshot in ms
+    status_max_age = 5
+
     ## Initialize the class with the i2c address of your NXTMMX.
     #  @param self The object pointer.
     #  @param port Port where NXTMMX is connected.
     #  @param i2c_address Address of your NXTMMX.
     def __init__(self, port, i2c_address = 0x06):
+        self.status_watch = StopWatch()
+        self.status_ms = None
+        self.controller = None
         i2c.__init__(self, port, i2c_address) 
 
     ## Changes i2c address of your LED Matrix.
@@ -517,31 +1198,91 @@ class NXTMMX(i2c):
         m2 = str(go)+str(timed_control)+str(encoder_feedback)+str(brake_float)+str(encoder_control)+str(relative_change)+str(ramp)+str(speed_control)      
         self.writeByte(self.m2_command_reg_A, int(m2, 2).to_bytes((len(m2) + 7) // 8, 'little'))
 
-    ## Motor 1 status register reader.
+    ## Read both status (0x72-0x73) and both tasks registers (0x76-0x77) in one transaction.
+    #  The snapshot is reused by all status queries for status_max_age ms and dropped by any write.
+    #  @param self The object pointer.
+    #  @param max_age Oldest acceptable snapshot in ms, None for status_max_age, 0 always reads.
+    def read_status(self, max_age = None):
+        if max_age is None:
+            max_age = self.status_max_age
+        if self.status_ms is not None and self.status_watch.time() - self.status_ms < max_age:
+            return
+        if self.shadow_start <= self.m2_read_tasks_reg and self.shadow_end >= self.m1_read_status_reg:
+            self.invalidate()
+        self._fetch(self.m1_read_status_reg, self.m2_read_tasks_reg - self.m1_read_status_reg + 1)
+        self.status_ms = self.status_watch.time()
+
+    ## Drop the register snapshots, called on every write.
     #  @param self The object pointer.
+    def invalidate(self):
+        i2c.invalidate(self)
+        self.status_ms = None
+
+    ## Returns the status register of Motor 1 as bitfield, test it with the status_* masks.
+    #  @param self The object pointer.
+    #  @param max_age Oldest acceptable snapshot in ms, see read_status().
+    def motor1_get_status(self, max_age = None):
+        self.read_status(max_age)
+        return self.shadow[self.m1_read_status_reg]
+
+    ## Returns the status register of Motor 2 as bitfield, test it with the status_* masks.
+    #  @param self The object pointer.
+    #  @param max_age Oldest acceptable snapshot in ms, see read_status().
+    def motor2_get_status(self, max_age = None):
+        self.read_status(max_age)
+        return self.shadow[self.m2_read_status_reg]
+
+    ## Returns the tasks register of Motor 1.
+    #  @param self The object pointer.
+    #  @param max_age Oldest acceptable snapshot in ms, see read_status().
+    def motor1_get_tasks(self, max_age = None):
+        self.read_status(max_age)
+        return self.shadow[self.m1_read_tasks_reg]
+
+    ## Returns the tasks register of Motor 2.
+    #  @param self The object pointer.
+    #  @param max_age Oldest acceptable snapshot in ms, see read_status().
+    def motor2_get_tasks(self, max_age = None):
+        self.read_status(max_age)
+        return self.shadow[self.m2_read_tasks_reg]
+
+    ## Converts a status bitfield to the list returned by get_m1_status, stalled bit first.
+    #  @param self The object pointer.
+    #  @param status Status register value.
     #  @param print_it Bool for detailed status register information
-    def get_m1_status(self, print_it = 0):
-        result = [eval(i) for i in list("{:08b}".format(self.readByte(self.m1_read_status_reg)))]
+    def status_list(self, status, print_it = 0):
+        result = [(status >> bit) & 1 for bit in range(7, -1, -1)]
         if print_it == 1:
             print("--------------")
             text = ["Motor is stalled:","Motor is in timed mode:","Motor is overloaded:","Motor is in brake mode:","Positional Control is ON:","Motor is powered:","Motor is ramping:","Speed Control is ON:"]
             for i in range(len(result)):
                 print(text[i]," ", result[i])
             print("--------------")
-        return result 
+        return result
+
+    ## Motor 1 status register reader.
+    #  @param self The object pointer.
+    #  @param print_it Bool for detailed status register information
+    def get_m1_status(self, print_it = 0):
+        return self.status_list(self.motor1_get_status(), print_it)
 
     ## Motor 2 status register reader.
     #  @param self The object pointer.
     #  @param print_it Bool for detailed status register information
     def get_m2_status(self, print_it = 0):
-        result = [eval(i) for i in list("{:08b}".format(self.readByte(self.m2_read_status_reg)))]
-        if print_it == 1:
-            print("--------------")
-            text = ["Motor is stalled:","Motor is in timed mode:","Motor is overloaded:","Motor is in brake mode:","Positional Control is ON:","Motor is powered:","Motor is ramping:","Speed Control is ON:"]
-            for i in range(len(result)):
-                print(text[i]," ", result[i])
-            print("--------------")
-        return result 
+        return self.status_list(self.motor2_get_status(), print_it)
+
+    ## Reads all PID settings (0x7A-0x87) in one transaction.
+    #  @param self The object pointer.
+    #  @return PIDParams
+    def read_pid(self):
+        return PIDParams.from_bytes(self.readArray(self.kP_encoder_reg, PIDParams.SIZE))
+
+    ## Writes all PID settings (0x7A-0x87) in one transaction.
+    #  @param self The object pointer.
+    #  @param params PIDParams to write.
+    def write_pid(self, params):
+        self.writeArray(self.kP_encoder_reg, params.to_bytes())
 
     ## Resets all encoder values to 0.
     #  @param self The object pointer.
@@ -638,182 +1379,335 @@ class NXTMMX(i2c):
         self.writeByte(self.m2_speed_reg, speed.to_bytes(2, 'little'))
         self.m2_send(go = 1)
     
+    ## Writes the parameter blocks of both motors (0x42-0x51) in one transaction and starts them together with 'S'.
+    #  @param self The object pointer.
+    #  @param target_m1 Encoder target of Motor 1.
+    #  @param speed_m1 The speed of the Motor 1.
+    #  @param target_m2 Encoder target of Motor 2.
+    #  @param speed_m2 The speed of the Motor 2.
+    #  @param command_A Command register A value of both motors, without go bit.
+    def motors_send(self, target_m1, speed_m1, target_m2, speed_m2, command_A):
+        block = bytearray(self.m2_command_reg_A - self.m1_encoder_reg + 1)
+        for base, target, speed in ((0, target_m1, speed_m1), (self.m2_encoder_reg - self.m1_encoder_reg, target_m2, speed_m2)):
+            target = target & 0xFFFFFFFF
+            block[base] = target & 0xFF
+            block[base + 1] = (target >> 8) & 0xFF
+            block[base + 2] = (target >> 16) & 0xFF
+            block[base + 3] = (target >> 24) & 0xFF
+            block[base + 4] = speed & 0xFF
+            block[base + 7] = command_A
+        self.writeArray(self.m1_encoder_reg, block)
+        self.issue_command_to_both_motors()
+
     ## Starts unlimited run for both Motors.
     #  @param self The object pointer.
     #  @param speed_m1 The speed of the Motor 1.
     #  @param speed_m2 The speed of the Motor 2.
     def motors_tank_move(self, speed_m1, speed_m2): 
-        self.writeByte(self.m1_speed_reg, speed_m1.to_bytes(2, 'little'))
-        self.writeByte(self.m2_speed_reg, speed_m2.to_bytes(2, 'little'))
-        self.issue_command_to_both_motors()
+        self.motors_send(0, speed_m1, 0, speed_m2, self.status_speed_control)
 
-    def motors_steering_move(self, speed_m1, speed_m2): #TODO
-        pass
+    ## Starts unlimited run for both Motors, steering like the EV3 Move Steering block.
+    #  @param self The object pointer.
+    #  @param speed The speed of the faster Motor.
+    #  @param steering -100 (turn on the spot towards Motor 1) .. 0 (straight) .. 100 (turn on the spot towards Motor 2).
+    def motors_steering_move(self, speed, steering):
+        steering = min(max(steering, -100), 100)
+        inner = speed * (50 - abs(steering)) // 50
+        if steering >= 0:
+            self.motors_tank_move(speed, inner)
+        else:
+            self.motors_tank_move(inner, speed)
+
+    ## Runs both Motors from their current angles to encoder targets so that they arrive at the same time.
+    #  The Motor with the longer way runs at speed, the other one proportionally slower.
+    #  @param self The object pointer.
+    #  @param speed The speed of the Motor with the longer way.
+    #  @param target_m1 The angle to which Motor 1 should turn.
+    #  @param target_m2 The angle to which Motor 2 should turn.
+    #  @param angle_m1 The current angle of Motor 1.
+    #  @param angle_m2 The current angle of Motor 2.
+    #  @param wait Should the function wait for completion?
+    #  @param timeout Time in ms after which the move is given up and the motors stopped, None waits forever.
+    #  @param brake Brake at the targets instead of floating.
+    #  @return MotorPairMove handle of the move.
+    def motors_sync_move(self, speed, target_m1, target_m2, angle_m1, angle_m2, wait = True, timeout = None, brake = False):
+        distance_m1 = abs(target_m1 - angle_m1)
+        distance_m2 = abs(target_m2 - angle_m2)
+        longest = max(distance_m1, distance_m2, 1)
+        speed = abs(speed)
+        speed_m1 = (speed * distance_m1 + longest // 2) // longest
+        speed_m2 = (speed * distance_m2 + longest // 2) // longest
+        if distance_m1 and not speed_m1: speed_m1 = 1
+        if distance_m2 and not speed_m2: speed_m2 = 1
+        command_A = self.status_speed_control | self.status_position_control
+        if brake: command_A = command_A | self.status_brake
+        self.motors_send(target_m1, speed_m1, target_m2, speed_m2, command_A)
+        move = MotorPairMove(MotorMove(self, 1, self.status_position_control, speed_m1, target = target_m1, timeout = timeout),
+                             MotorMove(self, 2, self.status_position_control, speed_m2, target = target_m2, timeout = timeout))
+        if wait:
+            move.wait()
+        return move
+
+    ## Reads the angles of both Motors in one transaction.
+    #  @param self The object pointer.
+    #  @return (angle of Motor 1, angle of Motor 2)
+    def motors_get_angle(self):
+        self.refresh(self.m1_read_encoder_reg, self.m2_read_encoder_reg + 3)
+        angles = (self.readLongSigned(self.m1_read_encoder_reg), self.readLongSigned(self.m2_read_encoder_reg))
+        self.invalidate()
+        return angles
+
+    ## Runs both Motors to encoder targets so that they arrive at the same time, see motors_sync_move().
+    #  @param self The object pointer.
+    #  @param speed The speed of the Motor with the longer way.
+    #  @param target_m1 The angle to which Motor 1 should turn.
+    #  @param target_m2 The angle to which Motor 2 should turn.
+    #  @param wait Should the function wait for completion?
+    #  @param timeout Time in ms after which the move is given up and the motors stopped, None waits forever.
+    #  @param brake Brake at the targets instead of floating.
+    #  @return MotorPairMove handle of the move.
+    def motors_run_target(self, speed, target_m1, target_m2, wait = True, timeout = None, brake = False):
+        angle_m1, angle_m2 = self.motors_get_angle()
+        return self.motors_sync_move(speed, target_m1, target_m2, angle_m1, angle_m2, wait, timeout, brake)
+
+    ## Turns both Motors by angles so that they arrive at the same time, see motors_sync_move().
+    #  @param self The object pointer.
+    #  @param speed The speed of the Motor with the longer way.
+    #  @param angle_m1 The angle for which Motor 1 should turn.
+    #  @param angle_m2 The angle for which Motor 2 should turn.
+    #  @param wait Should the function wait for completion?
+    #  @param timeout Time in ms after which the move is given up and the motors stopped, None waits forever.
+    #  @param brake Brake at the targets instead of floating.
+    #  @return MotorPairMove handle of the move.
+    def motors_run_angle(self, speed, angle_m1, angle_m2, wait = True, timeout = None, brake = False):
+        start_m1, start_m2 = self.motors_get_angle()
+        return self.motors_sync_move(speed, start_m1 + angle_m1, start_m2 + angle_m2, start_m1, start_m2, wait, timeout, brake)
 
     ## Starts timed run for Motor 1.
     #  @param self The object pointer.
     #  @param speed The speed of the Motor 1.
     #  @param run_time The time for which motor should run in seconds.
     #  @param wait Should the function wait for completion?
-    def motor1_run_time(self, speed, run_time, wait = True):
+    #  @param timeout Time in ms after which the move is given up and the motor stopped, None waits forever.
+    #  @return MotorMove handle of the move.
+    def motor1_run_time(self, speed, run_time, wait = True, timeout = None):
         self.writeByte(self.m1_speed_reg, speed.to_bytes(2, 'little'))
         self.writeByte(self.m1_time_reg, run_time.to_bytes(2, 'little'))
-        self.m1_send(timed_control = 1, go = 1)  
+        self.m1_send(timed_control = 1, go = 1)
+        move = MotorMove(self, 1, self.status_timed, speed, run_ms = run_time * 1000, timeout = timeout)
         if wait:
-            while True:
-                if self.get_m1_status()[1] == 0:
-                    break     
+            move.wait()
+        return move
 
     ## Starts timed run for Motor 2.
     #  @param self The object pointer.
     #  @param speed The speed of the Motor 2.
     #  @param run_time The time for which motor should run in seconds.
     #  @param wait Should the function wait for completion?
-    def motor2_run_time(self, speed, run_time, wait = True):
+    #  @param timeout Time in ms after which the move is given up and the motor stopped, None waits forever.
+    #  @return MotorMove handle of the move.
+    def motor2_run_time(self, speed, run_time, wait = True, timeout = None):
         self.writeByte(self.m2_speed_reg, speed.to_bytes(2, 'little'))
         self.writeByte(self.m2_time_reg, run_time.to_bytes(2, 'little'))
         self.m2_send(timed_control = 1, go = 1)
+        move = MotorMove(self, 2, self.status_timed, speed, run_ms = run_time * 1000, timeout = timeout)
         if wait:
-            while True:
-                if self.get_m2_status()[1] == 0:
-                    break
+            move.wait()
+        return move
     
     ## Starts encoder angled run for Motor 1.
     #  @param self The object pointer.
     #  @param speed The speed of the Motor 1.
     #  @param rotation_angle The angle for which should motor turn.
     #  @param wait Should the function wait for completion?
-    def motor1_run_angle(self, speed, rotation_angle, wait = True): # negative speed doesn't change anything
+    #  @param timeout Time in ms after which the move is given up and the motor stopped, None waits forever.
+    #  @return MotorMove handle of the move.
+    def motor1_run_angle(self, speed, rotation_angle, wait = True, timeout = None): # negative speed doesn't change anything
         self.writeByte(self.m1_speed_reg, speed.to_bytes(2, 'little'))
-        self.writeArray(self.m1_encoder_reg, ((rotation_angle + self.motor1_get_angle()) & 0xFFFFFFFF).to_bytes(4, 'little'))
+        target = rotation_angle + self.motor1_get_angle()
+        self.writeArray(self.m1_encoder_reg, (target & 0xFFFFFFFF).to_bytes(4, 'little'))
         self.m1_send(encoder_control = 1, go = 1)
+        move = MotorMove(self, 1, self.status_position_control, speed, target = target, timeout = timeout)
         if wait:
-            while True:
-                if self.get_m1_status()[4] == 0:
-                    break
+            move.wait()
+        return move
 
     ## Starts encoder angled run for Motor 2.
     #  @param self The object pointer.
     #  @param speed The speed of the Motor 2.
     #  @param rotation_angle The angle for which should motor turn.
-    #  @param wait Should the function wait for completion?        
-    def motor2_run_angle(self, speed, rotation_angle, wait = True): # negative speed doesn't change anything
+    #  @param wait Should the function wait for completion?
+    #  @param timeout Time in ms after which the move is given up and the motor stopped, None waits forever.
+    #  @return MotorMove handle of the move.
+    def motor2_run_angle(self, speed, rotation_angle, wait = True, timeout = None): # negative speed doesn't change anything
         self.writeByte(self.m2_speed_reg, speed.to_bytes(2, 'little'))
-        self.writeArray(self.m2_encoder_reg, ((rotation_angle + self.motor2_get_angle()) & 0xFFFFFFFF).to_bytes(4, 'little'))
+        target = rotation_angle + self.motor2_get_angle()
+        self.writeArray(self.m2_encoder_reg, (target & 0xFFFFFFFF).to_bytes(4, 'little'))
         self.m2_send(encoder_control = 1, go = 1)
+        move = MotorMove(self, 2, self.status_position_control, speed, target = target, timeout = timeout)
         if wait:
-            while True:
-                if self.get_m2_status()[4] == 0:
-                    break
+            move.wait()
+        return move
 
     ## Starts encoder angled full rotation run for Motor 1.
     #  @param self The object pointer.
     #  @param speed The speed of the Motor 1.
     #  @param rotation_count The of full rotations for which should motor turn.
     #  @param wait Should the function wait for completion?
-    def motor1_run_rotation(self, speed, rotation_count, wait = True): # negative speed doesn't change anything
+    #  @param timeout Time in ms after which the move is given up and the motor stopped, None waits forever.
+    #  @return MotorMove handle of the move.
+    def motor1_run_rotation(self, speed, rotation_count, wait = True, timeout = None): # negative speed doesn't change anything
         self.writeByte(self.m1_speed_reg, speed.to_bytes(2, 'little'))
-        self.writeArray(self.m1_encoder_reg, (((360 * rotation_count) + self.motor1_get_angle()) & 0xFFFFFFFF).to_bytes(4, 'little'))
+        target = (360 * rotation_count) + self.motor1_get_angle()
+        self.writeArray(self.m1_encoder_reg, (target & 0xFFFFFFFF).to_bytes(4, 'little'))
         self.m1_send(encoder_control = 1, go = 1)
+        move = MotorMove(self, 1, self.status_position_control, speed, target = target, timeout = timeout)
         if wait:
-            while True:
-                if self.get_m1_status()[4] == 0:
-                    break
+            move.wait()
+        return move
 
     ## Starts encoder angled full rotation run for Motor 2.
     #  @param self The object pointer.
     #  @param speed The speed of the Motor 2.
     #  @param rotation_count The of full rotations for which should motor turn.
-    #  @param wait Should the function wait for completion?        
-    def motor2_run_rotation(self, speed, rotation_count, wait = True): # negative speed doesn't change anything
+    #  @param wait Should the function wait for completion?
+    #  @param timeout Time in ms after which the move is given up and the motor stopped, None waits forever.
+    #  @return MotorMove handle of the move.
+    def motor2_run_rotation(self, speed, rotation_count, wait = True, timeout = None): # negative speed doesn't change anything
         self.writeByte(self.m2_speed_reg, speed.to_bytes(2, 'little'))
-        self.writeArray(self.m2_encoder_reg, (((360 * rotation_count) + self.motor2_get_angle()) & 0xFFFFFFFF).to_bytes(4, 'little'))
+        target = (360 * rotation_count) + self.motor2_get_angle()
+        self.writeArray(self.m2_encoder_reg, (target & 0xFFFFFFFF).to_bytes(4, 'little'))
         self.m2_send(encoder_control = 1, go = 1)
+        move = MotorMove(self, 2, self.status_position_control, speed, target = target, timeout = timeout)
         if wait:
-            while True:
-                if self.get_m2_status()[4] == 0:
-                    break
+            move.wait()
+        return move
 
     ## Starts absolute encoder angled run for Motor 1.
     #  @param self The object pointer.
     #  @param speed The speed of the Motor 1.
     #  @param target_angle The angle to which should motor turn.
     #  @param wait Should the function wait for completion?
-    def motor1_run_target(self, speed, target_angle, wait = True): # negative speed doesn't change anything
+    #  @param timeout Time in ms after which the move is given up and the motor stopped, None waits forever.
+    #  @return MotorMove handle of the move.
+    def motor1_run_target(self, speed, target_angle, wait = True, timeout = None): # negative speed doesn't change anything
         self.writeByte(self.m1_speed_reg, speed.to_bytes(2, 'little'))
         self.writeArray(self.m1_encoder_reg, ((target_angle) & 0xFFFFFFFF).to_bytes(4, 'little'))
         self.m1_send(encoder_control = 1, go = 1)
+        move = MotorMove(self, 1, self.status_position_control, speed, target = target_angle, timeout = timeout)
         if wait:
-            while True:
-                if self.get_m1_status()[4] == 0:
-                    break
+            move.wait()
+        return move
     
     ## Starts absolute encoder angled run for Motor 2.
     #  @param self The object pointer.
     #  @param speed The speed of the Motor 2.
     #  @param target_angle The angle to which should motor turn.
     #  @param wait Should the function wait for completion?
-    def motor2_run_target(self, speed, target_angle, wait = True): # negative speed doesn't change anything
+    #  @param timeout Time in ms after which the move is given up and the motor stopped, None waits forever.
+    #  @return MotorMove handle of the move.
+    def motor2_run_target(self, speed, target_angle, wait = True, timeout = None): # negative speed doesn't change anything
         self.writeByte(self.m2_speed_reg, speed.to_bytes(2, 'little'))
         self.writeArray(self.m2_encoder_reg, ((target_angle) & 0xFFFFFFFF).to_bytes(4, 'little'))
         self.m2_send(encoder_control = 1, go = 1)
+        move = MotorMove(self, 2, self.status_position_control, speed, target = target_angle, timeout = timeout)
         if wait:
-            while True:
-                if self.get_m2_status()[4] == 0:
-                    break
+            move.wait()
+        return move
 
     ## Starts Motor 1 untill the motor is stalled.
     #  @param self The object pointer.
     #  @param speed The speed of the Motor 1.
-    #  @param threshold The threshold count on which the motor should stop.
-    def motor1_run_until_stalled(self, speed, threshold = 30):
-        self.writeByte(self.m1_speed_reg, speed.to_bytes(2, 'little'))
-        self.m1_send(go = 1)
-        overload = 0
-        while True:
-            if self.get_m1_status()[2] == 1:
-                overload = overload + 1
-                if overload > threshold:
-                    self.motor1_brake()
-                    print("Motor 1 overloaded!")
-                    self.motor1_stop()
-                    break
-            else:
-                overload = 0
+    #  @param threshold Number of overloaded status samples (10 ms apart) after which the motor counts as stalled, None for 100 ms.
+    #  @param window The time in ms over which the motor must turn slower than min_speed.
+    #  @param min_speed Slowest speed of a running motor in degrees per second.
+    #  @param timeout Time in ms after which the motor is stopped anyway, None waits forever.
+    #  @return Angle of Motor 1 where it stalled, None on timeout.
+    def motor1_run_until_stalled(self, speed, threshold = None, *, window = 200, min_speed = 30, timeout = None):
+        return self.motors_run_until_stalled(speed, None, window, min_speed, timeout, threshold)[0]
     
     ## Starts Motor 2 untill the motor is stalled.
     #  @param self The object pointer.
     #  @param speed The speed of the Motor 2.
-    #  @param threshold The threshold count on which the motor should stop.
-    def motor2_run_until_stalled(self, speed, threshold = 30):
-        self.writeByte(self.m2_speed_reg, speed.to_bytes(2, 'little'))
-        self.m2_send(go = 1)
-        overload = 0
-        while True:
-            if self.get_m2_status()[2] == 1:
-                overload = overload + 1
-                if overload > threshold:
-                    self.motor2_brake()
-                    print("Motor 2 overloaded!")
-                    self.motor2_stop()
-                    break
-            else:
-                overload = 0
+    #  @param threshold Number of overloaded status samples (10 ms apart) after which the motor counts as stalled, None for 100 ms.
+    #  @param window The time in ms over which the motor must turn slower than min_speed.
+    #  @param min_speed Slowest speed of a running motor in degrees per second.
+    #  @param timeout Time in ms after which the motor is stopped anyway, None waits forever.
+    #  @return Angle of Motor 2 where it stalled, None on timeout.
+    def motor2_run_until_stalled(self, speed, threshold = None, *, window = 200, min_speed = 30, timeout = None):
+        return self.motors_run_until_stalled(None, speed, window, min_speed, timeout, threshold)[1]
+
+    ## Starts both Motors, each one runs until it is stalled.
+    #  @param self The object pointer.
+    #  @param speed_m1 The speed of the Motor 1, None leaves Motor 1 alone.
+    #  @param speed_m2 The speed of the Motor 2, None leaves Motor 2 alone.
+    #  @param window The time in ms over which a motor must turn slower than min_speed.
+    #  @param min_speed Slowest speed of a running motor in degrees per second.
+    #  @param timeout Time in ms after which the motors are stopped anyway, None waits forever.
+    #  @param threshold Number of overloaded status samples (10 ms apart) after which a motor counts as stalled, None for 100 ms.
+    #  @return Stall angles [motor 1, motor 2], None for motors that did not stall.
+    def motors_run_until_stalled(self, speed_m1, speed_m2, window = 200, min_speed = 30, timeout = None, threshold = None):
+        detector = StallDetector(self, window, min_speed)
+        if threshold is not None:
+            detector.overload_ms = threshold * detector.sample_ms
+        if speed_m1 is not None:
+            self.writeArray(self.m1_speed_reg, bytes((speed_m1 & 0xFF, 0, 0, self.status_speed_control | 0x80)))
+            detector.watch(1)
+        if speed_m2 is not None:
+            self.writeArray(self.m2_speed_reg, bytes((speed_m2 & 0xFF, 0, 0, self.status_speed_control | 0x80)))
+            detector.watch(2)
+        return detector.run(timeout)
+
+    ## Runs Motor 1 with fixed power, without speed regulation. Ends host side control of Motor 1.
+    #  @param self The object pointer.
+    #  @param dc Power -100..100.
+    def motor1_dc(self, dc):
+        if self.controller is not None:
+            self.controller.release(1)
+        self.writeArray(self.m1_speed_reg, bytes((dc & 0xFF, 0, 0, 0x80)))
 
-    def motor1_dc(self, dc): #TODO advanced future
-        pass
-    
-    def motor2_dc(self, dc): #TODO advanced future
-        pass
+    ## Runs Motor 2 with fixed power, without speed regulation. Ends host side control of Motor 2.
+    #  @param self The object pointer.
+    #  @param dc Power -100..100.
+    def motor2_dc(self, dc):
+        if self.controller is not None:
+            self.controller.release(2)
+        self.writeArray(self.m2_speed_reg, bytes((dc & 0xFF, 0, 0, 0x80)))
 
-    def motor1_track_target(self, target_angle): #TODO advanced future
-        pass
-    
-    def motor2_track_target(self, target_angle): #TODO advanced future
-        pass
+    ## Returns the host side MotorControl of this NXTMMX, creating it on first use.
+    #  @param self The object pointer.
+    #  @param period_ms Control period in ms, used when the controller is created.
+    def motor_controller(self, period_ms = 10):
+        if self.controller is None:
+            self.controller = MotorControl(self, period_ms)
+        return self.controller
+
+    ## Lets Motor 1 track a target angle under host side control, see motor1_control().
+    #  @param self The object pointer.
+    #  @param target_angle The setpoint.
+    #  @param velocity Setpoint velocity in degrees per second, the setpoint moves on by itself.
+    def motor1_track_target(self, target_angle, velocity = 0):
+        self.motor_controller().track(1, target_angle, velocity)
+
+    ## Lets Motor 2 track a target angle under host side control, see motor2_control().
+    #  @param self The object pointer.
+    #  @param target_angle The setpoint.
+    #  @param velocity Setpoint velocity in degrees per second, the setpoint moves on by itself.
+    def motor2_track_target(self, target_angle, velocity = 0):
+        self.motor_controller().track(2, target_angle, velocity)
 
-    def motor1_control(self): #TODO advanced future
-        pass
+    ## Runs a control tick when it is due, call it often from your main loop.
+    #  @param self The object pointer.
+    #  @return Control error of Motor 1 in degrees.
+    def motor1_control(self):
+        ctl = self.motor_controller()
+        ctl.poll()
+        return ctl.error[0]
     
-    def motor2_control(self):  #TODO advanced future
-        pass
\ No newline at end of file
+    ## Runs a control tick when it is due, call it often from your main loop.
+    #  @param self The object pointer.
+    #  @return Control error of Motor 2 in degrees.
+    def motor2_control(self):
+        ctl = self.motor_controller()
+        ctl.poll()
+        return ctl.error[1]
\ No newline at end of file
@@ -0,0 +1,300 @@
+#!/usr/bin/env pybricks-micropython
+
+# Benchmarks for the driver helpers. Everything here runs on the EV3 as well
+# as on a plain Linux python, no sensor has to be connected. replayBench()
+# needs imu_replay.csv next to this file.
+
+import gc
+import time
+
+from i2c_decode import FORMATS, SIZES, compile_format
+from tft_encode import CommandEncoder, Palette, rgb565
+from lineestimate import LineEstimator, SCALE
+from imufusion import ComplementaryFilter, MahonyFilter, GYRO_UDPS, replay, wrap_cd
+from mindsensorsPYB import IMUSAMPLE
+
+
+## ticks in microseconds on MicroPython and CPython
+def ticks_us():
+    try:
+        return time.ticks_us()
+    except AttributeError:
+        return int(time.perf_counter() * 1000000)
+
+## Bytes allocated on the MicroPython heap by fn(), None where gc.mem_alloc is not available (CPython)
+def allocated(fn):
+    if not hasattr(gc, 'mem_alloc'):
+        return None
+    gc.collect()
+    gc.disable()
+    before = gc.mem_alloc()
+    fn()
+    size = gc.mem_alloc() - before
+    gc.enable()
+    return size
+
+
+## FakeI2CDevice: register file with the pybricks I2CDevice read/write interface
+class FakeI2CDevice():
+
+    def __init__(self, port = None, address = 0):
+        self.regs = bytearray(256)
+        self.reads = 0
+
+    def read(self, reg, length):
+        self.reads = self.reads + 1
+        return bytes(self.regs[reg:reg + length])
+
+    def write(self, reg, data = None):
+        if data is None:
+            return
+        data = bytes([data]) if isinstance(data, int) else bytes(data)
+        self.regs[reg:reg + len(data)] = data
+
+
+## Decoding the way the drivers did before i2c_decode: one read and a new int per call
+def legacy_readIntegerSigned(dev, reg):
+    results = dev.read(reg, 2)
+    a = results[0] + (results[1]<<8)
+    if a&0x8000 : a = a -65535
+    return a
+
+
+## Checks every i2c_decode format against the struct module and times 16 bit signed reads.
+#  @param loops Number of decoded values per timing run.
+def decodeBench(loops = 2000):
+    import struct
+    dev = FakeI2CDevice()
+    for i in range(256):
+        dev.regs[i] = (i * 37 + 11) & 0xFF
+
+    errors = 0
+    for fmt in FORMATS:
+        decoder = compile_format(fmt)
+        for reg in range(0, 256 - SIZES[decoder]):
+            if decoder(dev.regs, reg) != struct.unpack_from(fmt, dev.regs, reg)[0]:
+                errors = errors + 1
+    print("decode errors:", errors)
+
+    buf = bytearray(256)
+    decoder = compile_format('<h')
+
+    def legacy():
+        for i in range(loops):
+            legacy_readIntegerSigned(dev, 0x45)
+
+    def decoded():
+        buf[0x42:0x59] = dev.read(0x42, 0x17)
+        for i in range(loops):
+            decoder(buf, 0x45)
+
+    for name, fn in (("legacy", legacy), ("i2c_decode", decoded)):
+        dev.reads = 0
+        start = ticks_us()
+        fn()
+        elapsed = ticks_us() - start
+        reads = dev.reads
+        heap = allocated(fn)
+        print("%-10s %6d us  %5d reads  heap: %s" % (name, elapsed, reads, "n/a" if heap is None else "%d bytes" % heap))
+    return errors
+
+
+## TFTPack encoding the way TFTPACK did before tft_encode: float color math and to_bytes concatenation
+def legacy_rgb_hex565(RGB):
+    return( ((int(RGB[0] / 255 * 31) << 11) | (int(RGB[1] / 255 * 63) << 5) | (int(RGB[2] / 255 * 31))))
+
+def legacy_draw_line(start, end, RGB):
+    return b'\x01' + b'\x0C'+start[0].to_bytes(2, 'little')+start[1].to_bytes(2, 'little')+end[0].to_bytes(2, 'little')+end[1].to_bytes(2, 'little')+legacy_rgb_hex565(RGB).to_bytes(2, 'little')
+
+
+## Checks rgb565 and the command encoder against the legacy encoding and times draw_line commands.
+#  @param loops Number of encoded commands per timing run.
+def tftBench(loops = 500):
+    errors = 0
+    for v in range(256):
+        if rgb565((v, v, v)) != legacy_rgb_hex565((v, v, v)):
+            errors = errors + 1
+    encoder = CommandEncoder(Palette(8))
+    colors = [[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 255]]
+    for i in range(64):
+        start, end, RGB = [i, 2 * i], [3 * i, 239 - i], colors[i % 4]
+        if bytes(encoder.draw_line(start, end, RGB)) != legacy_draw_line(start, end, RGB):
+            errors = errors + 1
+    print("encode errors:", errors)
+
+    out = bytearray(12 * loops)
+    start = [10, 20]
+    end = [100, 200]
+
+    def legacy():
+        pos = 0
+        for i in range(loops):
+            out[pos:pos + 12] = legacy_draw_line(start, end, colors[i & 3])
+            pos = pos + 12
+
+    def encoded():
+        pos = 0
+        for i in range(loops):
+            out[pos:pos + 12] = encoder.draw_line(start, end, colors[i & 3])
+            pos = pos + 12
+
+    for name, fn in (("legacy", legacy), ("tft_encode", encoded)):
+        begin = ticks_us()
+        fn()
+        elapsed = ticks_us() - begin
+        heap = allocated(fn)
+        print("%-10s %6d us  heap: %s" % (name, elapsed, "n/a" if heap is None else "%d bytes/command" % (heap // loops)))
+    print("palette hits: %d  misses: %d" % (encoder.palette.hits, encoder.palette.misses))
+    return errors
+
+
+## Checks LineEstimator on a line swept under the sensors and times estimate().
+#  @param loops Number of estimates per timing run.
+def lineBench(loops = 1000):
+    line = LineEstimator()
+    errors = 0
+    values = bytearray(8)
+    # a 1.5 sensor wide dark line moved in steps of 1/10 sensor
+    for step in range(0, 71):
+        center = step * SCALE // 10
+        for i in range(8):
+            distance = abs(i * SCALE - center)
+            values[i] = 100 - max(0, 90 - 90 * distance // (3 * SCALE // 2))
+        position = line.estimate(values)
+        if position is None or abs(position - (center - 7 * SCALE // 2)) > SCALE // 4:
+            errors = errors + 1
+    if line.estimate(bytes([100] * 8)) is not None or not line.lost:
+        errors = errors + 1
+    line.estimate(bytes([5] * 8))
+    if not line.intersection:
+        errors = errors + 1
+    print("line errors:", errors)
+
+    values = bytes([100, 100, 90, 20, 10, 80, 100, 100])
+    def estimates():
+        for i in range(loops):
+            line.estimate(values)
+    start = ticks_us()
+    estimates()
+    elapsed = ticks_us() - start
+    heap = allocated(estimates)
+    print("%-10s %6d us/estimate  heap: %s" % ("line", elapsed // loops, "n/a" if heap is None else "%d bytes" % heap))
+    return errors
+
+
+## Samples of a sensor held at roll 30, pitch -20 degrees while turning at 20 degrees per second, 100 Hz
+def imu_samples(count):
+    samples = []
+    heading = 0
+    for i in range(count):
+        s = IMUSAMPLE()
+        s.timestamp = i * 10000
+        # gravity of roll 30, pitch -20: (-sin p, sin r cos p, cos r cos p) * 1000
+        s.accel[0] = 342
+        s.accel[1] = 470
+        s.accel[2] = 814
+        # the turn seen in body axes: -20 deg/s about the vertical
+        s.gyro[0] = -6840000 // GYRO_UDPS
+        s.gyro[1] = -9400000 // GYRO_UDPS
+        s.gyro[2] = -16280000 // GYRO_UDPS
+        s.heading = i * 20 // 100 % 360
+        s.valid = True
+        samples.append(s)
+    return samples
+
+## Accuracy against a known attitude and update rate of the attitude filters.
+#  @param loops Updates timed per filter.
+def fusionBench(loops = 500):
+    samples = imu_samples(loops)
+    errors = 0
+    # the complementary filter does not rotate the gyro rates into angle rates, a steady turn biases it
+    for f, tolerance in ((ComplementaryFilter(), 500), (MahonyFilter(), 100)):
+        for s in samples:
+            f.update(s)
+        if (abs(f.roll - 3000) > tolerance or abs(f.pitch + 2000) > tolerance or
+                abs(f.yaw - samples[-1].heading * 100) > 300):
+            errors = errors + 1
+            print("fusion error:", f.__class__.__name__, f.degrees())
+    # a log starting without a compass heading: the first valid heading sets the yaw
+    start = imu_samples(2)
+    start[0].valid = False
+    start[1].heading = 270
+    for f in (ComplementaryFilter(), MahonyFilter()):
+        for s in start:
+            f.update(s)
+        if f.yaw != 27000:
+            errors = errors + 1
+            print("fusion error: first heading", f.__class__.__name__, f.degrees())
+    print("fusion errors:", errors)
+
+    for name, f in (("compl", ComplementaryFilter()), ("mahony", MahonyFilter())):
+        def updates():
+            for s in samples:
+                f.update(s)
+        start = ticks_us()
+        updates()
+        elapsed = ticks_us() - start
+        f.reset()
+        heap = allocated(updates)
+        print("%-10s %6d updates/s  %6d us/update  heap: %s" % (name, loops * 1000000 // max(elapsed, 1), elapsed // loops,
+                                                               "n/a" if heap is None else "%d bytes" % heap))
+    return errors
+
+
+## Sample log recorded with imufusion.record() from the simulator's ABSIMU: the sensor tilts to
+#  roll 30, pitch -20 degrees while the heading turns from 90 to 135 degrees, with a small gyro
+#  bias and a compass glitch (samples with valid 0) in the middle of the turn.
+REPLAY_LOG = (__file__.rsplit('/', 1)[0] + '/' if '/' in __file__ else '') + 'imu_replay.csv'
+## Attitude at the end of REPLAY_LOG in centidegrees
+REPLAY_ATTITUDE = (3000, -2000, 13500)
+
+## Replay the recorded log and check the final attitude of both filters.
+#  @param path A log recorded with imufusion.record().
+#  @param expected (roll, pitch, yaw) at the end of the log in centidegrees.
+def replayBench(path = REPLAY_LOG, expected = REPLAY_ATTITUDE):
+    errors = 0
+    # (filter, roll and pitch tolerance, yaw tolerance) in centidegrees
+    for f, tolerance, yaw_tolerance in ((ComplementaryFilter(), 200, 300), (MahonyFilter(), 50, 300)):
+        count = replay(path, f)
+        if (count == 0 or abs(f.roll - expected[0]) > tolerance or abs(f.pitch - expected[1]) > tolerance or
+                abs(wrap_cd(f.yaw - expected[2])) > yaw_tolerance):
+            errors = errors + 1
+        print("%-10s replay: %d samples, %s" % (f.__class__.__name__, count, f.degrees()))
+    print("replay errors:", errors)
+    return errors
+
+
+## Profiles driver calls on a FakeI2CDevice and checks the booked transactions.
+def profilerBench():
+    import mindsensorsPYB
+    from profiler import Profiler
+    errors = 0
+    device = mindsensorsPYB.I2CDevice
+    mindsensorsPYB.I2CDevice = FakeI2CDevice
+    try:
+        ll = mindsensorsPYB.LINELEADER(None)
+    finally:
+        mindsensorsPYB.I2CDevice = device
+    prof = Profiler()
+    prof.attach(ll)
+    # command() writes a single int, steering is a one byte read
+    ll.White_Cal()
+    ll.steering()
+    rows = dict([(row[0], row[1:4]) for row in prof.summary()])
+    for name, expected in (("LINELEADER.White_Cal", (1, 1, 1)), ("LINELEADER.steering", (1, 1, 1))):
+        if rows.get(name) != expected:
+            errors = errors + 1
+            print("%s: %s, expected %s" % (name, rows.get(name), expected))
+    if ll.i2c.device.regs[ll.LL_COMMAND] != 87:
+        errors = errors + 1
+    print("profiler errors:", errors)
+    return errors
+
+
+if __name__ == '__main__':
+    decodeBench()
+    tftBench()
+    lineBench()
+    fusionBench()
+    replayBench()
+    profilerBench()
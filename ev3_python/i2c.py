@@ -4,18 +4,16 @@
 #Version 1.01
 
 
-from pybricks.hubs import EV3Brick
-from pybricks.iodevices import I2CDevice
-from pybricks.iodevices import  AnalogSensor
-from pybricks.iodevices import UARTDevice
-from pybricks.parameters import Port, Stop, Direction, Button, Color
-from pybricks.tools import wait, StopWatch, DataLog
-from pybricks.media.ev3dev import Font
+from transport import EV3Brick, I2CDevice, AnalogSensor, UARTDevice
+from transport import Port, Stop, Direction, Button, Color
+from transport import wait, StopWatch, DataLog, Font
 
 import os
 import sys
 import time
 
+from i2c_decode import u8, s8, u16, s16, u16be, s16be, u32, s32, u32be, s32be, SIZES
+
 # state constants
 ON = True
 OFF = False
@@ -31,6 +29,13 @@ class i2c():
         self.port = port
         self.i2c_address=i2c_address
         self.i2c = I2CDevice(port,i2c_address>>1)
+        # shadow register map: image of the device register space, the span
+        # shadow_start..shadow_end is valid after refresh() until invalidated.
+        # Every read lands here and is decoded in place by i2c_decode.
+        self.shadow = bytearray(256)
+        self.shadow_view = memoryview(self.shadow)
+        self.shadow_start = 0
+        self.shadow_end = -1
         #self.port.mode = 'other-i2c'
 
 
@@ -38,11 +43,49 @@ class i2c():
         print ("Error accessing 0x%02X: Check your I2C address" % self.address)
         return -1
 
+    ## Read a contiguous block of registers in one transaction into the shadow register map.
+    #  Following reads inside the block are served from this snapshot until invalidate() or any write.
+    #  @param self The object pointer.
+    #  @param start The first register of the block.
+    #  @param end The last register of the block (inclusive).
+    def refresh(self, start, end):
+        length = end - start + 1
+        self.shadow_view[start:start + length] = self.i2c.read(start, length)
+        self.shadow_start = start
+        self.shadow_end = end
+
+    ## Drop the snapshot taken by refresh(), next reads go to the device again.
+    #  @param self The object pointer.
+    def invalidate(self):
+        self.shadow_start = 0
+        self.shadow_end = -1
+
+    ## Check if registers are covered by the current snapshot.
+    #  @param self The object pointer.
+    #  @param reg The first register.
+    #  @param length Number of registers.
+    def cached(self, reg, length):
+        return reg >= self.shadow_start and reg + length - 1 <= self.shadow_end
+
+    ## Make registers available in the shadow register map, reading them from the device if they are not in the snapshot.
+    #  @param self The object pointer.
+    #  @param reg The first register.
+    #  @param length Number of registers.
+    def _fetch(self, reg, length):
+        if reg >= self.shadow_start and reg + length - 1 <= self.shadow_end:
+            return
+        if reg <= self.shadow_end and reg + length - 1 >= self.shadow_start:
+            # partial overlap would mix two sample instants in the snapshot
+            self.invalidate()
+        self.shadow_view[reg:reg + length] = self.i2c.read(reg, length)
+
     ## Read a string from your i2c device starting at a given location
     #  @param self The object pointer.
     #  @param reg The first register of the string to read from.
     #  @param length The length of the string.
     def readString(self, reg, length):
+        if self.cached(reg, length):
+            return bytes(self.shadow_view[reg:reg + length])
         return self.i2c.read(reg, length)
 
 
@@ -50,22 +93,22 @@ class i2c():
     #  @param self The object pointer.
     #  @param reg The register to read from.
     def readByte(self, reg):
-        a =self.i2c.read(reg, 1)
-        return int.from_bytes(a, "little")
+        self._fetch(reg, 1)
+        return u8(self.shadow, reg)
 
     ## Write a byte to your i2c device at a given location
     #  @param self The object pointer.
     #  @param reg The register to write value at.
     #  @param value Value to write.
     def writeByte(self, reg, value):
-        
+        self.invalidate()
         self.i2c.write( reg,value)
-        pass
 
     ## Write a command to your i2c device at a command location
     #  @param self The object pointer.
     #  @param comamnd to write .
     def issueCommand(self,  value):
+       self.invalidate()
        self.i2c.write( 0x42, value)
              
 
@@ -75,7 +118,8 @@ class i2c():
     #  @param reg The first register in the array to read from.
     #  @param length The length of the array.
     def readArray(self, reg, length):
-
+        if self.cached(reg, length):
+            return bytes(self.shadow_view[reg:reg + length])
         return self.i2c.read(reg, length)
         
     ## Write a byte array from your i2c device starting at a given location
@@ -83,15 +127,15 @@ class i2c():
     #  @param reg The first register in the array to write to.
     #  @param arr The array to write.
     def writeArray(self, reg, arr):
+        self.invalidate()
         return self.i2c.write(reg, bytearray(arr))
         
     ## Read a signed byte from your i2c device at a given location
     #  @param self The object pointer.
     #  @param reg The register to read from.
     def readByteSigned(self, reg):
-        a = self.i2c.read(reg, 1)
-        signed_a =int.from_bytes(a, "little") #ctypes.c_byte.value 
-        return signed_a
+        self._fetch(reg, 1)
+        return s8(self.shadow, reg)
 
     ## Write an unsigned 16 bit integer from your i2c device from a given location. little endian write integers.
     #  @param self The object pointer.
@@ -99,54 +143,61 @@ class i2c():
     #  @param int The integer to write.
     def writeInteger(self, reg, i):        
         i = int(i)
+        self.invalidate()
         results = self.i2c.write(reg, [i%256, (i>>8)%256])
 
     ## Read a signed 16 bit integer from your i2c device from a given location. Big endian read integers .
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readIntegerSignedBE(self, reg):
-        a = self.readIntegerBE(reg)
-        if a&0x8000 : a = a -65535 
-        return a       
+        self._fetch(reg, 2)
+        return s16be(self.shadow, reg)
     
     ## Read a signed 16 bit integer from your i2c device from a given location. little endian read integers .
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readIntegerSigned(self, reg):
-        a = self.readInteger(reg)
-        if a&0x8000 : a = a -65535 
-        return a
+        try:
+            self._fetch(reg, 2)
+            return s16(self.shadow, reg)
+        except:
+            return 0
 
     ## Read an unsigned 32bit integer from your i2c device from a given location. Big endian read integers.
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readLongBE(self, reg):
-        
-        results = self.i2c.read(reg,4)
-        return results[3] + (results[2]<<8)+(results[1]<<16)+(results[0]<<24)           
+        self._fetch(reg, 4)
+        return u32be(self.shadow, reg)
         
     ## Read an unsigned 32bit integer from your i2c device from a given location. little endian read integers.
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readLong(self, reg):
-        results = self.i2c.read(reg,4)
-        return results[0] + (results[1]<<8)+(results[2]<<16)+(results[3]<<24)       
+        self._fetch(reg, 4)
+        return u32(self.shadow, reg)
 
     ## Read a signed 32bit integer from your i2c device from a given location. Big endian read integers .
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readLongSignedBE(self, reg):
-        a = self.readLongBE(reg)
-        if a&0x80000000 : a = a -0xFFFFFFFF
-        return a    
+        self._fetch(reg, 4)
+        return s32be(self.shadow, reg)
           
     ## Read a signed 32bit integer from your i2c device from a given location. little endian read integers .
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readLongSigned(self, reg):
-        a = self.readLong(reg)
-        if a&0x80000000 : a = a -0xFFFFFFFF
-        return a
+        self._fetch(reg, 4)
+        return s32(self.shadow, reg)
+
+    ## Read a value in any i2c_decode format from your i2c device at a given location.
+    #  @param self The object pointer.
+    #  @param reg The first register of the value to read.
+    #  @param fmt Decoder from i2c_decode (e.g. s16) or one returned by compile_format().
+    def readValue(self, reg, fmt):
+        self._fetch(reg, SIZES[fmt])
+        return fmt(self.shadow, reg)
 
     ##  Read the firmware version of the i2c device
     #  @param self The object pointer.
@@ -163,18 +214,32 @@ class i2c():
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readIntegerBE(self, reg):        
-        results = self.i2c.read( reg, 2)
-        return results[1] + (results[0]<<8)
+        self._fetch(reg, 2)
+        return u16be(self.shadow, reg)
         
     ## Read an unsigned 16 bit integer from your i2c device from a given location. little endian read integers.
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readInteger(self, reg):        
         try:
-            results = self.i2c.read(reg, 2)
-            return results[0] + (results[1]<<8)
+            self._fetch(reg, 2)
+            return u16(self.shadow, reg)
+        except:
+            return 0
+
+    ## Read consecutive unsigned 16 bit integers (little endian) in one transaction into an array.
+    #  @param self The object pointer.
+    #  @param reg The register of the first integer.
+    #  @param out The array('H') (or list) to fill, its length is the number of integers.
+    def readIntegerArray(self, reg, out):
+        try:
+            self._fetch(reg, 2 * len(out))
+            for i in range(len(out)):
+                out[i] = u16(self.shadow, reg + 2 * i)
         except:
-            return 0    
+            for i in range(len(out)):
+                out[i] = 0
+        return out
 
     ##  Read the vendor name of the i2c device
     #  @param self The object pointer.
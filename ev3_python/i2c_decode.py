@@ -0,0 +1,81 @@
+#!/usr/bin/env pybricks-micropython
+
+## i2c_decode: integer decoders for register data already held in a buffer.
+#  Each format is compiled once into a plain function taking (buffer, offset),
+#  so decoding a register does not create any bytes, list or tuple objects.
+#  Values that do not fit a MicroPython small int (32 bit values above 2^30)
+#  still need a long int object, everything else is allocation free.
+
+
+## Unsigned 8 bit.
+def u8(buf, offset):
+    return buf[offset]
+
+## Signed 8 bit.
+def s8(buf, offset):
+    a = buf[offset]
+    if a & 0x80: a = a - 0x100
+    return a
+
+## Unsigned 16 bit, little endian.
+def u16(buf, offset):
+    return buf[offset] | (buf[offset+1]<<8)
+
+## Signed 16 bit, little endian.
+def s16(buf, offset):
+    a = buf[offset] | (buf[offset+1]<<8)
+    if a & 0x8000: a = a - 0x10000
+    return a
+
+## Unsigned 16 bit, big endian.
+def u16be(buf, offset):
+    return buf[offset+1] | (buf[offset]<<8)
+
+## Signed 16 bit, big endian.
+def s16be(buf, offset):
+    a = buf[offset+1] | (buf[offset]<<8)
+    if a & 0x8000: a = a - 0x10000
+    return a
+
+## Unsigned 32 bit, little endian.
+def u32(buf, offset):
+    return buf[offset] | (buf[offset+1]<<8) | (buf[offset+2]<<16) | (buf[offset+3]<<24)
+
+## Signed 32 bit, little endian.
+def s32(buf, offset):
+    a = buf[offset] | (buf[offset+1]<<8) | (buf[offset+2]<<16)
+    if buf[offset+3] & 0x80: return a - ((0x100 - buf[offset+3])<<24)
+    return a | (buf[offset+3]<<24)
+
+## Unsigned 32 bit, big endian.
+def u32be(buf, offset):
+    return buf[offset+3] | (buf[offset+2]<<8) | (buf[offset+1]<<16) | (buf[offset]<<24)
+
+## Signed 32 bit, big endian.
+def s32be(buf, offset):
+    a = buf[offset+3] | (buf[offset+2]<<8) | (buf[offset+1]<<16)
+    if buf[offset] & 0x80: return a - ((0x100 - buf[offset])<<24)
+    return a | (buf[offset]<<24)
+
+
+## struct-like format strings and their decoders
+FORMATS = {
+    'B': u8, 'b': s8,
+    '<H': u16, '<h': s16, '>H': u16be, '>h': s16be,
+    '<I': u32, '<i': s32, '>I': u32be, '>i': s32be,
+}
+
+## Size in bytes of every decoder
+SIZES = {
+    u8: 1, s8: 1,
+    u16: 2, s16: 2, u16be: 2, s16be: 2,
+    u32: 4, s32: 4, u32be: 4, s32be: 4,
+}
+
+## Compile a struct-like format string ('B', 'b', '<H', '<h', '>H', '>h', '<I', '<i', '>I', '>i') into its decoder.
+#  @param fmt The format string.
+def compile_format(fmt):
+    try:
+        return FORMATS[fmt]
+    except KeyError:
+        raise ValueError("unsupported format: %s" % fmt)
@@ -0,0 +1,335 @@
+#!/usr/bin/env pybricks-micropython
+
+# imufusion: roll, pitch and yaw from the AbsoluteIMU gyro, accelerometer and compass.
+#
+#   from imusampler import IMUSampler
+#   from imufusion import ComplementaryFilter
+#   sampler = IMUSampler(imu, rate_hz = 100)
+#   attitude = ComplementaryFilter()
+#   while True:
+#       if sampler.poll():
+#           attitude.update(sampler.sample)
+#           print(attitude.roll, attitude.pitch, attitude.yaw)    # centidegrees
+#
+# Angles are integers in hundredths of a degree. Roll is about x, pitch about y,
+# both -18000 .. 18000. The yaw follows the compass heading (0 .. 36000,
+# clockwise): the gyro z rate is integrated and pulled towards the tilt
+# compensated heading the ABSIMU computes from its magnetometer.
+#
+# ComplementaryFilter uses integer math only, atan2 comes from a 256 entry
+# table. It treats the gyro rates as roll and pitch rates, which biases it
+# while the robot turns tilted. MahonyFilter integrates the rotation in a float
+# quaternion and corrects the gyro towards gravity, it stays accurate in
+# combined motion but costs more per update; bench.py measures both.
+# Samples can be logged with record() and fed back through any filter with
+# replay().
+
+import math
+from array import array
+
+from transport import ticks_diff
+
+## Gyro scale of the ABSIMU in micro degrees per second per count (8.75 mdps at 250 dps full scale)
+GYRO_UDPS = 8750
+
+# atan(i / 256) in centidegrees, one extra entry for the interpolation at i = 256
+ATAN_TABLE = array('h', [int(math.atan(i / 256) * 18000 / math.pi + 0.5) for i in range(258)])
+
+
+## atan2 in centidegrees (-18000 .. 18000) from the table, integer arguments.
+def atan2_cd(y, x):
+    if x == 0 and y == 0:
+        return 0
+    ax = x if x >= 0 else -x
+    ay = y if y >= 0 else -y
+    swap = ay > ax
+    if swap:
+        ax, ay = ay, ax
+    # keep (ay << 16) a small int
+    while ax >= 16384:
+        ax = ax >> 1
+        ay = ay >> 1
+    q = (ay << 16) // ax
+    i = q >> 8
+    a = ATAN_TABLE[i] + (((ATAN_TABLE[i + 1] - ATAN_TABLE[i]) * (q & 0xFF)) >> 8)
+    if swap:
+        a = 9000 - a
+    if x < 0:
+        a = 18000 - a
+    return a if y >= 0 else -a
+
+## Integer square root.
+def isqrt(n):
+    if n <= 0:
+        return 0
+    # power of two above the root, Newton then decreases monotonically
+    x = 1
+    while x * x < n:
+        x = x << 1
+    while True:
+        y = (x + n // x) >> 1
+        if y >= x:
+            return x
+        x = y
+
+## Wrap an angle in centidegrees to -18000 .. 18000.
+def wrap_cd(a):
+    while a > 18000:
+        a = a - 36000
+    while a < -18000:
+        a = a + 36000
+    return a
+
+
+## Attitude: state and yaw handling shared by the filters
+#  @param gyro_udps Gyro scale in micro degrees per second per count.
+#  @param yaw_alpha Weight of the gyro in the yaw per update, out of 256.
+class Attitude():
+
+    def __init__(self, gyro_udps = GYRO_UDPS, yaw_alpha = 252):
+        self.gyro_udps = gyro_udps
+        self.yaw_alpha = yaw_alpha
+        self.reset()
+
+    ## Forget the state, the next sample sets the angles from accelerometer and compass.
+    def reset(self):
+        ## Angles in centidegrees
+        self.roll = 0
+        self.pitch = 0
+        self.yaw = 0
+        ## Has yaw been set from a valid compass heading?
+        self.yaw_valid = False
+        ## Number of updates
+        self.updates = 0
+        self.timestamp = None
+        # gyro integration remainders in 1e-8 centidegrees, and the time step remainder in us
+        self.rest = [0, 0, 0]
+        self.dt_rest = 0
+
+    ## (roll, pitch, yaw) in degrees.
+    def degrees(self):
+        return (self.roll / 100, self.pitch / 100, self.yaw / 100)
+
+    ## Roll and pitch of the gravity vector in the accelerometer reading, centidegrees.
+    def accel_angles(self, sample):
+        ax = sample.accel[0]
+        ay = sample.accel[1]
+        az = sample.accel[2]
+        return atan2_cd(ay, az), atan2_cd(-ax, isqrt(ay * ay + az * az))
+
+    ## Angle change from a gyro axis over dt, centidegrees.
+    #  @param axis 0, 1 or 2.
+    #  @param counts Gyro reading.
+    #  @param dt Time step in units of 100 us.
+    def gyro_step(self, axis, counts, dt):
+        # counts * udps * dt is in 1e-8 centidegrees, the remainder carries over so nothing is lost
+        rest = self.rest[axis] + counts * self.gyro_udps * dt
+        step = rest // 100000000
+        self.rest[axis] = rest - step * 100000000
+        return step
+
+    ## Integrate the gyro z rate and pull the yaw towards the compass heading.
+    def update_yaw(self, sample, dt):
+        # the gyro z rate counts counterclockwise, the heading clockwise
+        yaw = self.yaw - self.gyro_step(2, sample.gyro[2], dt)
+        if sample.valid:
+            if self.yaw_valid:
+                yaw = yaw + ((wrap_cd(sample.heading * 100 - yaw) * (256 - self.yaw_alpha)) >> 8)
+            else:
+                # first valid heading, nothing to blend with yet
+                yaw = sample.heading * 100
+                self.yaw_valid = True
+        self.yaw = yaw % 36000
+
+    ## Time step to the previous sample in units of 100 us, None for the first sample.
+    def time_step(self, sample):
+        last = self.timestamp
+        self.timestamp = sample.timestamp
+        self.updates = self.updates + 1
+        if last is None:
+            if sample.valid:
+                self.yaw = sample.heading * 100
+                self.yaw_valid = True
+            return None
+        us = ticks_diff(sample.timestamp, last) + self.dt_rest
+        dt = us // 100
+        self.dt_rest = us - dt * 100
+        return dt
+
+
+## ComplementaryFilter: integrated gyro rates pulled towards the accelerometer angles, integer math
+#  @param gyro_udps Gyro scale in micro degrees per second per count.
+#  @param alpha Weight of the gyro in roll and pitch per update, out of 256.
+#  @param yaw_alpha Weight of the gyro in the yaw per update, out of 256.
+class ComplementaryFilter(Attitude):
+
+    def __init__(self, gyro_udps = GYRO_UDPS, alpha = 250, yaw_alpha = 252):
+        self.alpha = alpha
+        Attitude.__init__(self, gyro_udps, yaw_alpha)
+
+    ## Fuse one sample.
+    #  @param sample IMUSAMPLE, e.g. IMUSampler.sample or ABSIMU.read_all().
+    #  @return The filter, roll, pitch and yaw are updated.
+    def update(self, sample):
+        roll, pitch = self.accel_angles(sample)
+        dt = self.time_step(sample)
+        if dt is None:
+            self.roll = roll
+            self.pitch = pitch
+            return self
+        k = 256 - self.alpha
+        angle = self.roll + self.gyro_step(0, sample.gyro[0], dt)
+        self.roll = wrap_cd(angle + ((wrap_cd(roll - angle) * k) >> 8))
+        angle = self.pitch + self.gyro_step(1, sample.gyro[1], dt)
+        self.pitch = wrap_cd(angle + ((wrap_cd(pitch - angle) * k) >> 8))
+        self.update_yaw(sample, dt)
+        return self
+
+
+## MahonyFilter: quaternion driven by the gyro, corrected towards gravity by a PI controller
+#  @param gyro_udps Gyro scale in micro degrees per second per count.
+#  @param kp Proportional gain of the accelerometer correction.
+#  @param ki Integral gain, estimates the gyro bias.
+#  @param yaw_alpha Weight of the gyro in the yaw per update, out of 256.
+class MahonyFilter(Attitude):
+
+    def __init__(self, gyro_udps = GYRO_UDPS, kp = 2.0, ki = 0.05, yaw_alpha = 252):
+        self.kp = kp
+        self.ki = ki
+        Attitude.__init__(self, gyro_udps, yaw_alpha)
+
+    def reset(self):
+        Attitude.reset(self)
+        self.q = [1.0, 0.0, 0.0, 0.0]
+        ## Integral feedback, rad/s per axis
+        self.bias = [0.0, 0.0, 0.0]
+
+    ## Fuse one sample.
+    #  @param sample IMUSAMPLE, e.g. IMUSampler.sample or ABSIMU.read_all().
+    #  @return The filter, roll, pitch and yaw are updated.
+    def update(self, sample):
+        dt = self.time_step(sample)
+        if dt is None:
+            roll, pitch = self.accel_angles(sample)
+            # quaternion of roll, then pitch
+            cr = math.cos(roll * math.pi / 36000)
+            sr = math.sin(roll * math.pi / 36000)
+            cp = math.cos(pitch * math.pi / 36000)
+            sp = math.sin(pitch * math.pi / 36000)
+            self.q = [cr * cp, sr * cp, cr * sp, -sr * sp]
+            self.roll = roll
+            self.pitch = pitch
+            return self
+        dts = dt / 10000
+        q0, q1, q2, q3 = self.q
+        scale = self.gyro_udps * math.pi / 180000000
+        gx = sample.gyro[0] * scale
+        gy = sample.gyro[1] * scale
+        gz = sample.gyro[2] * scale
+        ax = sample.accel[0]
+        ay = sample.accel[1]
+        az = sample.accel[2]
+        norm = ax * ax + ay * ay + az * az
+        if norm:
+            norm = 1 / math.sqrt(norm)
+            ax = ax * norm
+            ay = ay * norm
+            az = az * norm
+            # gravity direction of the estimate
+            vx = 2 * (q1 * q3 - q0 * q2)
+            vy = 2 * (q0 * q1 + q2 * q3)
+            vz = q0 * q0 - q1 * q1 - q2 * q2 + q3 * q3
+            ex = ay * vz - az * vy
+            ey = az * vx - ax * vz
+            ez = ax * vy - ay * vx
+            bias = self.bias
+            if self.ki:
+                bias[0] = bias[0] + self.ki * ex * dts
+                bias[1] = bias[1] + self.ki * ey * dts
+                bias[2] = bias[2] + self.ki * ez * dts
+            gx = gx + self.kp * ex + bias[0]
+            gy = gy + self.kp * ey + bias[1]
+            gz = gz + self.kp * ez + bias[2]
+        h = 0.5 * dts
+        gx = gx * h
+        gy = gy * h
+        gz = gz * h
+        n0 = q0 - q1 * gx - q2 * gy - q3 * gz
+        n1 = q1 + q0 * gx + q2 * gz - q3 * gy
+        n2 = q2 + q0 * gy - q1 * gz + q3 * gx
+        n3 = q3 + q0 * gz + q1 * gy - q2 * gx
+        norm = 1 / math.sqrt(n0 * n0 + n1 * n1 + n2 * n2 + n3 * n3)
+        q0 = n0 * norm
+        q1 = n1 * norm
+        q2 = n2 * norm
+        q3 = n3 * norm
+        self.q[0] = q0
+        self.q[1] = q1
+        self.q[2] = q2
+        self.q[3] = q3
+        # Euler angles through the atan2 table, quaternion terms scaled to integers
+        self.roll = atan2_cd(int(2 * (q0 * q1 + q2 * q3) * 16384), int((1 - 2 * (q1 * q1 + q2 * q2)) * 16384))
+        s = int(2 * (q0 * q2 - q3 * q1) * 16384)
+        s = min(max(s, -16384), 16384)
+        self.pitch = atan2_cd(s, isqrt(16384 * 16384 - s * s))
+        self.update_yaw(sample, dt)
+        return self
+
+
+## Log header, one sample per line in IMUSampler channel order, valid is 0 for a sample with a bad heading
+HEADER = "timestamp,tilt_x,tilt_y,tilt_z,accel_x,accel_y,accel_z,heading,mag_x,mag_y,mag_z,gyro_x,gyro_y,gyro_z,valid\n"
+
+## Write one sample as a log line.
+def write_sample(f, s):
+    f.write("%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d,%d\n" % (
+        s.timestamp, s.tilt[0], s.tilt[1], s.tilt[2], s.accel[0], s.accel[1], s.accel[2], s.heading,
+        s.mag[0], s.mag[1], s.mag[2], s.gyro[0], s.gyro[1], s.gyro[2], 1 if s.valid else 0))
+
+## Record the samples of an IMUSampler to a log file.
+#  @param sampler The IMUSampler.
+#  @param path The log file.
+#  @param duration_ms Recording time in ms.
+def record(sampler, path, duration_ms):
+    with open(path, 'w') as f:
+        f.write(HEADER)
+        def log():
+            write_sample(f, sampler.sample)
+            return False
+        sampler.run(duration_ms, log)
+
+## Read the samples of a log file, one sample object is refilled for every line.
+#  @param path The log file.
+#  @param sample IMUSAMPLE to fill, a new one is made if None.
+def read_log(path, sample = None):
+    if sample is None:
+        from mindsensorsPYB import IMUSAMPLE
+        sample = IMUSAMPLE()
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] == 't':
+                continue
+            v = [int(x) for x in line.split(',')]
+            if len(v) != 15:
+                continue
+            sample.timestamp = v[0]
+            for i in range(3):
+                sample.tilt[i] = v[1 + i]
+                sample.accel[i] = v[4 + i]
+                sample.mag[i] = v[8 + i]
+                sample.gyro[i] = v[11 + i]
+            sample.heading = v[7]
+            sample.valid = v[14] != 0
+            yield sample
+
+## Feed a log file through filters.
+#  @param path The log file.
+#  @param filters Filters to update with every sample.
+#  @return Number of samples.
+def replay(path, *filters):
+    count = 0
+    for sample in read_log(path):
+        for f in filters:
+            f.update(sample)
+        count = count + 1
+    return count
@@ -0,0 +1,213 @@
+#!/usr/bin/env pybricks-micropython
+
+# imusampler: fixed rate sampling of the AbsoluteIMU into a ring buffer.
+#
+#   from imusampler import IMUSampler, GYRO, ACCEL
+#   sampler = IMUSampler(imu, rate_hz = 100, window = 64)
+#   sampler.run(2000)
+#   print(sampler.mean(GYRO + 2), sampler.variance(GYRO + 2), sampler.maximum(ACCEL))
+#   print(sampler.achieved_hz(), sampler.jitter_max_us, sampler.jitter_mean_us(), sampler.overruns)
+#
+# Every sample is one ABSIMU.read_all() transaction. Its 13 values are copied
+# into a preallocated array('h') ring buffer, so sampling creates no objects.
+# Sums and sums of squares over the window are updated as samples come and go.
+# Minimum and maximum are updated the same way, a channel is only rescanned
+# when its extreme value leaves the window. poll() does not block, so the
+# sampler can also run as a Scheduler task: sched.every(1, sampler.poll).
+
+from array import array
+
+from transport import StopWatch, wait, ticks_us, ticks_diff
+from mindsensorsPYB import IMUSAMPLE
+
+## Channel offsets in a sample, x, y, z follow each other
+TILT = 0
+ACCEL = 3
+HEADING = 6
+MAG = 7
+GYRO = 10
+## Values per sample
+WIDTH = 13
+
+
+## IMUSampler: polls an ABSIMU at a fixed rate, keeps the last window samples and their statistics
+#  @param imu The ABSIMU.
+#  @param rate_hz Sampling rate.
+#  @param window Number of samples kept and covered by the statistics.
+class IMUSampler():
+
+    def __init__(self, imu, rate_hz = 100, window = 64):
+        self.imu = imu
+        self.period_us = 1000000 // rate_hz
+        self.window = window
+        self.sample = IMUSAMPLE()
+        ## Ring buffer, sample i occupies samples[i * WIDTH:(i + 1) * WIDTH]
+        self.samples = array('h', bytes(2 * WIDTH * window))
+        ## ticks_us() of every sample
+        self.timestamps = array('l', [0] * window)
+        self.lo = array('h', bytes(2 * WIDTH))
+        self.hi = array('h', bytes(2 * WIDTH))
+        # channels whose minimum or maximum left the window
+        self.stale = bytearray(WIDTH)
+        self.next_us = None
+        self.clear()
+
+    ## Empty the buffer and reset the statistics.
+    def clear(self):
+        ## Index the next sample is written to
+        self.head = 0
+        ## Samples in the buffer
+        self.count = 0
+        self.sum = [0] * WIDTH
+        self.sumsq = [0] * WIDTH
+        for c in range(WIDTH):
+            self.stale[c] = 0
+        self.clear_stats()
+
+    ## Reset the timing statistics.
+    def clear_stats(self):
+        ## Number of samples taken
+        self.taken = 0
+        ## Samples with an out of range heading, they keep the last valid heading
+        self.invalid = 0
+        ## Samples started more than a period late, their deadlines were skipped
+        self.overruns = 0
+        ## Largest sample start lateness in us
+        self.jitter_max_us = 0
+        self.jitter_sum_us = 0
+
+    ## Mean sample start lateness in us.
+    def jitter_mean_us(self):
+        return self.jitter_sum_us / self.taken if self.taken else 0
+
+    ## Read one sample and add it to the buffer.
+    def take(self):
+        s = self.imu.read_all(self.sample)
+        if not s.valid:
+            self.invalid = self.invalid + 1
+        samples = self.samples
+        base = self.head * WIDTH
+        full = self.count == self.window
+        for c in range(WIDTH):
+            if c < ACCEL:
+                v = s.tilt[c]
+            elif c < HEADING:
+                v = s.accel[c - ACCEL]
+            elif c == HEADING:
+                v = s.heading
+            elif c < GYRO:
+                v = s.mag[c - MAG]
+            else:
+                v = s.gyro[c - GYRO]
+            if full:
+                old = samples[base + c]
+                self.sum[c] = self.sum[c] - old
+                self.sumsq[c] = self.sumsq[c] - old * old
+                if old == self.lo[c] or old == self.hi[c]:
+                    self.stale[c] = 1
+            samples[base + c] = v
+            self.sum[c] = self.sum[c] + v
+            self.sumsq[c] = self.sumsq[c] + v * v
+            if self.count == 0:
+                self.lo[c] = v
+                self.hi[c] = v
+            elif not self.stale[c]:
+                if v < self.lo[c]:
+                    self.lo[c] = v
+                if v > self.hi[c]:
+                    self.hi[c] = v
+        self.timestamps[self.head] = s.timestamp
+        self.head = self.head + 1 if self.head + 1 < self.window else 0
+        if not full:
+            self.count = self.count + 1
+        self.taken = self.taken + 1
+
+    ## Take a sample if its deadline has come, without blocking.
+    #  @return True if a sample was taken.
+    def poll(self):
+        now = ticks_us()
+        if self.next_us is None:
+            self.next_us = now
+        late = ticks_diff(now, self.next_us)
+        if late < 0:
+            return False
+        if late > self.jitter_max_us:
+            self.jitter_max_us = late
+        self.jitter_sum_us = self.jitter_sum_us + late
+        if late >= self.period_us:
+            # too late, skip the missed deadlines instead of catching up in a burst
+            self.overruns = self.overruns + 1
+            self.next_us = now
+        self.take()
+        self.next_us = self.next_us + self.period_us
+        return True
+
+    ## Sample at the fixed rate, sleeping until every deadline.
+    #  @param duration_ms Run time in ms, None to run until stop returns True.
+    #  @param stop Function called after every sample, the loop ends when it returns True.
+    def run(self, duration_ms = None, stop = None):
+        watch = StopWatch()
+        self.next_us = None
+        while duration_ms is None or watch.time() < duration_ms:
+            if self.poll():
+                if stop is not None and stop():
+                    break
+                continue
+            wait((ticks_diff(self.next_us, ticks_us()) + 999) // 1000)
+
+    ## Value of a channel in sample i, 0 is the oldest sample in the buffer, -1 the newest.
+    def get(self, i, channel):
+        if i < 0:
+            i = self.count + i
+        start = self.head - self.count
+        if start < 0:
+            start = start + self.window
+        i = start + i
+        if i >= self.window:
+            i = i - self.window
+        return self.samples[i * WIDTH + channel]
+
+    ## Mean of a channel over the window.
+    def mean(self, channel):
+        return self.sum[channel] / self.count if self.count else 0
+
+    ## Variance of a channel over the window.
+    def variance(self, channel):
+        n = self.count
+        if n == 0:
+            return 0
+        total = self.sum[channel]
+        return (self.sumsq[channel] - total * total / n) / n
+
+    def rescan(self, channel):
+        lo = hi = self.get(0, channel)
+        for i in range(1, self.count):
+            v = self.get(i, channel)
+            if v < lo:
+                lo = v
+            if v > hi:
+                hi = v
+        self.lo[channel] = lo
+        self.hi[channel] = hi
+        self.stale[channel] = 0
+
+    ## Minimum of a channel over the window.
+    def minimum(self, channel):
+        if self.stale[channel]:
+            self.rescan(channel)
+        return self.lo[channel]
+
+    ## Maximum of a channel over the window.
+    def maximum(self, channel):
+        if self.stale[channel]:
+            self.rescan(channel)
+        return self.hi[channel]
+
+    ## Sampling rate achieved over the window, from the sample timestamps.
+    def achieved_hz(self):
+        if self.count < 2:
+            return 0
+        last = self.head - 1 if self.head else self.window - 1
+        first = self.head if self.count == self.window else 0
+        span = ticks_diff(self.timestamps[last], self.timestamps[first])
+        return (self.count - 1) * 1000000 / span if span > 0 else 0
@@ -0,0 +1,178 @@
+#!/usr/bin/env pybricks-micropython
+
+# linecal: host side calibration of LSA and LINELEADER sensor arrays.
+#
+#   from linecal import CalibrationStore
+#   store = CalibrationStore()
+#   lsa.profile = store.get(lsa)
+#   if lsa.profile is None:
+#       lsa.profile = store.capture(lsa)    # sweep the array over line and floor
+#       store.save()
+#   values = lsa.ReadNormalized()          # 0 (black) .. 100 (white)
+#
+# A profile holds the per channel minimum and maximum of the uncalibrated
+# values seen during capture and one 256 entry lookup table per channel that
+# maps a raw value (shifted to 8 bits) to 0..100. Profiles are stored in a
+# small binary file keyed by port and I2C address, so a robot loads them at
+# startup instead of recalibrating every boot.
+
+import struct
+from array import array
+
+from transport import StopWatch, wait
+
+## Default profile file
+PATH = "linecal.bin"
+# file header: magic, version, number of profiles
+MAGIC = b'LCAL'
+VERSION = 1
+# record: port name (8 bytes), i2c address, channels, flags; then lo and hi per channel
+RECORD = "<8sBBB"
+RECORD_SIZE = struct.calcsize(RECORD)
+FLAG_INVERT = 0x01
+
+
+## CalibrationProfile: per channel min/max and normalization tables
+#  @param channels Number of sensors.
+#  @param invert True if higher raw values mean darker (as the mindsensors arrays report them).
+class CalibrationProfile():
+
+    def __init__(self, channels = 8, invert = True):
+        self.channels = channels
+        self.invert = invert
+        self.lo = array('H', [0xFFFF] * channels)
+        self.hi = array('H', [0] * channels)
+        self.shift = 0
+        self.tables = None
+
+    ## Add one set of uncalibrated values to the min/max.
+    def capture(self, values):
+        lo = self.lo
+        hi = self.hi
+        for i in range(self.channels):
+            v = values[i]
+            if v < lo[i]: lo[i] = v
+            if v > hi[i]: hi[i] = v
+        self.tables = None
+
+    ## True if every channel saw a usable range.
+    def valid(self):
+        for i in range(self.channels):
+            if self.hi[i] <= self.lo[i]:
+                return False
+        return True
+
+    ## Build the lookup tables from min/max, called by normalize() when needed.
+    def build(self):
+        top = max(self.hi) if self.channels else 0
+        shift = 0
+        while (top >> shift) > 255:
+            shift = shift + 1
+        self.shift = shift
+        tables = []
+        for ch in range(self.channels):
+            lo = self.lo[ch]
+            hi = self.hi[ch]
+            span = max(hi - lo, 1)
+            table = bytearray(256)
+            for q in range(256):
+                # middle of the raw values falling into bin q
+                v = (q << shift) + ((1 << shift) >> 1)
+                n = (v - lo) * 100 // span
+                n = min(max(n, 0), 100)
+                table[q] = 100 - n if self.invert else n
+            tables.append(table)
+        self.tables = tables
+
+    ## Normalize uncalibrated values to 0 (black) .. 100 (white).
+    #  @param values Uncalibrated values, e.g. array('H') from ReadRaw_Uncalibrated().
+    #  @param out bytearray to fill, a new one is made if None.
+    def normalize(self, values, out = None):
+        if self.tables is None:
+            self.build()
+        if out is None:
+            out = bytearray(self.channels)
+        tables = self.tables
+        shift = self.shift
+        for i in range(self.channels):
+            q = values[i] >> shift
+            out[i] = tables[i][q if q < 256 else 255]
+        return out
+
+    def to_bytes(self):
+        return struct.pack('<%dH' % (2 * self.channels), *(list(self.lo) + list(self.hi)))
+
+    @staticmethod
+    def from_bytes(data, channels, invert):
+        profile = CalibrationProfile(channels, invert)
+        values = struct.unpack('<%dH' % (2 * channels), data)
+        for i in range(channels):
+            profile.lo[i] = values[i]
+            profile.hi[i] = values[channels + i]
+        return profile
+
+
+## Key of a sensor in the store: port name and I2C address.
+def key(sensor):
+    name = str(sensor.port)
+    if '.' in name:
+        name = name.split('.')[-1]
+    return (name[:8], sensor.i2c_address)
+
+
+## CalibrationStore: calibration profiles of all sensor arrays of a robot in one binary file
+#  @param path The file, loaded right away if it exists.
+class CalibrationStore():
+
+    def __init__(self, path = PATH):
+        self.path = path
+        self.profiles = {}
+        try:
+            self.load()
+        except OSError:
+            pass
+
+    ## Profile of a sensor (LSA or LINELEADER), None if there is none.
+    def get(self, sensor):
+        return self.profiles.get(key(sensor))
+
+    def put(self, sensor, profile):
+        self.profiles[key(sensor)] = profile
+
+    ## Capture a profile by streaming ReadRaw_Uncalibrated, move the array over line and floor meanwhile.
+    #  @param sensor LSA or LINELEADER.
+    #  @param duration_ms Capture time in ms.
+    #  @param period_ms Sampling interval in ms.
+    #  @return The new profile, also put into the store.
+    def capture(self, sensor, duration_ms = 3000, period_ms = 10):
+        profile = CalibrationProfile(len(sensor.uncalibrated))
+        watch = StopWatch()
+        while watch.time() < duration_ms:
+            profile.capture(sensor.ReadRaw_Uncalibrated())
+            wait(period_ms)
+        self.put(sensor, profile)
+        return profile
+
+    def load(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        if data[0:4] != MAGIC or data[4] != VERSION:
+            raise ValueError("not a calibration file: %s" % self.path)
+        count = data[5]
+        pos = 6
+        profiles = {}
+        for i in range(count):
+            name, address, channels, flags = struct.unpack(RECORD, data[pos:pos + RECORD_SIZE])
+            pos = pos + RECORD_SIZE
+            profile = CalibrationProfile.from_bytes(data[pos:pos + 4 * channels], channels, bool(flags & FLAG_INVERT))
+            pos = pos + 4 * channels
+            profiles[(name.rstrip(b'\0').decode(), address)] = profile
+        self.profiles = profiles
+
+    def save(self):
+        with open(self.path, 'wb') as f:
+            f.write(MAGIC + bytes((VERSION, len(self.profiles))))
+            for (name, address), profile in self.profiles.items():
+                f.write(struct.pack(RECORD, name.encode(), address, profile.channels,
+                                    FLAG_INVERT if profile.invert else 0))
+                f.write(profile.to_bytes())
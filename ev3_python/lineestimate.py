@@ -0,0 +1,101 @@
+#!/usr/bin/env pybricks-micropython
+
+## lineestimate: line position from the eight calibrated values of an LSA or LINELEADER.
+#  Integer math only: sensor values go through a 256 entry signal table, the
+#  position is fixed point with SCALE units between neighbouring sensors and
+#  0 under the middle of the array (-3500 .. 3500 for 8 sensors).
+#  @code
+#  line = LineEstimator()
+#  if line.estimate(lsa.ReadRaw_Calibrated()) is not None:
+#      steer = line.position * gain // SCALE
+#  frame = lineleader.ReadLineFrame()
+#  line.estimate(frame.data, 7)
+#  @endcode
+
+from array import array
+
+## Position units between two neighbouring sensors
+SCALE = 1000
+
+
+## LineEstimator: weighted centroid with parabolic subpixel peak, line lost and intersection detection
+#  @param sensors Number of sensors.
+#  @param dark_line True for a dark line on a light floor, False for a light line.
+#  @param floor Signal below which a sensor does not see the line at all (0-100).
+#  @param threshold Signal from which a sensor counts as on the line (0-100).
+#  @param wide Sensors on the line from which the line is reported as intersection.
+class LineEstimator():
+
+    def __init__(self, sensors = 8, dark_line = True, floor = 10, threshold = 50, wide = 5):
+        self.sensors = sensors
+        self.threshold = threshold
+        self.wide = wide
+        ## signal table: calibrated value -> line signal 0..100 minus floor
+        self.signal_table = array('B', [0] * 256)
+        for v in range(256):
+            s = min(v, 100)
+            if dark_line:
+                s = 100 - s
+            self.signal_table[v] = max(s - floor, 0)
+        self.peak_min = threshold - floor
+        ## sensor positions relative to the middle of the array
+        self.weights = array('i', [i * SCALE - (sensors - 1) * SCALE // 2 for i in range(sensors)])
+        self.signal = array('B', [0] * sensors)
+        ## Results of the last estimate()
+        self.position = 0
+        self.centroid = 0
+        self.confidence = 0
+        self.lost = True
+        self.intersection = False
+        ## Sensors on the line
+        self.count = 0
+
+    ## Estimate the line position.
+    #  @param values Calibrated sensor values (0-100), a list, bytes, bytearray or array.
+    #  @param offset Index of the first sensor value in values (7 for LINEFRAME.data).
+    #  @return The position, or None if the line is lost (position keeps its last value).
+    def estimate(self, values, offset = 0):
+        table = self.signal_table
+        signal = self.signal
+        weights = self.weights
+        n = self.sensors
+        total = 0
+        moment = 0
+        peak = 0
+        k = 0
+        low = 100
+        count = 0
+        for i in range(n):
+            s = table[values[offset + i]]
+            signal[i] = s
+            total = total + s
+            moment = moment + s * weights[i]
+            if s > peak:
+                peak = s
+                k = i
+            if s < low:
+                low = s
+            if s >= self.peak_min:
+                count = count + 1
+        self.count = count
+        self.intersection = count >= self.wide
+        self.confidence = peak - low
+        if peak < self.peak_min:
+            self.lost = True
+            self.confidence = 0
+            return None
+        self.lost = False
+        self.centroid = moment // total
+        if 0 < k < n - 1 and count < 3:
+            # parabola through the peak and its neighbours, vertex offset in SCALE units
+            left = signal[k - 1]
+            right = signal[k + 1]
+            spread = 2 * (2 * peak - left - right)
+            shift = (right - left) * SCALE
+            # rounds towards 0 for both signs
+            shift = shift // spread if shift >= 0 else -(-shift // spread)
+            self.position = weights[k] + shift
+        else:
+            # wide line, edge of the array or intersection: the centroid is steadier
+            self.position = self.centroid
+        return self.position
@@ -1,10 +1,8 @@
 #!/usr/bin/env pybricks-micropython
 
-from pybricks.hubs import EV3Brick
-from pybricks.parameters import Port, Stop, Direction, Button, Color
-from pybricks.tools import wait, StopWatch, DataLog
-
-from pybricks.media.ev3dev import Font
+from transport import EV3Brick
+from transport import Port, Stop, Direction, Button, Color
+from transport import wait, StopWatch, DataLog, Font
 
 from EV3_python import *
 
@@ -4,17 +4,18 @@
 #Version 1.01
 
 
-from pybricks.hubs import EV3Brick
-from pybricks.iodevices import I2CDevice
-from pybricks.iodevices import  AnalogSensor
-from pybricks.iodevices import UARTDevice
-from pybricks.parameters import Port, Stop, Direction, Button, Color
-from pybricks.tools import wait, StopWatch, DataLog
-from pybricks.media.ev3dev import Font
+from transport import EV3Brick, I2CDevice, AnalogSensor, UARTDevice
+from transport import Port, Stop, Direction, Button, Color
+from transport import wait, StopWatch, DataLog, Font, ticks_us
 
 import os
 import sys
 import time
+from array import array
+
+from i2c_decode import u8, s8, u16, s16, u16be, s16be, u32, s32, u32be, s32be, SIZES
+from tft_encode import Palette, CommandEncoder, rgb565_list
+from scheduler import run_steps
 
 # state constants
 ON = True
@@ -31,17 +32,62 @@ class mindsensors_i2c():
         self.port = port
         self.i2c_address=i2c_address
         self.i2c = I2CDevice(port,i2c_address>>1)
+        # shadow register map: image of the device register space, the span
+        # shadow_start..shadow_end is valid after refresh() until invalidated.
+        # Every read lands here and is decoded in place by i2c_decode.
+        self.shadow = bytearray(256)
+        self.shadow_view = memoryview(self.shadow)
+        self.shadow_start = 0
+        self.shadow_end = -1
 
 
     def errMsg(self):
         print ("Error accessing 0x%02X: Check your I2C address" % self.address)
         return -1
 
+    ## Read a contiguous block of registers in one transaction into the shadow register map.
+    #  Following reads inside the block are served from this snapshot until invalidate() or any write.
+    #  @param self The object pointer.
+    #  @param start The first register of the block.
+    #  @param end The last register of the block (inclusive).
+    def refresh(self, start, end):
+        length = end - start + 1
+        self.shadow_view[start:start + length] = self.i2c.read(start, length)
+        self.shadow_start = start
+        self.shadow_end = end
+
+    ## Drop the snapshot taken by refresh(), next reads go to the device again.
+    #  @param self The object pointer.
+    def invalidate(self):
+        self.shadow_start = 0
+        self.shadow_end = -1
+
+    ## Check if registers are covered by the current snapshot.
+    #  @param self The object pointer.
+    #  @param reg The first register.
+    #  @param length Number of registers.
+    def cached(self, reg, length):
+        return reg >= self.shadow_start and reg + length - 1 <= self.shadow_end
+
+    ## Make registers available in the shadow register map, reading them from the device if they are not in the snapshot.
+    #  @param self The object pointer.
+    #  @param reg The first register.
+    #  @param length Number of registers.
+    def _fetch(self, reg, length):
+        if reg >= self.shadow_start and reg + length - 1 <= self.shadow_end:
+            return
+        if reg <= self.shadow_end and reg + length - 1 >= self.shadow_start:
+            # partial overlap would mix two sample instants in the snapshot
+            self.invalidate()
+        self.shadow_view[reg:reg + length] = self.i2c.read(reg, length)
+
     ## Read a string from your i2c device starting at a given location
     #  @param self The object pointer.
     #  @param reg The first register of the string to read from.
     #  @param length The length of the string.
     def readString(self, reg, length):
+        if self.cached(reg, length):
+            return bytes(self.shadow_view[reg:reg + length])
         return self.i2c.read(reg, length)
 
 
@@ -49,22 +95,22 @@ class mindsensors_i2c():
     #  @param self The object pointer.
     #  @param reg The register to read from.
     def readByte(self, reg):
-        a =self.i2c.read(reg, 1)
-        return int.from_bytes(a, "little")
+        self._fetch(reg, 1)
+        return u8(self.shadow, reg)
 
     ## Write a byte to your i2c device at a given location
     #  @param self The object pointer.
     #  @param reg The register to write value at.
     #  @param value Value to write.
     def writeByte(self, reg, value):
-        
+        self.invalidate()
         self.i2c.write( reg,value)
-        pass
 
     ## Write a command to your i2c device at a command location
     #  @param self The object pointer.
     #  @param comamnd to write .
     def issueCommand(self,  value):
+       self.invalidate()
        self.i2c.write( 0x42, value)
              
 
@@ -74,7 +120,8 @@ class mindsensors_i2c():
     #  @param reg The first register in the array to read from.
     #  @param length The length of the array.
     def readArray(self, reg, length):
-
+        if self.cached(reg, length):
+            return bytes(self.shadow_view[reg:reg + length])
         return self.i2c.read(reg, length)
         
     ## Write a byte array from your i2c device starting at a given location
@@ -82,15 +129,15 @@ class mindsensors_i2c():
     #  @param reg The first register in the array to write to.
     #  @param arr The array to write.
     def writeArray(self, reg, arr):
+        self.invalidate()
         return self.i2c.write(reg, bytearray(arr))
         
     ## Read a signed byte from your i2c device at a given location
     #  @param self The object pointer.
     #  @param reg The register to read from.
     def readByteSigned(self, reg):
-        a = self.i2c.read(reg, 1)
-        signed_a =int.from_bytes(a, "little") #ctypes.c_byte.value 
-        return signed_a
+        self._fetch(reg, 1)
+        return s8(self.shadow, reg)
 
     ## Write an unsigned 16 bit integer from your i2c device from a given location. little endian write integers.
     #  @param self The object pointer.
@@ -98,54 +145,61 @@ class mindsensors_i2c():
     #  @param int The integer to write.
     def writeInteger(self, reg, i):        
         i = int(i)
+        self.invalidate()
         results = self.i2c.write(reg, [i%256, (i>>8)%256])
 
     ## Read a signed 16 bit integer from your i2c device from a given location. Big endian read integers .
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readIntegerSignedBE(self, reg):
-        a = self.readIntegerBE(reg)
-        if a&0x8000 : a = a -65535 
-        return a       
+        self._fetch(reg, 2)
+        return s16be(self.shadow, reg)
     
     ## Read a signed 16 bit integer from your i2c device from a given location. little endian read integers .
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readIntegerSigned(self, reg):
-        a = self.readInteger(reg)
-        if a&0x8000 : a = a -65535 
-        return a
+        try:
+            self._fetch(reg, 2)
+            return s16(self.shadow, reg)
+        except:
+            return 0
 
     ## Read an unsigned 32bit integer from your i2c device from a given location. Big endian read integers.
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readLongBE(self, reg):
-        
-        results = self.i2c.read(reg,4)
-        return results[3] + (results[2]<<8)+(results[1]<<16)+(results[0]<<24)           
+        self._fetch(reg, 4)
+        return u32be(self.shadow, reg)
         
     ## Read an unsigned 32bit integer from your i2c device from a given location. little endian read integers.
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readLong(self, reg):
-        results = self.i2c.read(reg,4)
-        return results[0] + (results[1]<<8)+(results[2]<<16)+(results[3]<<24)       
+        self._fetch(reg, 4)
+        return u32(self.shadow, reg)
 
     ## Read a signed 32bit integer from your i2c device from a given location. Big endian read integers .
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readLongSignedBE(self, reg):
-        a = self.readLongBE(reg)
-        if a&0x80000000 : a = a -0xFFFFFFFF
-        return a    
+        self._fetch(reg, 4)
+        return s32be(self.shadow, reg)
           
     ## Read a signed 32bit integer from your i2c device from a given location. little endian read integers .
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readLongSigned(self, reg):
-        a = self.readLong(reg)
-        if a&0x80000000 : a = a -0xFFFFFFFF
-        return a
+        self._fetch(reg, 4)
+        return s32(self.shadow, reg)
+
+    ## Read a value in any i2c_decode format from your i2c device at a given location.
+    #  @param self The object pointer.
+    #  @param reg The first register of the value to read.
+    #  @param fmt Decoder from i2c_decode (e.g. s16) or one returned by compile_format().
+    def readValue(self, reg, fmt):
+        self._fetch(reg, SIZES[fmt])
+        return fmt(self.shadow, reg)
 
     ##  Read the firmware version of the i2c device
     #  @param self The object pointer.
@@ -162,18 +216,32 @@ class mindsensors_i2c():
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readIntegerBE(self, reg):        
-        results = self.i2c.read( reg, 2)
-        return results[1] + (results[0]<<8)
+        self._fetch(reg, 2)
+        return u16be(self.shadow, reg)
         
     ## Read an unsigned 16 bit integer from your i2c device from a given location. little endian read integers.
     #  @param self The object pointer.
     #  @param reg The first register of the first byte of the integer to read.
     def readInteger(self, reg):        
         try:
-            results = self.i2c.read(reg, 2)
-            return results[0] + (results[1]<<8)
+            self._fetch(reg, 2)
+            return u16(self.shadow, reg)
+        except:
+            return 0
+
+    ## Read consecutive unsigned 16 bit integers (little endian) in one transaction into an array.
+    #  @param self The object pointer.
+    #  @param reg The register of the first integer.
+    #  @param out The array('H') (or list) to fill, its length is the number of integers.
+    def readIntegerArray(self, reg, out):
+        try:
+            self._fetch(reg, 2 * len(out))
+            for i in range(len(out)):
+                out[i] = u16(self.shadow, reg + 2 * i)
         except:
-            return 0    
+            for i in range(len(out)):
+                out[i] = 0
+        return out
 
     ##  Read the vendor name of the i2c device
     #  @param self The object pointer.
@@ -202,6 +270,7 @@ class mindsensors_i2c():
 #  for read and write operations.
 class TFTPACK():
     TouchPoint =[0,0]
+    palette = Palette(32)
 
     ## Initialize the class with the i2c address of your TFTPack
     #  @param self The object pointer.
@@ -211,11 +280,29 @@ class TFTPACK():
         self.port = port
         # Initialize sensor port  as a uart device
         self.ser = UARTDevice(self.port, baudrate=115200)
+        ## Commands sent without ACK at most, see send_batch()
+        self.max_outstanding = 8
+        ## Bytes of unacknowledged commands at most, keeps the display input buffer from overflowing
+        self.max_bytes = 64
+        # sizes of the sent but not acknowledged commands, oldest first
+        self.pending = []
+        self.pending_bytes = 0
+        # ACK parser: reply holds the touch point bytes following 0x06
+        self.reply = bytearray(4)
+        self.reply_pos = 0
+        ## Recently used colors, shared by all TFTPacks
+        self.palette = TFTPACK.palette
+        self.encoder = CommandEncoder(self.palette)
         time.sleep(0.1)
 
 
+    ## RGB565 value of [R,G,B], served from the palette of recently used colors
     def rgb_hex565(self,RGB):
-            return( ((int(RGB[0] / 255 * 31) << 11) | (int(RGB[1] / 255 * 63) << 5) | (int(RGB[2] / 255 * 31))))
+            return self.palette.lookup(RGB)
+
+    ## RGB565 values of a list of [R,G,B] colors as array('H')
+    def rgb_hex565_list(self,colors):
+            return rgb565_list(colors)
     
 
 
@@ -224,26 +311,86 @@ class TFTPACK():
         #if len(str(data) >15:
         #    self.port.write(str(data)[:15])
 
+    ## Parses ACK replies (0x06 followed by the touch point x, y) and updates TouchPoint.
+    #  @param self The object pointer.
+    #  @param block Wait until at least one ACK arrived?
+    #  @return Number of ACKs parsed.
+    def poll(self, block = False):
+        acks = 0
+        while True:
+            n = self.ser.waiting()
+            if n == 0:
+                if not block or acks:
+                    return acks
+                n = 1
+            for b in self.ser.read(n):
+                if self.reply_pos == 0:
+                    if b == 0x06:
+                        self.reply_pos = 1
+                    continue
+                self.reply[self.reply_pos - 1] = b
+                self.reply_pos = self.reply_pos + 1
+                if self.reply_pos == 5:
+                    self.reply_pos = 0
+                    self.TouchPoint[0] = self.reply[0] | (self.reply[1] << 8)
+                    self.TouchPoint[1] = self.reply[2] | (self.reply[3] << 8)
+                    if self.pending:
+                        self.pending_bytes = self.pending_bytes - self.pending.pop(0)
+                    acks = acks + 1
+
+    ## Waits until all sent commands are acknowledged.
+    #  @param self The object pointer.
+    def drain(self):
+        while self.pending:
+            self.poll(True)
+
     ## Writes command to TFTpack
     #  @param self The object pointer.
     #  @param command Value to write to the command register.
     def write_command(self, command):
-
         self.ser.write(command)
-        go =1
-        while go:
-            inc =self.ser.read(1)
-            if inc == b'\x06':
-                time.sleep(0.004)
-                self.TouchPoint[0] = int.from_bytes(self.ser.read(2), "little")
-                self.TouchPoint[1] = int.from_bytes(self.ser.read(2), "little")
-                #print(self.TouchPoint)
-                go =0
+        self.pending.append(len(command))
+        self.pending_bytes = self.pending_bytes + len(command)
+        self.drain()
+
+    ## Starts a batch of drawing commands, send it with send_batch()
+    #  @param self The object pointer.
+    def batch(self):
+        return TFTBATCH(self)
+
+    ## Sends a batch of commands in bursts, keeping at most max_outstanding commands
+    #  and max_bytes bytes unacknowledged instead of waiting for every single ACK.
+    #  @param self The object pointer.
+    #  @param batch The TFTBATCH to send.
+    #  @param wait Wait for the last ACK? Otherwise call poll() or drain() later.
+    def send_batch(self, batch, wait = True):
+        ends = batch.ends
+        data = batch.data
+        i = 0
+        while i < len(ends):
+            start = ends[i - 1] if i else 0
+            j = i
+            while j < len(ends) and len(self.pending) + j - i < self.max_outstanding:
+                if self.pending_bytes + ends[j] - start > self.max_bytes and (j > i or self.pending):
+                    break
+                j = j + 1
+            if j == i:
+                self.poll(True)
+                continue
+            self.ser.write(bytes(data[start:ends[j - 1]]))
+            for k in range(i, j):
+                size = ends[k] - (ends[k - 1] if k else 0)
+                self.pending.append(size)
+                self.pending_bytes = self.pending_bytes + size
+            i = j
+            self.poll()
+        if wait:
+            self.drain()
                 
     ## Clears the TFTPack display
     #  @param self The object pointer.
     def clear_display(self):
-        self.write_command(b'\x01'+ b'\x00')
+        self.write_command(self.encode_clear_display())
 
     def get_touch(self):
         self.write_command(b'\x01'+ b'\x02')
@@ -269,19 +416,19 @@ class TFTPACK():
     #  @param self The object pointer.
     #   @param  Xpos and Ypos
     def set_curser_xy(self, xpos,ypos):
-        self.write_command(b'\x01' + b'\x18'+xpos.to_bytes(2, 'little')+ypos.to_bytes(2, 'little'))    
+        self.write_command(self.encode_set_curser_xy(xpos, ypos))
 
     ## set_color of  TFTPack display text to [R,G,B]
     #  @param self The object pointer.
     #  @param RGB tuple  as [R,G,B]
     def set_color(self,RGB):
-        self.write_command(b'\x01' + b'\x07'+self.rgb_hex565(RGB).to_bytes(2, 'little') ) 
+        self.write_command(self.encode_set_color(RGB))
         
     ## set_font_size of  TFTPack display text 
     #  @param self The object pointer.
     #  @param size  of font
     def set_font_size(self,size):
-        self.write_command(b'\x01' + b'\x06'+size.to_bytes(1, 'little')) 
+        self.write_command(self.encode_set_font_size(size))
      
   
 
@@ -292,11 +439,11 @@ class TFTPACK():
     #  @param RGB tuple  as [R,G,B]
     
     def draw_line(self,start,end,RGB):
-        self.write_command(b'\x01' + b'\x0C'+start[0].to_bytes(2, 'little')+start[1].to_bytes(2, 'little')+end[0].to_bytes(2, 'little')+end[1].to_bytes(2, 'little')+self.rgb_hex565(RGB).to_bytes(2, 'little'))  
+        self.write_command(self.encode_draw_line(start, end, RGB))
    
    
     def draw_pixel(self,position,RGB):
-        self.write_command(b'\x01' + b'\x10'+position[0].to_bytes(2, 'little')+position[1].to_bytes(2, 'little')+self.rgb_hex565(RGB).to_bytes(2, 'little'))  
+        self.write_command(self.encode_draw_pixel(position, RGB))
 
 
 
@@ -308,8 +455,7 @@ class TFTPACK():
     #  @param fill bool  as True of False
     
     def draw_circle(self,center,radius,RGB,fill):
-        if fill ==True: self.write_command(b'\x01' + b'\x43'+center[0].to_bytes(2, 'little')+center[1].to_bytes(2, 'little')+radius.to_bytes(1, 'little')+self.rgb_hex565(RGB).to_bytes(2, 'little'))  
-        else :self.write_command(b'\x01' + b'\x03'+center[0].to_bytes(2, 'little')+center[1].to_bytes(2, 'little')+radius.to_bytes(1, 'little')+self.rgb_hex565(RGB).to_bytes(2, 'little'))  
+        self.write_command(self.encode_draw_circle(center, radius, RGB, fill))
      
     ## draw_rectangle on  TFTPack display at topleft  width and hight with curved corner of radius and with Color RGB, W/WO fill
     #  @param self The object pointer.
@@ -321,12 +467,7 @@ class TFTPACK():
     #  @param fill bool  as True of False
     
     def draw_rectangle(self,topleft,width,hight,radius,RGB,fill):
-        if radius ==0:
-            if fill ==True: self.write_command(b'\x01' + b'\x4F'+topleft[0].to_bytes(2, 'little')+topleft[1].to_bytes(2, 'little')+width.to_bytes(2, 'little')+hight.to_bytes(2, 'little')+self.rgb_hex565(RGB).to_bytes(2, 'little'))  
-            else :self.write_command(b'\x01' + b'\x0F'+topleft[0].to_bytes(2, 'little')+topleft[1].to_bytes(2, 'little')+width.to_bytes(2, 'little')+hight.to_bytes(2, 'little')+self.rgb_hex565(RGB).to_bytes(2, 'little'))  
-        else :
-            if fill ==True: self.write_command(b'\x01' + b'\x59'+topleft[0].to_bytes(2, 'little')+topleft[1].to_bytes(2, 'little')+width.to_bytes(2, 'little')+hight.to_bytes(2, 'little')+radius.to_bytes(1, 'little')+self.rgb_hex565(RGB).to_bytes(2, 'little'))  
-            else :self.write_command(b'\x01' + b'\x19'+topleft[0].to_bytes(2, 'little')+topleft[1].to_bytes(2, 'little')+width.to_bytes(2, 'little')+hight.to_bytes(2, 'little')+radius.to_bytes(1, 'little')+self.rgb_hex565(RGB).to_bytes(2, 'little'))  
+        self.write_command(self.encode_draw_rectangle(topleft, width, hight, radius, RGB, fill))
 
                         
     ## draw_triangle on  TFTPack display from vertex1 ,vertex2 and vertex3 with Color RGB, W/WO fill
@@ -338,9 +479,96 @@ class TFTPACK():
     #  @param fill bool  as True of False
     
     def draw_triangle(self,vertex1,vertex2,vertex3,RGB,fill):
-        if fill ==True: self.write_command(b'\x01' + b'\x4E'+vertex1[0].to_bytes(2, 'little')+vertex1[1].to_bytes(2, 'little')+vertex2[0].to_bytes(2, 'little')+vertex2[1].to_bytes(2, 'little')+vertex3[0].to_bytes(2, 'little')+vertex3[1].to_bytes(2, 'little')+self.rgb_hex565(RGB).to_bytes(2, 'little'))  
-        else :self.write_command(b'\x01' + b'\x0E'+vertex1[0].to_bytes(2, 'little')+vertex1[1].to_bytes(2, 'little')+vertex2[0].to_bytes(2, 'little')+vertex2[1].to_bytes(2, 'little')+vertex3[0].to_bytes(2, 'little')+vertex3[1].to_bytes(2, 'little')+self.rgb_hex565(RGB).to_bytes(2, 'little'))  
-    
+        self.write_command(self.encode_draw_triangle(vertex1, vertex2, vertex3, RGB, fill))
+
+    ## Command encoders, they return the command for write_command() or a TFTBATCH.
+    #  The result is a view of the encoder buffer, valid until the next command is encoded.
+
+    def encode_clear_display(self):
+        return self.encoder.simple(0x00)
+
+    def encode_set_curser_xy(self, xpos,ypos):
+        return self.encoder.set_curser_xy(xpos, ypos)
+
+    def encode_set_color(self,RGB):
+        return self.encoder.set_color(RGB)
+
+    def encode_set_font_size(self,size):
+        return self.encoder.set_font_size(size)
+
+    def encode_draw_line(self,start,end,RGB):
+        return self.encoder.draw_line(start, end, RGB)
+
+    def encode_draw_pixel(self,position,RGB):
+        return self.encoder.draw_pixel(position, RGB)
+
+    def encode_draw_circle(self,center,radius,RGB,fill):
+        return self.encoder.draw_circle(center, radius, RGB, fill)
+
+    def encode_draw_rectangle(self,topleft,width,hight,radius,RGB,fill):
+        return self.encoder.draw_rectangle(topleft, width, hight, radius, RGB, fill)
+
+    def encode_draw_triangle(self,vertex1,vertex2,vertex3,RGB,fill):
+        return self.encoder.draw_triangle(vertex1, vertex2, vertex3, RGB, fill)
+
+
+## TFTBATCH: drawing commands for a TFTPACK collected in one buffer, sent by TFTPACK.send_batch()
+#  @remark
+#  @code
+#  batch = tft.batch()
+#  batch.clear_display()
+#  for i in range(50):
+#      batch.draw_pixel([i, i], [255, 0, 0])
+#  tft.send_batch(batch)
+#  @endcode
+class TFTBATCH():
+
+    def __init__(self, tft):
+        self.tft = tft
+        self.data = bytearray()
+        ## End offset of every command in data
+        self.ends = []
+
+    def __len__(self):
+        return len(self.ends)
+
+    ## Adds an encoded command.
+    def add(self, command):
+        self.data.extend(command)
+        self.ends.append(len(self.data))
+
+    ## Removes all commands, the batch can be filled again.
+    def clear(self):
+        self.data = bytearray()
+        self.ends = []
+
+    def clear_display(self):
+        self.add(self.tft.encode_clear_display())
+
+    def set_curser_xy(self, xpos, ypos):
+        self.add(self.tft.encode_set_curser_xy(xpos, ypos))
+
+    def set_color(self, RGB):
+        self.add(self.tft.encode_set_color(RGB))
+
+    def set_font_size(self, size):
+        self.add(self.tft.encode_set_font_size(size))
+
+    def draw_line(self, start, end, RGB):
+        self.add(self.tft.encode_draw_line(start, end, RGB))
+
+    def draw_pixel(self, position, RGB):
+        self.add(self.tft.encode_draw_pixel(position, RGB))
+
+    def draw_circle(self, center, radius, RGB, fill):
+        self.add(self.tft.encode_draw_circle(center, radius, RGB, fill))
+
+    def draw_rectangle(self, topleft, width, hight, radius, RGB, fill):
+        self.add(self.tft.encode_draw_rectangle(topleft, width, hight, radius, RGB, fill))
+
+    def draw_triangle(self, vertex1, vertex2, vertex3, RGB, fill):
+        self.add(self.tft.encode_draw_triangle(vertex1, vertex2, vertex3, RGB, fill))
+
 
 
 
@@ -448,80 +676,273 @@ class DIST_ToF(mindsensors_i2c):
         return self.readToF()/25.4   
 
 
+## RFIDTRANSFER: one block read or write queued on an EV3RFid
+class RFIDTRANSFER():
+
+    def __init__(self, command, BlockID, data = None):
+        ## 'R' or 'W'
+        self.command = command
+        self.BlockID = BlockID
+        ## 16 data bytes, filled in by a read (also if it timed out)
+        self.data = data
+        self.done = False
+        ## False if the card did not answer in time
+        self.ok = False
+        ## Time from issuing the command to its completion in ms
+        self.elapsed = 0
+        ## UID of the card when the transfer was queued
+        self.uid = 0
+
+
+## RFIDCACHE: blocks already read from RFID cards, keyed by card UID and block id.
+#  Least recently used blocks are dropped when the cache exceeds max_bytes.
+#  One cache can be shared by several EV3RFid readers.
+class RFIDCACHE():
+
+    ## Bytes counted per cached block: the data and its bookkeeping
+    ENTRY_BYTES = 48
+
+    def __init__(self, max_bytes = 2048):
+        self.max_bytes = max_bytes
+        self.blocks = {}
+        # keys, least recently used first
+        self.order = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.order)
+
+    def key(self, uid, BlockID):
+        return (uid << 8) | BlockID
+
+    ## Cached block data or None.
+    def get(self, uid, BlockID):
+        key = self.key(uid, BlockID)
+        data = self.blocks.get(key)
+        if data is None:
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        if self.order[-1] != key:
+            self.order.remove(key)
+            self.order.append(key)
+        return data
+
+    def put(self, uid, BlockID, data):
+        key = self.key(uid, BlockID)
+        if key in self.blocks:
+            self.order.remove(key)
+        self.blocks[key] = bytes(data)
+        self.order.append(key)
+        while len(self.order) * self.ENTRY_BYTES > self.max_bytes:
+            del self.blocks[self.order.pop(0)]
+
+    ## Drop a block, or all blocks of a card for BlockID None.
+    def invalidate(self, uid, BlockID = None):
+        if BlockID is not None:
+            keys = [self.key(uid, BlockID)]
+        else:
+            keys = [key for key in self.order if key >> 8 == uid]
+        for key in keys:
+            if key in self.blocks:
+                del self.blocks[key]
+                self.order.remove(key)
+
+    def clear(self):
+        self.blocks = {}
+        self.order = []
+        self.hits = 0
+        self.misses = 0
+
+
 ## EV3RFid : this class provides EV3Dev specific interface for the  EV3RFid
 #  for read and write operations.
+#  Block transfers run as a queue: startRead()/startWrite() return at once,
+#  poll() advances the transfers without blocking, polling the command
+#  register (it reads back the command until the card is done) with backoff.
+#  @code
+#  transfers = [rfid.startRead(block) for block in (4, 5, 6)]
+#  rfid.waitAll()
+#  print([t.data for t in transfers])
+#  @endcode
+#  With an RFIDCACHE, reads of blocks already read from the same card (UID) finish at once.
 class EV3RFid(mindsensors_i2c):
-    def __init__(self, port,i2c_address=0x22):
+
+    ## Command register
+    command_reg = 0x41
+    ## UID register (long)
+    uid_reg = 0x44
+    ## Block id register, directly followed by the 16 data registers
+    block_reg = 0x4F
+    ## Data registers 0x50-0x5F
+    data_reg = 0x50
+
+    def __init__(self, port,i2c_address=0x22, cache = None):
         mindsensors_i2c.__init__(self,port, i2c_address)
+        ## RFIDCACHE or None
+        self.cache = cache
+        ## First and longest poll interval of the command register in ms
+        self.min_poll_ms = 10
+        self.max_poll_ms = 50
+        ## Time in ms after which a transfer is given up
+        self.timeout_ms = 3000
+        self.queue = []
+        self.current = None
+        self.watch = StopWatch()
+        self.started_ms = 0
+        self.next_ms = 0
+        self.backoff_ms = 0
 
     ## Clear UID stored in device .
     #  @param self The object pointer.
     def clearUID(self):
         self.writeByte(65,'C')
 
+    ## Queue a block read.
+    #  @param self The object pointer.
+    #  @param BlockID The block id to read.first 4 block and every 4th block can not be used
+    #  @return RFIDTRANSFER, its data is set when done
+    def startRead(self, BlockID):
+        transfer = RFIDTRANSFER('R', BlockID)
+        if self.cache is not None:
+            transfer.uid = self.readUID()
+            data = self.cache.get(transfer.uid, BlockID) if transfer.uid else None
+            if data is not None:
+                transfer.data = data
+                transfer.done = True
+                transfer.ok = True
+                return transfer
+        self.queue.append(transfer)
+        self.poll()
+        return transfer
+
+    ## Queue a block write.
+    #  @param self The object pointer.
+    #  @param BlockID The block id to write.first 4 block and every 4th block can not be used
+    #  @param data Up to 16 bytes (bytes, bytearray, list of ints or str), padded with zeros
+    #  @return RFIDTRANSFER
+    def startWrite(self, BlockID, data):
+        if isinstance(data, str):
+            data = data.encode()
+        block = bytearray(16)
+        block[0:min(len(data), 16)] = bytes(data[:16])
+        transfer = RFIDTRANSFER('W', BlockID, block)
+        if self.cache is not None:
+            transfer.uid = self.readUID()
+            self.cache.invalidate(transfer.uid, BlockID)
+        self.queue.append(transfer)
+        self.poll()
+        return transfer
+
+    ## Advance the queued transfers without blocking.
+    #  @param self The object pointer.
+    #  @return Number of unfinished transfers.
+    def poll(self):
+        now = self.watch.time()
+        if self.current is not None and now >= self.next_ms:
+            transfer = self.current
+            if self.readByte(self.command_reg) == 0:
+                if transfer.command == 'R':
+                    transfer.data = self.readArray(self.data_reg, 16)
+                    # a write queued after the read makes its data stale
+                    if self.cache is not None and transfer.uid and not self.writePending(transfer.uid, transfer.BlockID):
+                        self.cache.put(transfer.uid, transfer.BlockID, transfer.data)
+                elif self.cache is not None and transfer.uid:
+                    self.cache.put(transfer.uid, transfer.BlockID, transfer.data)
+                transfer.ok = True
+                self.finish(now)
+            elif now - self.started_ms >= self.timeout_ms:
+                if transfer.command == 'R':
+                    # whatever the data registers hold, as the blocking reads returned after their sleep
+                    transfer.data = self.readArray(self.data_reg, 16)
+                self.finish(now)
+            else:
+                self.backoff_ms = min(2 * self.backoff_ms, self.max_poll_ms)
+                self.next_ms = now + self.backoff_ms
+        if self.current is None and self.queue:
+            transfer = self.queue.pop(0)
+            if transfer.command == 'W':
+                # block id and data in one transaction
+                self.writeArray(self.block_reg, bytes((transfer.BlockID,)) + transfer.data)
+            else:
+                self.writeByte(self.block_reg, bytes((transfer.BlockID,)))
+            self.writeByte(self.command_reg, transfer.command)
+            self.current = transfer
+            self.started_ms = self.watch.time()
+            self.backoff_ms = self.min_poll_ms
+            self.next_ms = self.started_ms + self.backoff_ms
+        return len(self.queue) + (self.current is not None)
+
+    ## Check if a write to a block of a card is queued.
+    #  @param self The object pointer.
+    #  @param uid The card UID.
+    #  @param BlockID The block id.
+    def writePending(self, uid, BlockID):
+        for t in self.queue:
+            if t.command == 'W' and t.uid == uid and t.BlockID == BlockID:
+                return True
+        return False
+
+    def finish(self, now):
+        self.current.done = True
+        self.current.elapsed = now - self.started_ms
+        self.current = None
+
+    ## Steps for the Scheduler, runs until all queued transfers are done.
+    #  @param self The object pointer.
+    def transferSteps(self):
+        while self.poll():
+            yield max(self.next_ms - self.watch.time(), 1)
+
+    ## Block until a transfer (None: all queued transfers) is done.
+    #  @param self The object pointer.
+    #  @param transfer The RFIDTRANSFER to wait for.
+    #  @return True if the transfer succeeded (all transfers for None)
+    def waitAll(self, transfer = None):
+        transfers = [transfer] if transfer is not None else self.queue + ([self.current] if self.current is not None else [])
+        while self.poll() and not all([t.done for t in transfers]):
+            wait(max(self.next_ms - self.watch.time(), 1))
+        return all([t.ok for t in transfers])
+
     ## Read a EEPROM stored data block from RFid card and return in Array  .
     #  @param self The object pointer.
     #  @param BlockID The block id to read.first 4 block and every 4th block can not be used    
     def ReadBlockArray(self,BlockID):
-        self.writeByte(0x4f,str(BlockID))
-        self.writeByte(0x41,'R')
-        time.sleep(2)
-        return self.readArray(0x50,16)
+        transfer = self.startRead(BlockID)
+        self.waitAll(transfer)
+        return transfer.data
 
     ## Read a EEPROM stored data block from RFid card and return in String  .
     #  @param self The object pointer.
     #  @param BlockID The block id to read.first 4 block and every 4th block can not be used  
     def ReadBlockString(self,BlockID):
-        self.writeByte(0x4f,str(BlockID))
-        self.writeByte(0x41,'R')
-        time.sleep(2)
-        return self.readString(0x50,16)
+        return self.ReadBlockArray(BlockID)
 
     ## Write a string in EEPROM data block of RFid card .
     #  @param self The object pointer.
     #  @param BlockID The block id to read.first 4 block and every 4th block can not be used  
     #  @param dataString The string to store
+    #  @return 16, or 0 if the card did not confirm the write in time
     def WriteBlockString(self,BlockID,dataString):
-        count = 0
-        
-        
-        self.writeByte(0x4f,str(BlockID))
-        for elem in dataString :
-            if count < 16 : 
-                self.writeByte(0x50+count,str(elem))
-                count = count+1
-        while count < 16  :
-            self.writeByte(0x50+count,b'x0')
-            count = count+1
-
-        self.writeByte(0x41,'W')
-        
-        return count
+        if self.waitAll(self.startWrite(BlockID, dataString)):
+            return 16
+        return 0
 
     ## Write a Data Array in EEPROM data block of RFid card .
     #  @param self The object pointer.
     #  @param BlockID The block id to read.first 4 block and every 4th block can not be used  
     #  @param dataString The string to store
+    #  @return 16, or 0 if the card did not confirm the write in time
     def WriteBlockArray(self,BlockID,data):
-        count = 0
-        self.writeByte(0x4f,str(BlockID))
-        for elem in data :
-            if count < 16 : 
-                self.writeByte(0x50+count,str(elem))
-                count = count+1
-        while count < 16  :
-            self.writeByte(0x50+count,b'x0')
-            count = count+1
-
-        self.writeByte(0x41,'W')
-        
-        return count
+        if self.waitAll(self.startWrite(BlockID, data)):
+            return 16
+        return 0
 
     ## Read a UID  from RFid card and return   .
     #  @param self The object pointer.
     def  readUID(self):
-        results = self.readArray(0x44,4)
-        return self.readLong(0x44)
+        return self.readLong(self.uid_reg)
 
 
 
@@ -564,6 +985,40 @@ class IRThermometer(mindsensors_i2c):
         return (float(self.readInteger(self.IRT_TARGET_FAHR))/100)
 
 
+## LINEFRAME: LineLeader registers 0x42-0x50 from one read, filled by LINELEADER.ReadLineFrame().
+class LINEFRAME():
+    __slots__ = ('data',)
+
+    ## Number of registers, 0x42-0x50
+    SIZE = 15
+
+    def __init__(self):
+        self.data = bytearray(self.SIZE)
+
+    ## Steering value (signed)
+    @property
+    def steering(self):
+        return s8(self.data, 0)
+
+    ## Average weighted position of the line
+    @property
+    def average(self):
+        return self.data[1]
+
+    ## One bit per sensor seeing the line
+    @property
+    def result(self):
+        return self.data[2]
+
+    @property
+    def setpoint(self):
+        return self.data[3]
+
+    ## Calibrated value of sensor index (0-7), does not allocate.
+    def calibrated(self, index):
+        return self.data[7 + index]
+
+
 ## LINELEADER: this class provides functions for Lineleader from mindsensors.com
 #  for read and write operations.
 class LINELEADER(mindsensors_i2c):
@@ -603,6 +1058,11 @@ class LINELEADER(mindsensors_i2c):
     def __init__(self,  port,ll_address = LL_ADDRESS):
         #the LSA address
         mindsensors_i2c.__init__(self, port, ll_address )
+        self.uncalibrated = array('H', [0] * 8)
+        self.frame = LINEFRAME()
+        ## Host side calibration (linecal.CalibrationProfile) used by ReadNormalized()
+        self.profile = None
+        self.normalized = bytearray(8)
 
     ## Writes a value to the command register
     #  @param self The object pointer.
@@ -636,20 +1096,30 @@ class LINELEADER(mindsensors_i2c):
         return self.readArray(self.LL_CALIBRATED, 8)
         
 
-    ## Reads the eight(8) uncalibrated light sensor values of the LightSensorArray
+    ## Reads the eight(8) uncalibrated light sensor values of the LightSensorArray in one transaction
     #  @param self The object pointer.
+    #  @return array('H') of the 8 values, the same array is refilled by every call
     def ReadRaw_Uncalibrated(self):
-        
-        s1 = self.readInteger(self.LL_UNCALIBRATED)
-        s2 = self.readInteger(self.LL_UNCALIBRATED + 2)
-        s3 = self.readInteger(self.LL_UNCALIBRATED + 4)
-        s4 = self.readInteger(self.LL_UNCALIBRATED + 6)
-        s5 = self.readInteger(self.LL_UNCALIBRATED + 8)
-        s6 = self.readInteger(self.LL_UNCALIBRATED + 10)
-        s7 = self.readInteger(self.LL_UNCALIBRATED + 12)
-        s8 = self.readInteger(self.LL_UNCALIBRATED + 14)
-        array = [s1, s2, s3, s4, s5, s6, s7, s8]
-        return array
+        return self.readIntegerArray(self.LL_UNCALIBRATED, self.uncalibrated)
+
+    ## Reads the uncalibrated values in one transaction and normalizes them with the host side calibration profile
+    #  @param self The object pointer.
+    #  @return bytearray of the 8 values, 0 (black) .. 100 (white), refilled by every call
+    def ReadNormalized(self):
+        if self.profile is None:
+            raise ValueError("no calibration profile, capture or load one first")
+        return self.profile.normalize(self.ReadRaw_Uncalibrated(), self.normalized)
+
+    ## Reads steering, average, result, setpoint, PID values and the eight calibrated sensor values (0x42-0x50) in one transaction
+    #  @param self The object pointer.
+    #  @param frame LINEFRAME to fill, None refills the LINEFRAME of this LINELEADER
+    #  @return The LINEFRAME
+    def ReadLineFrame(self, frame = None):
+        if frame is None:
+            frame = self.frame
+        self._fetch(self.LL_STEERING, LINEFRAME.SIZE)
+        frame.data[0:LINEFRAME.SIZE] = self.shadow_view[self.LL_STEERING:self.LL_STEERING + LINEFRAME.SIZE]
+        return frame
        
 
     ## Read the steering value from the Lineleader (add or subtract this value to the motor speed)
@@ -769,6 +1239,10 @@ class LSA(mindsensors_i2c):
     def __init__(self,  port,lsa_address = LSA_ADDRESS):
         #the LSA address
         mindsensors_i2c.__init__(self, port, lsa_address)
+        self.uncalibrated = array('H', [0] * 8)
+        ## Host side calibration (linecal.CalibrationProfile) used by ReadNormalized()
+        self.profile = None
+        self.normalized = bytearray(8)
  
     ## Writes a value to the command register
     #  @param self The object pointer.
@@ -802,19 +1276,19 @@ class LSA(mindsensors_i2c):
         return self.readArray(self.LSA_CALIBRATED, 8)
         
 
-    ## Reads the eight(8) uncalibrated light sensor values of the LightSensorArray
+    ## Reads the eight(8) uncalibrated light sensor values of the LightSensorArray in one transaction
     #  @param self The object pointer.
+    #  @return array('H') of the 8 values, the same array is refilled by every call
     def ReadRaw_Uncalibrated(self):
-        s1 = self.readInteger(self.LSA_UNCALIBRATED)
-        s2 = self.readInteger(self.LSA_UNCALIBRATED + 2)
-        s3 = self.readInteger(self.LSA_UNCALIBRATED + 4)
-        s4 = self.readInteger(self.LSA_UNCALIBRATED + 6)
-        s5 = self.readInteger(self.LSA_UNCALIBRATED + 8)
-        s6 = self.readInteger(self.LSA_UNCALIBRATED + 10)
-        s7 = self.readInteger(self.LSA_UNCALIBRATED + 12)
-        s8 = self.readInteger(self.LSA_UNCALIBRATED + 14)
-        array = [s1, s2, s3, s4, s5, s6, s7, s8]
-        return array
+        return self.readIntegerArray(self.LSA_UNCALIBRATED, self.uncalibrated)
+
+    ## Reads the uncalibrated values in one transaction and normalizes them with the host side calibration profile
+    #  @param self The object pointer.
+    #  @return bytearray of the 8 values, 0 (black) .. 100 (white), refilled by every call
+    def ReadNormalized(self):
+        if self.profile is None:
+            raise ValueError("no calibration profile, capture or load one first")
+        return self.profile.normalize(self.ReadRaw_Uncalibrated(), self.normalized)
 
 
  ## BLOB: this class is a subclass of NXTCAM. There is no need to call this class directly.
@@ -835,6 +1309,72 @@ class BLOB():
         self.right = right
         self.bottom = bottom
 
+## BLOBVIEW: accessor for one blob inside a BLOBS table, no data is copied.
+class BLOBVIEW():
+    __slots__ = ('data', 'offset')
+
+    ## Initialize the view on blob index of a BLOBS table.
+    #  @param self The object pointer.
+    #  @param data The bytearray of the BLOBS table.
+    #  @param index The index of the blob (0-7).
+    def __init__(self, data, index):
+        self.data = data
+        self.offset = index * 5
+
+    @property
+    def color(self):
+        return self.data[self.offset]
+
+    @property
+    def left(self):
+        return self.data[self.offset + 1]
+
+    @property
+    def top(self):
+        return self.data[self.offset + 2]
+
+    @property
+    def right(self):
+        return self.data[self.offset + 3]
+
+    @property
+    def bottom(self):
+        return self.data[self.offset + 4]
+
+## BLOBS: all tracked objects of an NXTCAM as one 40 byte table, filled by NXTCAM.getAllBlobs().
+#  Blob i is stored as color, left, top, right, bottom at data[5*i].
+class BLOBS():
+    __slots__ = ('data', 'count')
+
+    def __init__(self):
+        self.data = bytearray(40)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    ## Returns a BLOBVIEW on blob index (0 based).
+    def __getitem__(self, index):
+        if index < 0 or index >= self.count:
+            raise IndexError("blob index out of range")
+        return BLOBVIEW(self.data, index)
+
+    ## Color of blob index, same for left(), top(), right() and bottom(). These do not allocate.
+    def color(self, index):
+        return self.data[index * 5]
+
+    def left(self, index):
+        return self.data[index * 5 + 1]
+
+    def top(self, index):
+        return self.data[index * 5 + 2]
+
+    def right(self, index):
+        return self.data[index * 5 + 3]
+
+    def bottom(self, index):
+        return self.data[index * 5 + 4]
+
 ## NXTCAM: this class provides functions for models of the NXTCAM and PixyAdapter from mindsensors.com
 #  for read and write operations.
 class NXTCAM(mindsensors_i2c):
@@ -862,6 +1402,8 @@ class NXTCAM(mindsensors_i2c):
     #  @remark
     def __init__(self,port, nxtcam_address = NXTCAM_ADDRESS):
         mindsensors_i2c.__init__(self, port,nxtcam_address)
+        ## Result table reused by getAllBlobs()
+        self.blobs = BLOBS()
 
     ## Writes a value to the command register
     #  @param self The object pointer.
@@ -987,20 +1529,37 @@ class NXTCAM(mindsensors_i2c):
     #  print "Bottom: " + str(b.bottom)
     #  @endcode
     def getBlobs(self, blobNum = 1):
-        data= [0,0,0,0,0]
         blobs = self.getNumberObjects()
         i = blobNum - 1
         if (blobNum > blobs):
             print ("blobNum is greater than amount of blobs tracked.")
             return 0
         else:
-            #while(i < blobs):
-            data[0] = color = self.readByte(self.Color + (i*5))
-            data[1] = left = self.readByte(self.X_Top + (i*5))
-            data[2] = top = self.readByte(self.Y_Top + (i*5))
-            data[3] = right = self.readByte(self.X_Bottom + (i*5))
-            data[4] = bottom = self.readByte(self.Y_Bottom + (i*5))
+            color, left, top, right, bottom = self.readArray(self.Color + (i*5), 5)
             return BLOB(color,left,top,right,bottom)
+
+    ## Reads the number of objects and the data of all tracked objects in one transaction
+    #  @param self The object pointer.
+    #  @param result BLOBS table to fill, by default the one of this NXTCAM is reused.
+    #  @remark
+    #  To use this function in your program:
+    #  @code
+    #  blobs = cam.getAllBlobs()
+    #  for i in range(len(blobs)):
+    #      print(blobs.color(i), blobs.left(i), blobs.top(i), blobs.right(i), blobs.bottom(i))
+    #  @endcode
+    def getAllBlobs(self, result = None):
+        if result is None:
+            result = self.blobs
+        reg = self.NumberObjects
+        self._fetch(reg, 41)
+        # copied element by element from the shadow, a slice would allocate
+        shadow = self.shadow
+        data = result.data
+        for i in range(40):
+            data[i] = shadow[reg + 1 + i]
+        result.count = min(shadow[reg], 8)
+        return result
         
 
 ## @package mindsensors
@@ -1047,6 +1606,7 @@ class ABSIMU(mindsensors_i2c):
     #  @remark
     def __init__(self, port,absimu_address = ABSIMU_ADDRESS):
         mindsensors_i2c.__init__(self,port, absimu_address )
+        self.sample = IMUSAMPLE()
 
     ## Writes a value to the command register
     #  @param self The object pointer.
@@ -1072,9 +1632,11 @@ class ABSIMU(mindsensors_i2c):
     ## Reads the tilt values
     #  @param self The object pointer.
     def get_tiltall(self):
+        self.refresh(self.TILT_X, self.TILT_Z)
         res = [(self.get_tiltx(),
                     self.get_tilty(),
                     self.get_tiltz())]
+        self.invalidate()
         return res
         
 
@@ -1099,19 +1661,24 @@ class ABSIMU(mindsensors_i2c):
     ## Reads the accelerometer values
     #  @param self The object pointer.
     def get_accelall(self):
+        self.refresh(self.ACCEL_X, self.ACCEL_Z + 1)
         res = [(self.get_accelx(),
                 self.get_accely(),
                 self.get_accelz())]
+        self.invalidate()
         return res
         
 
-    ## Reads compass heading
+    ## Reads compass heading, an out of range reading is retried and then the last valid heading is returned
     #  @param self The object pointer.
-    def get_heading(self):
-        head = self.readInteger(self.CMPS)
-        while(head > 360 or head < 0):
+    #  @param retries Extra reads for an out of range heading.
+    def get_heading(self, retries = 2):
+        for attempt in range(retries + 1):
             head = self.readInteger(self.CMPS)
-        return head
+            if 0 <= head <= 360:
+                self.sample.heading = head
+                return head
+        return self.sample.heading
         
 
     ## Reads magnetometer value along the x-axis
@@ -1135,9 +1702,11 @@ class ABSIMU(mindsensors_i2c):
     ## Reads the magnetometer values
     #  @param self The object pointer.
     def get_magall(self):
+        self.refresh(self.MAG_X, self.MAG_Z + 1)
         res = [(self.get_magx(),
                     self.get_magy(),
                     self.get_magz())]
+        self.invalidate()
         return res
         
 
@@ -1162,12 +1731,43 @@ class ABSIMU(mindsensors_i2c):
     ## Reads the tilt values
     #  @param self The object pointer.
     def get_gyroall(self):
+        self.refresh(self.GYRO_X, self.GYRO_Z + 1)
         res = [(self.get_gyrox(),
                     self.get_gyroy(),
                     self.get_gyroz())]
+        self.invalidate()
         return res
        
 
+    ## Reads all axes (0x42-0x58) in one transaction into a sample.
+    #  The heading is checked in the same buffer, a sample with an out of range
+    #  heading is read again as a whole so tilt, accel, mag and gyro stay coherent.
+    #  @param self The object pointer.
+    #  @param sample IMUSAMPLE to fill, None uses the one owned by the sensor.
+    #  @param retries Extra reads for an out of range heading.
+    #  @return The sample, sample.valid is False if every read had a bad heading.
+    def read_all(self, sample = None, retries = 2):
+        if sample is None:
+            sample = self.sample
+        start = self.TILT_X
+        buf = self.shadow
+        for attempt in range(retries + 1):
+            self.invalidate()
+            self._fetch(start, self.GYRO_Z + 2 - start)
+            heading = u16(buf, self.CMPS)
+            if heading <= 360:
+                break
+        sample.timestamp = ticks_us()
+        sample.valid = heading <= 360
+        if sample.valid:
+            sample.heading = heading
+        for i in range(3):
+            sample.tilt[i] = s8(buf, self.TILT_X + i)
+            sample.accel[i] = s16(buf, self.ACCEL_X + 2 * i)
+            sample.mag[i] = s16(buf, self.MAG_X + 2 * i)
+            sample.gyro[i] = s16(buf, self.GYRO_X + 2 * i)
+        return sample
+
     ## Starts the compass calibration process
     #  @param self The object pointer.
     def start_cmpscal(self):
@@ -1204,6 +1804,28 @@ class ABSIMU(mindsensors_i2c):
         self.command(52)
         
 
+## IMUSAMPLE: one coherent sample of all AbsoluteIMU axes, filled in place by ABSIMU.read_all().
+class IMUSAMPLE():
+    __slots__ = ('tilt', 'accel', 'heading', 'mag', 'gyro', 'timestamp', 'valid')
+
+    def __init__(self):
+        ## x, y, z
+        self.tilt = array('h', [0, 0, 0])
+        self.accel = array('h', [0, 0, 0])
+        ## Compass heading 0-360, keeps the last valid value if the sample had none
+        self.heading = 0
+        self.mag = array('h', [0, 0, 0])
+        self.gyro = array('h', [0, 0, 0])
+        ## ticks_us() when the sample was read
+        self.timestamp = 0
+        ## False if the heading of the sample was out of range
+        self.valid = False
+
+    def __repr__(self):
+        return "IMUSAMPLE(tilt=%s, accel=%s, heading=%d, mag=%s, gyro=%s, timestamp=%d)" % (
+            list(self.tilt), list(self.accel), self.heading, list(self.mag), list(self.gyro), self.timestamp)
+
+
 ## CURRENT: this class provides functions for NXTCurrentMeter from mindsensors.com
 #  for read and write operations.
 class CURRENT(mindsensors_i2c):
@@ -1366,11 +1988,7 @@ class PFMATE(mindsensors_i2c):
     #  @param operationB Operation command for motor B (0 = Float, 1 = Forward, 2 = Reverse, 3 = Brake).
     #  @param speedB Speed of motor B (0-7).
     def controlBothMotors(self, channel, operationA, speedA, operationB, speedB):
-        array = [channel, 0x00, operationA, speedA, operationB, speedB]
-        self.writeArray(self.PFMATE_CHANNEL, array)
-        time.sleep(.1)
-        self.command('G')
-        time.sleep(.1)
+        run_steps(self.controlBothMotorsSteps(channel, operationA, speedA, operationB, speedB))
 
     ## Controls motor A
     #  @param self The object pointer.
@@ -1378,11 +1996,7 @@ class PFMATE(mindsensors_i2c):
     #  @param operationA Operation command for motor A (0 = Float, 1 = Forward, 2 = Reverse, 3 = Brake).
     #  @param speedA Speed of motor A (0-7).
     def controlMotorA(self, channel, operationA, speedA):
-        array = [channel, 0x01, operationA, speedA]
-        self.writeArray(self.PFMATE_CHANNEL, array)
-        time.sleep(.1)
-        self.command('G')
-        time.sleep(.1)
+        run_steps(self.controlMotorASteps(channel, operationA, speedA))
 
     ## Controls motor B
     #  @param self The object pointer.
@@ -1390,13 +2004,33 @@ class PFMATE(mindsensors_i2c):
     #  @param operationB Operation command for motor B (0 = Float, 1 = Forward, 2 = Reverse, 3 = Brake).
     #  @param speedB Speed of motor B (0-7).
     def controlMotorB(self, channel, operationB, speedB):
+        run_steps(self.controlMotorBSteps(channel, operationB, speedB))
+
+    ## Steps of controlBothMotors for the Scheduler, yields the IR transmission pauses in ms instead of sleeping.
+    def controlBothMotorsSteps(self, channel, operationA, speedA, operationB, speedB):
+        array = [channel, 0x00, operationA, speedA, operationB, speedB]
+        self.writeArray(self.PFMATE_CHANNEL, array)
+        yield 100
+        self.command('G')
+        yield 100
+
+    ## Steps of controlMotorA for the Scheduler, yields the IR transmission pauses in ms instead of sleeping.
+    def controlMotorASteps(self, channel, operationA, speedA):
+        array = [channel, 0x01, operationA, speedA]
+        self.writeArray(self.PFMATE_CHANNEL, array)
+        yield 100
+        self.command('G')
+        yield 100
+
+    ## Steps of controlMotorB for the Scheduler, yields the IR transmission pauses in ms instead of sleeping.
+    def controlMotorBSteps(self, channel, operationB, speedB):
         array = [channel, 0x02]
         array2 = [operationB, speedB]
         self.writeArray(self.PFMATE_CHANNEL, array)
         self.writeArray(self.PFMATE_OPER_B, array2)
-        time.sleep(.1)
+        yield 100
         self.command('G')
-        time.sleep(.1)
+        yield 100
 
 ## Sumoeyes : this class provides EV3Dev specific interface for the  Sumoeyes
 #  for read and write operations.
@@ -0,0 +1,134 @@
+#!/usr/bin/env pybricks-micropython
+
+# pidtune: offline tuning of the NXTMMX position PID.
+#
+#   from pidtune import PIDTuner
+#   tuner = PIDTuner(mux, motor = 1, step = 360)
+#   best = tuner.tune()
+#   print(best, tuner.best_ms)
+#
+# Every experiment writes a PID setting, runs a step move and measures the
+# settle time: the time until the encoder stays within band degrees of the
+# target. tune() does a coordinate search over the encoder gains and keeps
+# the setting with the shortest settle time, it is left written to the
+# NXTMMX. The steps alternate in direction so the mechanism stays in place.
+# Works the same on the simulator (sim.NXTMMXModel models the gains) and on
+# a real NXTMMX with the motor free to turn.
+
+from transport import StopWatch, wait
+
+
+## PIDTuner: step response experiments and gain search for one NXTMMX motor
+#  @param mux The NXTMMX.
+#  @param motor Motor number, 1 or 2.
+#  @param step Step size in degrees.
+#  @param speed The speed of the step moves.
+#  @param band Settling band in degrees.
+#  @param timeout Longest experiment in ms, slower settings score this.
+#  @param sample_ms Sampling interval in ms.
+class PIDTuner():
+
+    ## Gains searched by tune()
+    GAINS = ('encoder_kp', 'encoder_ki', 'encoder_kd')
+
+    def __init__(self, mux, motor = 1, step = 360, speed = 50, band = 5, timeout = 5000, sample_ms = 5):
+        self.mux = mux
+        self.motor = motor
+        self.step = step
+        self.speed = speed
+        self.band = band
+        self.timeout = timeout
+        self.sample_ms = sample_ms
+        self.encoder_reg = mux.m1_read_encoder_reg + 4 * (motor - 1)
+        self.status_reg = mux.m1_read_status_reg + motor - 1
+        self.direction = 1
+        ## (params, settle ms, overshoot degrees) of every experiment
+        self.results = []
+        self.best = None
+        self.best_ms = None
+
+    ## Encoder angle and status in one transaction.
+    def sample(self):
+        self.mux.refresh(self.encoder_reg, self.status_reg)
+        angle = self.mux.readLongSigned(self.encoder_reg)
+        status = self.mux.readByte(self.status_reg)
+        self.mux.invalidate()
+        return angle, status
+
+    ## Run one step response.
+    #  @param params PIDParams to test.
+    #  @return (settle time in ms, overshoot in degrees), the settle time is timeout if the move did not finish.
+    def experiment(self, params):
+        mux = self.mux
+        mux.write_pid(params)
+        start, status = self.sample()
+        step = self.step * self.direction
+        self.direction = -self.direction
+        target = start + step
+        if self.motor == 1:
+            mux.motor1_run_angle(self.speed, step, wait = False)
+        else:
+            mux.motor2_run_angle(self.speed, step, wait = False)
+        watch = StopWatch()
+        settled = None
+        overshoot = 0
+        while True:
+            angle, status = self.sample()
+            now = watch.time()
+            error = (angle - target) if step > 0 else (target - angle)
+            if error > overshoot:
+                overshoot = error
+            if abs(error) > self.band:
+                settled = None
+            elif settled is None:
+                settled = now
+            if not status & mux.status_position_control:
+                break
+            if now >= self.timeout:
+                if self.motor == 1:
+                    mux.motor1_stop()
+                else:
+                    mux.motor2_stop()
+                settled = None
+                break
+            wait(self.sample_ms)
+        settle_ms = self.timeout if settled is None else settled
+        self.results.append((params.copy(), settle_ms, overshoot))
+        return settle_ms, overshoot
+
+    ## Coordinate search over the encoder gains.
+    #  @param params Starting PIDParams, None reads them from the NXTMMX.
+    #  @param rounds Number of passes over all gains.
+    #  @param factors Scale factors tried for every gain.
+    #  @return The best PIDParams, also written to the NXTMMX.
+    def tune(self, params = None, rounds = 2, factors = (0.5, 0.75, 1.5, 2)):
+        if params is None:
+            params = self.mux.read_pid()
+        best = params.copy()
+        best_ms = self.experiment(best)[0]
+        for r in range(rounds):
+            improved = False
+            for gain in self.GAINS:
+                value = getattr(best, gain)
+                for factor in factors:
+                    candidate = best.copy()
+                    setattr(candidate, gain, min(int(value * factor) if value else int(8 * factor), 0xFFFF))
+                    if getattr(candidate, gain) == value:
+                        continue
+                    settle_ms = self.experiment(candidate)[0]
+                    if settle_ms < best_ms:
+                        best = candidate
+                        best_ms = settle_ms
+                        improved = True
+            if not improved:
+                break
+        self.mux.write_pid(best)
+        self.best = best
+        self.best_ms = best_ms
+        return best
+
+    ## Prints all experiments, fastest first.
+    def report(self):
+        print("%6s %6s %6s %9s %9s" % ("kP", "kI", "kD", "settle ms", "overshoot"))
+        for params, settle_ms, overshoot in sorted(self.results, key = lambda row: row[1]):
+            print("%6d %6d %6d %9d %9d" % (params.encoder_kp, params.encoder_ki, params.encoder_kd, settle_ms, overshoot))
@@ -0,0 +1,221 @@
+#!/usr/bin/env pybricks-micropython
+
+# profiler: counts the bus transactions of the drivers.
+#
+#   from profiler import Profiler
+#   prof = Profiler()
+#   mux = prof.attach(NXTMMX(Port.S3))
+#   mux.motor1_run_angle(50, 360)
+#   prof.report()
+#
+# attach() replaces the driver's bus device (i2c or ser) by a counting proxy
+# and wraps the driver's public methods so every transaction is booked on the
+# outermost driver method that caused it. Drivers which are not attached run
+# exactly the code they ran before, profiling costs nothing when it is off.
+#
+# Profiler(ring = N) only keeps the last N transactions in preallocated
+# arrays. It allocates nothing per transaction and can stay on in production,
+# report() then summarises what is in the ring.
+
+from array import array
+
+from transport import ticks_us, ticks_diff
+
+## Upper bounds of the latency histogram buckets in microseconds, the last bucket takes the rest
+BUCKETS_US = (500, 1000, 2000, 4000, 8000, 16000, 32000)
+NBUCKETS = len(BUCKETS_US) + 1
+
+## Sites are numbered, site 0 is bus traffic outside of any wrapped method
+DIRECT = "<direct>"
+
+
+## BusProxy: wraps a bus device and books every transaction
+class BusProxy():
+
+    def __init__(self, device, profiler):
+        self.device = device
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+
+## I2CProxy: BusProxy for an I2CDevice, same signatures so a call builds no argument tuple
+class I2CProxy(BusProxy):
+
+    def read(self, reg, length = 1):
+        start = ticks_us()
+        data = self.device.read(reg, length)
+        self.profiler.record(length, ticks_diff(ticks_us(), start))
+        return data
+
+    def write(self, reg, data = None):
+        start = ticks_us()
+        result = self.device.write(reg, data)
+        self.profiler.record(0 if data is None else 1 if isinstance(data, int) else len(data), ticks_diff(ticks_us(), start))
+        return result
+
+
+## UARTProxy: BusProxy for a UARTDevice
+class UARTProxy(BusProxy):
+
+    def read(self, length = 1):
+        start = ticks_us()
+        data = self.device.read(length)
+        self.profiler.record(length, ticks_diff(ticks_us(), start))
+        return data
+
+    def read_all(self):
+        start = ticks_us()
+        data = self.device.read_all()
+        self.profiler.record(len(data), ticks_diff(ticks_us(), start))
+        return data
+
+    def write(self, data):
+        start = ticks_us()
+        result = self.device.write(data)
+        self.profiler.record(len(data), ticks_diff(ticks_us(), start))
+        return result
+
+
+## Profiler: per driver method transaction counts, bytes, bus time and latency histograms
+#  @param ring Keep only the last ring transactions instead of full statistics.
+class Profiler():
+
+    def __init__(self, ring = 0):
+        self.ring = ring
+        self.names = [DIRECT]
+        self.site_ids = {DIRECT: 0}
+        self.current = 0
+        self.calls = array('I', [0])
+        self.transactions = array('I', [0])
+        self.nbytes = array('I', [0])
+        self.bus_us = array('I', [0])
+        self.max_us = array('I', [0])
+        self.histogram = array('I', [0] * NBUCKETS)
+        if ring:
+            self.ring_site = array('H', [0] * ring)
+            self.ring_bytes = array('H', [0] * ring)
+            self.ring_us = array('I', [0] * ring)
+            self.ring_pos = 0
+            self.ring_count = 0
+
+    ## Returns the site id for name, creating the counters on first use.
+    def site(self, name):
+        if name not in self.site_ids:
+            self.site_ids[name] = len(self.names)
+            self.names.append(name)
+            for counter in (self.calls, self.transactions, self.nbytes, self.bus_us, self.max_us):
+                counter.append(0)
+            for i in range(NBUCKETS):
+                self.histogram.append(0)
+        return self.site_ids[name]
+
+    ## Start profiling a driver, returns the driver.
+    #  @param driver Any driver with an i2c (I2CDevice) or ser (UARTDevice) attribute.
+    def attach(self, driver):
+        for attr, proxy in (('i2c', I2CProxy), ('ser', UARTProxy)):
+            device = getattr(driver, attr, None)
+            if device is not None and not isinstance(device, BusProxy):
+                setattr(driver, attr, proxy(device, self))
+        prefix = driver.__class__.__name__ + "."
+        wrapped = []
+        for name in dir(driver):
+            if name.startswith('_') or name in ('i2c', 'ser'):
+                continue
+            method = getattr(driver, name)
+            if callable(method) and not isinstance(method, type):
+                setattr(driver, name, self.wrap(self.site(prefix + name), method))
+                wrapped.append(name)
+        # MicroPython functions take no attributes, remember the wrapped names here
+        driver._profiled = wrapped
+        return driver
+
+    ## Stop profiling a driver.
+    def detach(self, driver):
+        for attr in ('i2c', 'ser'):
+            device = getattr(driver, attr, None)
+            if isinstance(device, BusProxy):
+                setattr(driver, attr, device.device)
+        for name in getattr(driver, '_profiled', ()):
+            delattr(driver, name)
+        driver._profiled = ()
+
+    def wrap(self, site, method):
+        profiler = self
+        def call(*args, **kwargs):
+            if profiler.current:
+                return method(*args, **kwargs)
+            profiler.current = site
+            profiler.calls[site] = profiler.calls[site] + 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                profiler.current = 0
+        return call
+
+    ## Books one transaction on the current site.
+    def record(self, nbytes, us):
+        site = self.current
+        if self.ring:
+            pos = self.ring_pos
+            self.ring_site[pos] = site
+            self.ring_bytes[pos] = nbytes
+            self.ring_us[pos] = us
+            self.ring_pos = (pos + 1) % self.ring
+            if self.ring_count < self.ring:
+                self.ring_count = self.ring_count + 1
+            return
+        self.transactions[site] = self.transactions[site] + 1
+        self.nbytes[site] = self.nbytes[site] + nbytes
+        self.bus_us[site] = self.bus_us[site] + us
+        if us > self.max_us[site]:
+            self.max_us[site] = us
+        bucket = 0
+        while bucket < NBUCKETS - 1 and us > BUCKETS_US[bucket]:
+            bucket = bucket + 1
+        self.histogram[site * NBUCKETS + bucket] = self.histogram[site * NBUCKETS + bucket] + 1
+
+    ## Clears all counters.
+    def clear(self):
+        for counter in (self.calls, self.transactions, self.nbytes, self.bus_us, self.max_us, self.histogram):
+            for i in range(len(counter)):
+                counter[i] = 0
+        if self.ring:
+            self.ring_pos = 0
+            self.ring_count = 0
+
+    ## Returns [(name, calls, transactions, bytes, bus_us, max_us, histogram)] sorted by bus time.
+    def summary(self):
+        if self.ring:
+            # rebuild the counters from the ring contents
+            stats = Profiler()
+            for name in self.names:
+                stats.site(name)
+            for i in range(self.ring_count):
+                stats.current = self.ring_site[i]
+                stats.record(self.ring_bytes[i], self.ring_us[i])
+            for i in range(len(self.names)):
+                stats.calls[i] = self.calls[i]
+            return stats.summary()
+        rows = []
+        for site in range(len(self.names)):
+            if self.transactions[site] == 0:
+                continue
+            rows.append((self.names[site], self.calls[site], self.transactions[site], self.nbytes[site],
+                         self.bus_us[site], self.max_us[site],
+                         list(self.histogram[site * NBUCKETS:(site + 1) * NBUCKETS])))
+        rows.sort(key = lambda row: row[4], reverse = True)
+        return rows
+
+    ## Prints the top driver methods by bus time.
+    #  @param top Number of methods to print.
+    #  @param histogram Also print the latency histogram of each method.
+    def report(self, top = 10, histogram = False):
+        print("%-36s %6s %7s %8s %9s %10s" % ("method", "calls", "trans", "bytes", "bus ms", "trans/call"))
+        for name, calls, transactions, nbytes, bus_us, max_us, hist in self.summary()[:top]:
+            per_call = transactions / calls if calls else 0
+            print("%-36s %6d %7d %8d %9.1f %10.1f" % (name, calls, transactions, nbytes, bus_us / 1000, per_call))
+            if histogram:
+                bounds = ["<=%d" % b for b in BUCKETS_US] + [">%d" % BUCKETS_US[-1]]
+                print("    us: " + "  ".join(["%s:%d" % (bounds[i], hist[i]) for i in range(NBUCKETS) if hist[i]]))
@@ -0,0 +1,167 @@
+#!/usr/bin/env pybricks-micropython
+
+# scheduler: cooperative multitasking for the drivers sharing the EV3 ports.
+#
+#   from scheduler import Scheduler
+#   sched = Scheduler()
+#   sched.every(10, imu.get_heading, priority = 2)
+#   sched.every(50, line.ReadSensorArray)
+#   sched.until(mux.motor1_run_angle(50, 720, wait = False).done, 20)
+#   sched.add(pfmate.controlBothMotorsSteps(1, 1, 7, 1, 7))
+#   sched.run(10000)
+#
+# Tasks are generators. A task runs until its next yield: "yield" hands the
+# CPU back until the task's next period (right away for period 0), "yield ms"
+# sleeps ms milliseconds without blocking the other tasks. Drivers offer
+# *Steps generators that yield instead of sleeping, run_steps() runs such a
+# generator blocking, the way the plain driver methods do.
+#
+# Of the due tasks the one with the highest priority runs first, equal
+# priorities go by oldest deadline. The loop latency is bounded by the
+# longest single step, not by the sum of every driver's sleeps.
+
+from transport import StopWatch, wait
+
+
+## Run a step generator to the end, sleeping where it yields.
+#  @param steps Generator yielding None or milliseconds to sleep.
+#  @return The return value of the generator.
+def run_steps(steps):
+    try:
+        while True:
+            ms = next(steps)
+            if ms:
+                wait(ms)
+    except StopIteration as stop:
+        return stop.args[0] if stop.args else None
+
+
+## Task: one generator run by the Scheduler
+class Task():
+
+    def __init__(self, steps, period_ms, priority, name):
+        self.steps = steps
+        self.period_ms = period_ms
+        self.priority = priority
+        self.name = name
+        self.next_ms = 0
+        ## Number of steps run
+        self.runs = 0
+        ## Periods skipped because the task could not run in time
+        self.overruns = 0
+        ## Largest delay between deadline and start of a step in ms
+        self.late_max_ms = 0
+        self.finished = False
+        ## Return value of the generator
+        self.result = None
+
+
+## Scheduler: runs generator tasks at their rates and priorities in one thread
+class Scheduler():
+
+    def __init__(self):
+        self.tasks = []
+        self.watch = StopWatch()
+        ## Number of steps run
+        self.steps = 0
+        ## Time spent sleeping because no task was due, in ms
+        self.idle_ms = 0
+
+    ## Add a generator task.
+    #  @param steps The generator.
+    #  @param period_ms Period of a plain yield, 0 continues as soon as possible.
+    #  @param priority Higher priorities run first.
+    #  @param name Name for report().
+    #  @param delay_ms Time until the first step.
+    def add(self, steps, period_ms = 0, priority = 0, name = None, delay_ms = 0):
+        task = Task(steps, period_ms, priority, name if name is not None else "task%d" % len(self.tasks))
+        task.next_ms = self.watch.time() + delay_ms
+        self.tasks.append(task)
+        return task
+
+    ## Call a function every period_ms.
+    #  @param period_ms The period.
+    #  @param fn Function without arguments, e.g. a bound driver method.
+    #  @param priority Higher priorities run first.
+    #  @param name Name for report().
+    def every(self, period_ms, fn, priority = 0, name = None):
+        def steps():
+            while True:
+                fn()
+                yield
+        return self.add(steps(), period_ms, priority, name if name is not None else getattr(fn, '__name__', None))
+
+    ## Call a function every period_ms until it returns True, e.g. MotorMove.done.
+    #  @param fn Function without arguments.
+    #  @param period_ms The period.
+    #  @param priority Higher priorities run first.
+    #  @param name Name for report().
+    def until(self, fn, period_ms, priority = 0, name = None):
+        def steps():
+            while not fn():
+                yield
+        return self.add(steps(), period_ms, priority, name if name is not None else getattr(fn, '__name__', None))
+
+    ## Remove a task.
+    def remove(self, task):
+        if task in self.tasks:
+            self.tasks.remove(task)
+
+    ## Run the most important due task for one step.
+    #  @return False if no task was due.
+    def step(self):
+        now = self.watch.time()
+        best = None
+        for task in self.tasks:
+            if task.next_ms <= now and (best is None or task.priority > best.priority or
+                                        (task.priority == best.priority and task.next_ms < best.next_ms)):
+                best = task
+        if best is None:
+            return False
+        late = now - best.next_ms
+        if late > best.late_max_ms:
+            best.late_max_ms = late
+        best.runs = best.runs + 1
+        self.steps = self.steps + 1
+        try:
+            ms = next(best.steps)
+        except StopIteration as stop:
+            best.finished = True
+            best.result = stop.args[0] if stop.args else None
+            self.tasks.remove(best)
+            return True
+        if ms:
+            best.next_ms = self.watch.time() + ms
+        elif best.period_ms:
+            best.next_ms = best.next_ms + best.period_ms
+            if best.next_ms <= now:
+                # skip the missed periods instead of catching up in a burst
+                missed = (now - best.next_ms) // best.period_ms + 1
+                best.overruns = best.overruns + missed
+                best.next_ms = best.next_ms + missed * best.period_ms
+        else:
+            best.next_ms = now
+        return True
+
+    ## Run the tasks.
+    #  @param duration_ms Run time in ms, None runs until all tasks finished.
+    def run(self, duration_ms = None):
+        start = self.watch.time()
+        while self.tasks:
+            now = self.watch.time()
+            if duration_ms is not None and now - start >= duration_ms:
+                break
+            if not self.step():
+                sleep = min([task.next_ms for task in self.tasks]) - now
+                if duration_ms is not None:
+                    sleep = min(sleep, start + duration_ms - now)
+                sleep = max(sleep, 1)
+                self.idle_ms = self.idle_ms + sleep
+                wait(sleep)
+
+    ## Prints the tasks with their step counts and worst start delays.
+    def report(self):
+        print("%-24s %4s %6s %8s %8s" % ("task", "prio", "runs", "late ms", "overruns"))
+        for task in self.tasks:
+            print("%-24s %4d %6d %8d %8d" % (task.name, task.priority, task.runs, task.late_max_ms, task.overruns))
+        print("steps: %d  idle: %d ms" % (self.steps, self.idle_ms))
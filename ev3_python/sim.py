@@ -0,0 +1,843 @@
+#!/usr/bin/env pybricks-micropython
+
+# Simulated EV3 backend for the mindsensors drivers.
+#
+# Provides the parts of the pybricks API the drivers use (I2CDevice,
+# UARTDevice, AnalogSensor, StopWatch, wait, Port, ...) on top of register
+# file models of the devices, so every driver runs on a plain Linux python.
+# transport.py picks this module automatically when pybricks is missing.
+#
+# Usage:
+#   import sim
+#   from mindsensorsPYB import ABSIMU
+#   imu_model = sim.attach(sim.Port.S1, 0x22, sim.ABSIMUModel())
+#   imu_model.set_sample(accel=(0, 0, 1000))
+#   imu = ABSIMU(sim.Port.S1)
+#   print(imu.get_accelz(), sim.stats())
+#
+# Time is virtual by default: bus latency and wait() advance the simulated
+# clock instead of sleeping, so long moves simulate in milliseconds of real
+# time. Set sim.clock.realtime = True to really sleep.
+
+import time
+
+
+## ticks in microseconds on MicroPython and CPython
+def ticks_us():
+    try:
+        return time.ticks_us()
+    except AttributeError:
+        return int(time.perf_counter() * 1000000)
+
+## Microseconds between two ticks_us values, the simulated clock does not wrap.
+def ticks_diff(end, start):
+    return end - start
+
+
+## SimClock: real elapsed time plus simulated bus and wait() time, in microseconds
+class SimClock():
+
+    def __init__(self):
+        self.realtime = False
+        self.reset()
+
+    def reset(self):
+        self.start_us = ticks_us()
+        self.offset_us = 0
+
+    def now_us(self):
+        return ticks_us() - self.start_us + self.offset_us
+
+    def advance(self, us):
+        if us <= 0:
+            return
+        if self.realtime:
+            time.sleep(us / 1000000)
+        else:
+            self.offset_us = self.offset_us + int(us)
+
+clock = SimClock()
+
+
+## LatencyModel: cost of one bus transaction
+#  @param turnaround_us Fixed cost per transaction (the EV3 needs about 1 ms per I2C transfer).
+#  @param per_byte_us Cost of every transferred byte.
+#  @param jitter_us Maximum random extra delay per transaction.
+#  @param seed Seed of the jitter generator, runs are repeatable.
+class LatencyModel():
+
+    def __init__(self, turnaround_us = 1000, per_byte_us = 100, jitter_us = 100, seed = 1):
+        self.turnaround_us = turnaround_us
+        self.per_byte_us = per_byte_us
+        self.jitter_us = jitter_us
+        self.state = seed
+
+    ## Returns the duration of a transaction moving nbytes in microseconds.
+    def cost(self, nbytes):
+        jitter = 0
+        if self.jitter_us:
+            # small LCG, random is not always available on the brick
+            self.state = (self.state * 1103515245 + 12345) & 0x7FFFFFFF
+            jitter = self.state % (self.jitter_us + 1)
+        return self.turnaround_us + self.per_byte_us * nbytes + jitter
+
+## Latency model used by I2C devices created after it is set
+i2c_latency = LatencyModel()
+
+## Attached device models by (port, 7 bit address) for I2C and by port for UART/analog
+devices = {}
+
+
+## Attach a device model to a port, drivers opening this port/address will talk to it.
+#  @param port Port of the device (sim.Port.S1 ... or a pybricks Port).
+#  @param address I2C address as used by the drivers (8 bit, e.g. 0x06 for NXTMMX), None for UART/analog devices.
+#  @param model Device model.
+def attach(port, address, model):
+    if address is None:
+        devices[port] = model
+    else:
+        devices[(port, address >> 1)] = model
+    model.port = port
+    model.address = address
+    return model
+
+## Remove all devices and reset the clock.
+def reset():
+    devices.clear()
+    clock.reset()
+
+## Bus totals over all attached devices.
+def stats():
+    total = {'transactions': 0, 'bytes_read': 0, 'bytes_written': 0, 'bus_us': 0}
+    for model in devices.values():
+        for key in total:
+            total[key] = total[key] + getattr(model, key)
+    return total
+
+## Prints bus usage per attached device.
+def report():
+    print("%-18s %-6s %6s %8s %8s %10s" % ("device", "addr", "trans", "read", "written", "bus us"))
+    for model in devices.values():
+        print("%-18s %-6s %6d %8d %8d %10d" % (model.__class__.__name__, model.address and hex(model.address),
+              model.transactions, model.bytes_read, model.bytes_written, model.bus_us))
+
+
+## Converts what the drivers pass to write() into bytes.
+def to_bytes(data):
+    if data is None:
+        return b''
+    if isinstance(data, str):
+        return data.encode()
+    if isinstance(data, int):
+        return bytes([data & 0xFF])
+    return bytes(data)
+
+
+## Base of all simulated devices: traffic counters
+class SimModel():
+
+    def __init__(self):
+        self.port = None
+        self.address = None
+        self.clear_stats()
+
+    def clear_stats(self):
+        self.transactions = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.bus_us = 0
+
+    def count(self, nread, nwritten, us):
+        self.transactions = self.transactions + 1
+        self.bytes_read = self.bytes_read + nread
+        self.bytes_written = self.bytes_written + nwritten
+        self.bus_us = self.bus_us + us
+        clock.advance(us)
+
+
+## RegisterModel: generic mindsensors I2C device, a 256 byte register file
+#  with firmware version, vendor and device id at 0x00, 0x08 and 0x10.
+#  Writes to command_reg are passed to command().
+class RegisterModel(SimModel):
+
+    command_reg = 0x41
+
+    def __init__(self, device_id = "", version = "V1.00"):
+        SimModel.__init__(self)
+        self.regs = bytearray(256)
+        self.latency = i2c_latency
+        self.put_string(0x00, version, 8)
+        self.put_string(0x08, "mndsnsrs", 8)
+        self.put_string(0x10, device_id, 8)
+
+    def put_string(self, reg, text, length):
+        data = text.encode()[:length]
+        self.regs[reg:reg + length] = data + bytes(length - len(data))
+
+    def put(self, reg, value, length = 1):
+        for i in range(length):
+            self.regs[reg + i] = (value >> (8 * i)) & 0xFF
+
+    def get(self, reg, length = 1, signed = False):
+        value = 0
+        for i in range(length):
+            value = value | (self.regs[reg + i] << (8 * i))
+        if signed and value & (1 << (8 * length - 1)):
+            value = value - (1 << (8 * length))
+        return value
+
+    ## Called before every register access, models update their state here.
+    def update(self):
+        pass
+
+    ## Called for every byte written to command_reg.
+    def command(self, cmd):
+        pass
+
+    ## Called after data was written to registers reg...
+    def written(self, reg, data):
+        if reg <= self.command_reg < reg + len(data):
+            self.command(chr(data[self.command_reg - reg]))
+
+    def read(self, reg, length):
+        self.update()
+        self.count(length, 0, self.latency.cost(length))
+        return bytes(self.regs[reg:reg + length])
+
+    def write(self, reg, data):
+        data = to_bytes(data)
+        self.count(0, len(data), self.latency.cost(len(data)))
+        self.update()
+        self.regs[reg:reg + len(data)] = data
+        self.written(reg, data)
+
+
+## I2CDevice: pybricks I2CDevice talking to the attached RegisterModel
+class I2CDevice():
+
+    def __init__(self, port, address):
+        try:
+            self.model = devices[(port, address)]
+        except KeyError:
+            raise OSError("no simulated device on %s at 0x%02X" % (port, address << 1))
+
+    def read(self, reg, length = 1):
+        return self.model.read(reg, length)
+
+    def write(self, reg, data = None):
+        self.model.write(reg, data)
+
+
+## UARTDevice: pybricks UARTDevice talking to the attached UART model
+class UARTDevice():
+
+    def __init__(self, port, baudrate, timeout = None):
+        try:
+            self.model = devices[port]
+        except KeyError:
+            raise OSError("no simulated device on %s" % (port,))
+        self.model.baudrate = baudrate
+        self.timeout = timeout
+
+    def read(self, length = 1):
+        return self.model.read(length)
+
+    def read_all(self):
+        return self.model.read(self.model.waiting())
+
+    def write(self, data):
+        return self.model.write(to_bytes(data))
+
+    def waiting(self):
+        return self.model.waiting()
+
+    def clear(self):
+        self.model.clear()
+
+
+## AnalogSensor: pybricks AnalogSensor reading the attached AnalogModel
+class AnalogSensor():
+
+    def __init__(self, port):
+        self.port = port
+
+    def voltage(self):
+        return devices[self.port].voltage(self)
+
+    def resistance(self):
+        return 0
+
+    def active(self):
+        devices[self.port].active = True
+
+    def passive(self):
+        devices[self.port].active = False
+
+
+## AnalogModel: analog sensor returning mV, separate values for active (lit) and passive mode
+class AnalogModel(SimModel):
+
+    def __init__(self, active_mv = 0, passive_mv = 0):
+        SimModel.__init__(self)
+        self.active_mv = active_mv
+        self.passive_mv = passive_mv
+        self.active = False
+
+    def voltage(self, sensor):
+        return self.active_mv if self.active else self.passive_mv
+
+
+## UARTModel: serial device with a receive buffer and timed replies
+class UARTModel(SimModel):
+
+    ## Bytes the device can buffer before it drops input
+    rx_size = 64
+
+    def __init__(self):
+        SimModel.__init__(self)
+        self.baudrate = 115200
+        self.rx = bytearray()
+        self.overruns = 0
+        # replies as [time_us, byte] waiting to be sent back
+        self.replies = []
+        self.busy_until = 0
+
+    def byte_us(self):
+        return 10 * 1000000 // self.baudrate
+
+    def write(self, data):
+        self.count(0, len(data), 0)
+        for b in data:
+            clock.advance(self.byte_us())
+            self.bus_us = self.bus_us + self.byte_us()
+            self.process()
+            if len(self.rx) >= self.rx_size:
+                self.overruns = self.overruns + 1
+            else:
+                self.rx.append(b)
+        self.process()
+        return len(data)
+
+    ## Queue reply bytes, they become readable after the device spent busy_us on the request.
+    def reply(self, data, busy_us = 0):
+        start = max(clock.now_us(), self.busy_until)
+        self.busy_until = start + busy_us
+        for b in data:
+            self.replies.append([self.busy_until, b])
+
+    ## Consume received bytes, models override this. A busy device leaves new
+    #  requests in rx until it finished the previous one.
+    def process(self):
+        pass
+
+    def busy(self):
+        return clock.now_us() < self.busy_until
+
+    def waiting(self):
+        now = clock.now_us()
+        n = 0
+        for when, b in self.replies:
+            if when > now:
+                break
+            n = n + 1
+        return n
+
+    def read(self, length = 1):
+        out = bytearray()
+        while len(out) < length:
+            if not self.replies:
+                raise OSError("simulated UART read timed out")
+            when, b = self.replies[0]
+            clock.advance(when - clock.now_us())
+            self.replies.pop(0)
+            out.append(b)
+        self.count(length, 0, self.byte_us() * length)
+        self.process()
+        return bytes(out)
+
+    def clear(self):
+        self.replies = []
+
+
+## StopWatch: pybricks StopWatch on the simulated clock
+class StopWatch():
+
+    def __init__(self):
+        self.paused_at = None
+        self.reset()
+
+    def time(self):
+        now = self.paused_at if self.paused_at is not None else clock.now_us()
+        return (now - self.start_us) // 1000
+
+    def pause(self):
+        if self.paused_at is None:
+            self.paused_at = clock.now_us()
+
+    def resume(self):
+        if self.paused_at is not None:
+            self.start_us = self.start_us + clock.now_us() - self.paused_at
+            self.paused_at = None
+
+    def reset(self):
+        self.start_us = clock.now_us()
+        if self.paused_at is not None:
+            self.paused_at = self.start_us
+
+
+## Pause for ms milliseconds of simulated time.
+def wait(ms):
+    clock.advance(ms * 1000)
+
+
+## Port: EV3 ports
+class Port():
+    S1 = 'S1'
+    S2 = 'S2'
+    S3 = 'S3'
+    S4 = 'S4'
+    A = 'A'
+    B = 'B'
+    C = 'C'
+    D = 'D'
+
+class Stop():
+    COAST = 0
+    BRAKE = 1
+    HOLD = 2
+
+class Direction():
+    CLOCKWISE = 0
+    COUNTERCLOCKWISE = 1
+
+class Button():
+    LEFT = 'LEFT'
+    RIGHT = 'RIGHT'
+    UP = 'UP'
+    DOWN = 'DOWN'
+    CENTER = 'CENTER'
+
+class Color():
+    BLACK = 'BLACK'
+    BLUE = 'BLUE'
+    GREEN = 'GREEN'
+    YELLOW = 'YELLOW'
+    RED = 'RED'
+    WHITE = 'WHITE'
+
+class Font():
+
+    def __init__(self, family = None, size = 12, bold = False, monospace = False):
+        self.size = size
+
+
+## DataLog: pybricks DataLog writing <name>.csv
+class DataLog():
+
+    def __init__(self, *headers, name = 'log', timestamp = True, extension = 'csv', append = False):
+        self.file = open(name + '.' + extension, 'a' if append else 'w')
+        if headers:
+            self.file.write(', '.join(headers) + '\n')
+
+    def log(self, *values):
+        self.file.write(', '.join([str(v) for v in values]) + '\n')
+        self.file.flush()
+
+
+class Speaker():
+
+    def beep(self, frequency = 500, duration = 100):
+        wait(duration)
+
+class Screen():
+
+    def print(self, *args):
+        print(*args)
+
+    def clear(self):
+        pass
+
+class EV3Brick():
+
+    def __init__(self):
+        self.speaker = Speaker()
+        self.screen = Screen()
+
+
+
+## NXTMMXModel: NXTMMX motor multiplexer with two simulated motors.
+#  Motors turn deg_per_speed degrees per second for every unit of speed (-100...100).
+#  limits[i] = (low, high) puts a mechanical stop on motor i+1, the motor stalls there.
+class NXTMMXModel(RegisterModel):
+
+    deg_per_speed = 9
+    # status bits
+    SPEED_CONTROL = 0x01
+    RAMPING = 0x02
+    POWERED = 0x04
+    POSITION_CONTROL = 0x08
+    BRAKE = 0x10
+    OVERLOAD = 0x20
+    TIMED = 0x40
+    STALLED = 0x80
+    # command register A bits
+    CMD_BRAKE = 0x10
+    CMD_RELATIVE = 0x04
+    CMD_ENCODER = 0x08
+    CMD_TIMED = 0x40
+    CMD_GO = 0x80
+
+    # positional moves: motor speed follows the PID output with this time constant
+    tau_s = 0.06
+    # speed below which a motor counts as standing, degrees per second
+    standing = 20
+    # PID register defaults (0x7A-0x87): encoder kP, kI, kD, speed kP, kI, kD, pass count, tolerance
+    PID_DEFAULTS = (64, 32, 16, 64, 32, 16, 5, 4)
+
+    def __init__(self, millivolts = 9000):
+        RegisterModel.__init__(self, "NxtMMX")
+        self.regs[0x41] = millivolts // 37
+        for i, value in enumerate(self.PID_DEFAULTS):
+            if i < 6:
+                self.put(0x7A + 2 * i, value, 2)
+            else:
+                self.regs[0x7A + 6 + i] = value
+        self.limits = [None, None]
+        self.position = [0.0, 0.0]
+        self.velocity = [0.0, 0.0]
+        self.integral = [0.0, 0.0]
+        self.passes = [0, 0]
+        self.carry = [0.0, 0.0]
+        self.speed = [0, 0]
+        self.mode = [None, None]
+        self.target = [0, 0]
+        self.end_us = [0, 0]
+        self.status = [0, 0]
+        self.last_us = clock.now_us()
+
+    def update(self):
+        now = clock.now_us()
+        last = self.last_us
+        self.last_us = now
+        for m in range(2):
+            mode = self.mode[m]
+            if mode is None:
+                continue
+            until = now
+            if mode == 'timed':
+                until = min(max(self.end_us[m], last), now)
+            step = self.speed[m] * self.deg_per_speed * (until - last) / 1000000
+            done = mode == 'timed' and until >= self.end_us[m]
+            if mode == 'target':
+                done = self.servo(m, (until - last) / 1000000)
+                step = 0
+            self.move(m, step)
+            if done:
+                self.finish(m)
+        for m in range(2):
+            self.put(0x62 + 4 * m, int(self.position[m]) & 0xFFFFFFFF, 4)
+            self.regs[0x72 + m] = self.status[m]
+
+    # Positional control like the firmware: the encoder PID sets the motor speed, limited
+    # to the commanded speed, the motor follows with a lag. Done after pass count steps
+    # standing within tolerance. Gains: kP / 8, kI / 64, kD / 256.
+    def servo(self, m, seconds):
+        kp = self.get(0x7A, 2) / 8
+        ki = self.get(0x7C, 2) / 64
+        kd = self.get(0x7E, 2) / 256
+        passes = self.regs[0x86]
+        tolerance = self.regs[0x87]
+        limit = abs(self.speed[m]) * self.deg_per_speed
+        dt = 0.001
+        self.carry[m] = self.carry[m] + seconds
+        steps = int(self.carry[m] / dt)
+        self.carry[m] = self.carry[m] - steps * dt
+        for i in range(steps):
+            error = self.target[m] - self.position[m]
+            command = kp * error - kd * self.velocity[m]
+            if abs(command) < limit:
+                # no integration while saturated
+                self.integral[m] = self.integral[m] + error * dt
+            command = command + ki * self.integral[m]
+            command = min(max(command, -limit), limit)
+            self.velocity[m] = self.velocity[m] + (command - self.velocity[m]) * dt / self.tau_s
+            self.move(m, self.velocity[m] * dt)
+            if abs(error) <= tolerance and abs(self.velocity[m]) < self.standing:
+                self.passes[m] = self.passes[m] + 1
+                if self.passes[m] >= passes:
+                    return True
+            else:
+                self.passes[m] = 0
+        return False
+
+    def move(self, m, step):
+        position = self.position[m] + step
+        limit = self.limits[m]
+        self.status[m] = self.status[m] & ~(self.OVERLOAD | self.STALLED)
+        if limit is not None and (position < limit[0] or position > limit[1]):
+            position = min(max(position, limit[0]), limit[1])
+            if self.mode[m] is not None:
+                self.status[m] = self.status[m] | self.OVERLOAD | self.STALLED
+        self.position[m] = position
+
+    def finish(self, m):
+        brake = self.regs[0x49 + 8 * m] & self.CMD_BRAKE
+        self.stop(m, brake)
+
+    def stop(self, m, brake):
+        self.mode[m] = None
+        self.velocity[m] = 0.0
+        self.status[m] = self.BRAKE if brake else 0
+
+    def start(self, m):
+        base = 0x42 + 8 * m
+        cmd = self.regs[base + 7]
+        self.speed[m] = self.get(base + 4, 1, True)
+        self.status[m] = self.POWERED | self.SPEED_CONTROL
+        if cmd & self.CMD_ENCODER:
+            target = self.get(base, 4, True)
+            if cmd & self.CMD_RELATIVE:
+                target = target + int(self.position[m])
+            self.target[m] = target
+            self.integral[m] = 0.0
+            self.passes[m] = 0
+            self.mode[m] = 'target'
+            self.status[m] = self.status[m] | self.POSITION_CONTROL
+        elif cmd & self.CMD_TIMED:
+            self.end_us[m] = clock.now_us() + self.regs[base + 5] * 1000000
+            self.mode[m] = 'timed'
+            self.status[m] = self.status[m] | self.TIMED
+        else:
+            self.mode[m] = 'run'
+        self.regs[0x72 + m] = self.status[m]
+
+    def written(self, reg, data):
+        for m in range(2):
+            if reg <= 0x49 + 8 * m < reg + len(data) and self.regs[0x49 + 8 * m] & self.CMD_GO:
+                self.start(m)
+        RegisterModel.written(self, reg, data)
+
+    def command(self, cmd):
+        if cmd == 'R':
+            self.position = [0.0, 0.0]
+        elif cmd == 'r':
+            self.position[0] = 0.0
+        elif cmd == 's':
+            self.position[1] = 0.0
+        elif cmd == 'S':
+            self.start(0)
+            self.start(1)
+        elif cmd in 'abc':
+            for m in range(2):
+                if cmd == 'c' or cmd == 'ab'[m]:
+                    self.stop(m, False)
+        elif cmd in 'ABC':
+            for m in range(2):
+                if cmd == 'C' or cmd == 'AB'[m]:
+                    self.stop(m, True)
+        else:
+            return
+        self.update()
+
+
+## NXTCam5Model: NXTCam5 / NXTCAM with up to 8 tracked objects
+class NXTCam5Model(RegisterModel):
+
+    def __init__(self):
+        RegisterModel.__init__(self, "NXTCAM5")
+        self.mode = None
+        self.commands = 0
+
+    ## Set the tracked objects.
+    #  @param objects List of (color, x_top_left, y_top_left, x_bottom_right, y_bottom_right).
+    def set_objects(self, objects):
+        objects = objects[:8]
+        self.regs[0x42] = len(objects)
+        self.regs[0x43:0x6B] = bytes(40)
+        for i, obj in enumerate(objects):
+            self.regs[0x43 + 5 * i:0x48 + 5 * i] = bytes(obj)
+
+    def command(self, cmd):
+        self.commands = self.commands + 1
+        if cmd in 'BFeLQ':
+            self.mode = cmd
+
+
+## EV3MatrixModel: 8x8 LED matrix.
+#  'P' sets the pixel row/column (0x45/0x46) to value (0x47), 'R' and 'C' set a
+#  whole row/column from the bitmap in value (bit n = column/row n), 'F' shows a font character.
+class EV3MatrixModel(RegisterModel):
+
+    def __init__(self):
+        RegisterModel.__init__(self, "EV3Matrx")
+        self.rows = bytearray(8)
+        self.commands = 0
+        self.char = None
+        self.brightness = 0
+
+    def pixel(self, row, column):
+        return (self.rows[row] >> column) & 1
+
+    def command(self, cmd):
+        self.commands = self.commands + 1
+        row = self.regs[0x45] & 7
+        column = self.regs[0x46] & 7
+        value = self.regs[0x47]
+        if cmd == 'P':
+            if value:
+                self.rows[row] = self.rows[row] | (1 << column)
+            else:
+                self.rows[row] = self.rows[row] & ~(1 << column)
+        elif cmd == 'R':
+            self.rows[row] = value
+        elif cmd == 'C':
+            for r in range(8):
+                if (value >> r) & 1:
+                    self.rows[r] = self.rows[r] | (1 << column)
+                else:
+                    self.rows[r] = self.rows[r] & ~(1 << column)
+        elif cmd == 'F':
+            self.char = chr(self.regs[0x44])
+            self.brightness = self.regs[0x42]
+        elif cmd == 'I':
+            self.brightness = self.regs[0x42]
+        self.regs[0x48:0x50] = self.rows
+
+
+## ABSIMUModel: AbsoluteIMU. set_sample() sets the registers directly, or assign
+#  motion = function(t_seconds) returning a dict of set_sample() arguments.
+class ABSIMUModel(RegisterModel):
+
+    def __init__(self):
+        RegisterModel.__init__(self, "AbsIMU")
+        self.motion = None
+        self.set_sample()
+
+    def set_sample(self, tilt = (0, 0, 0), accel = (0, 0, 0), heading = 0, mag = (0, 0, 0), gyro = (0, 0, 0)):
+        for i in range(3):
+            self.put(0x42 + i, tilt[i] & 0xFF)
+            self.put(0x45 + 2 * i, accel[i] & 0xFFFF, 2)
+            self.put(0x4D + 2 * i, mag[i] & 0xFFFF, 2)
+            self.put(0x53 + 2 * i, gyro[i] & 0xFFFF, 2)
+        self.put(0x4B, heading, 2)
+
+    def update(self):
+        if self.motion is not None:
+            self.set_sample(**self.motion(clock.now_us() / 1000000))
+
+
+## LineLeaderModel: LineLeader, set_line() sets the eight sensor values (0-100).
+class LineLeaderModel(RegisterModel):
+
+    def __init__(self):
+        RegisterModel.__init__(self, "LineLdr")
+        self.set_line([0] * 8)
+
+    def set_line(self, calibrated, uncalibrated = None):
+        if uncalibrated is None:
+            uncalibrated = [700 - 5 * v for v in calibrated]
+        result = 0
+        weighted = 0
+        for i in range(8):
+            self.regs[0x49 + i] = calibrated[i]
+            self.put(0x74 + 2 * i, uncalibrated[i], 2)
+            if calibrated[i] < 50:
+                result = result | (1 << i)
+                weighted = weighted + 10 * (i + 1)
+        count = bin(result).count('1')
+        self.regs[0x43] = weighted // count if count else 0
+        self.regs[0x44] = result
+        self.put(0x42, (self.regs[0x45] - self.regs[0x43] if count else 0) & 0xFF)
+
+
+## LSAModel: LightSensorArray, set_line() sets the eight sensor values (0-100).
+class LSAModel(RegisterModel):
+
+    def __init__(self):
+        RegisterModel.__init__(self, "LSArray")
+        self.set_line([0] * 8)
+
+    def set_line(self, calibrated, uncalibrated = None):
+        if uncalibrated is None:
+            uncalibrated = [700 - 5 * v for v in calibrated]
+        for i in range(8):
+            self.regs[0x42 + i] = calibrated[i]
+            self.put(0x6A + 2 * i, uncalibrated[i], 2)
+
+
+## RFidModel: EV3RFid reader. A block read ('R') or write ('W') takes busy_ms,
+#  the command register reads back the command until the card operation is done.
+class RFidModel(RegisterModel):
+
+    def __init__(self, busy_ms = 150):
+        RegisterModel.__init__(self, "EV3RFID")
+        self.busy_ms = busy_ms
+        self.card = None
+        self.pending = None
+        self.done_us = 0
+
+    ## Put a card on the reader.
+    #  @param uid Card UID (32 bit).
+    #  @param blocks Dictionary block id -> 16 bytes.
+    def present(self, uid, blocks = None):
+        self.card = {'uid': uid, 'blocks': blocks if blocks is not None else {}}
+        self.put(0x44, uid, 4)
+
+    def remove(self):
+        self.card = None
+        self.put(0x44, 0, 4)
+
+    def update(self):
+        if self.pending is None or clock.now_us() < self.done_us:
+            return
+        block = self.regs[0x4F]
+        if self.card is not None:
+            blocks = self.card['blocks']
+            if self.pending == 'R':
+                self.regs[0x50:0x60] = blocks.get(block, bytes(16))
+            else:
+                blocks[block] = bytes(self.regs[0x50:0x60])
+        self.pending = None
+        self.regs[0x41] = 0
+
+    def command(self, cmd):
+        if cmd in 'RW':
+            self.pending = cmd
+            self.done_us = clock.now_us() + self.busy_ms * 1000
+        elif cmd == 'C':
+            self.put(0x44, 0, 4)
+
+
+## TFTPackModel: TFTPack display on a UART port. Every 0x01 <opcode> <args>
+#  command is acknowledged with 0x06 followed by the touch point (x, y) after command_us.
+class TFTPackModel(UARTModel):
+
+    ## Argument bytes per opcode
+    ARGS = {0x00: 0, 0x02: 0, 0x04: 0, 0x12: 0, 0x13: 0, 0x18: 4, 0x07: 2, 0x06: 1,
+            0x0C: 10, 0x10: 6, 0x03: 7, 0x43: 7, 0x0F: 10, 0x4F: 10, 0x19: 11, 0x59: 11,
+            0x0E: 14, 0x4E: 14}
+
+    def __init__(self, command_us = 2000):
+        UARTModel.__init__(self)
+        self.command_us = command_us
+        self.touch = (0, 0)
+        self.commands = []
+        self.text = ''
+
+    def set_touch(self, x, y):
+        self.touch = (x, y)
+
+    def process(self):
+        while self.rx and not self.busy():
+            if self.rx[0] != 0x01:
+                self.text = self.text + chr(self.rx.pop(0))
+                continue
+            if len(self.rx) < 2:
+                return
+            n = self.ARGS.get(self.rx[1], 0)
+            if len(self.rx) < 2 + n:
+                return
+            self.commands.append(bytes(self.rx[1:2 + n]))
+            self.rx = self.rx[2 + n:]
+            x, y = self.touch
+            self.reply(bytes([0x06, x & 0xFF, x >> 8, y & 0xFF, y >> 8]), self.command_us)
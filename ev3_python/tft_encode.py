@@ -0,0 +1,149 @@
+#!/usr/bin/env pybricks-micropython
+
+## tft_encode: RGB565 colors and command encoding for the TFTPack display.
+#  Colors are converted with integer math and kept in a small LRU palette,
+#  commands are written field by field into one preallocated buffer, so
+#  encoding a primitive does not build any intermediate bytes objects.
+
+from array import array
+
+
+## RGB565 value of an [R,G,B] color, same result as the float conversion TFTPACK used.
+def rgb565(RGB):
+    return ((RGB[0] * 31 // 255) << 11) | ((RGB[1] * 63 // 255) << 5) | (RGB[2] * 31 // 255)
+
+## RGB565 values of a list of [R,G,B] colors.
+#  @param colors List of [R,G,B] colors.
+#  @param out array('H') to fill, a new one is made if None.
+def rgb565_list(colors, out = None):
+    if out is None:
+        out = array('H', bytes(2 * len(colors)))
+    for i in range(len(colors)):
+        RGB = colors[i]
+        out[i] = ((RGB[0] * 31 // 255) << 11) | ((RGB[1] * 63 // 255) << 5) | (RGB[2] * 31 // 255)
+    return out
+
+
+## Palette: RGB565 values of the last recently used colors
+#  @param size Number of colors kept.
+class Palette():
+
+    def __init__(self, size = 32):
+        self.size = size
+        self.values = {}
+        # keys, least recently used first
+        self.order = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.order)
+
+    ## RGB565 value of an [R,G,B] color.
+    def lookup(self, RGB):
+        key = (RGB[0] << 16) | (RGB[1] << 8) | RGB[2]
+        value = self.values.get(key)
+        if value is not None:
+            self.hits = self.hits + 1
+            if self.order[-1] != key:
+                self.order.remove(key)
+                self.order.append(key)
+            return value
+        self.misses = self.misses + 1
+        value = rgb565(RGB)
+        if len(self.order) >= self.size:
+            del self.values[self.order.pop(0)]
+        self.values[key] = value
+        self.order.append(key)
+        return value
+
+    def clear(self):
+        self.values = {}
+        self.order = []
+        self.hits = 0
+        self.misses = 0
+
+
+## CommandEncoder: writes TFTPack commands into one reusable buffer.
+#  Every method returns a memoryview of the buffer, it is only valid until the
+#  next command is encoded. Write it or copy it (bytearray.extend) right away.
+class CommandEncoder():
+
+    def __init__(self, palette = None):
+        self.palette = palette if palette is not None else Palette()
+        self.buf = bytearray(16)
+        self.view = memoryview(self.buf)
+        self.buf[0] = 0x01
+
+    def put16(self, pos, value):
+        self.buf[pos] = value & 0xFF
+        self.buf[pos + 1] = (value >> 8) & 0xFF
+
+    def point(self, pos, xy):
+        self.put16(pos, xy[0])
+        self.put16(pos + 2, xy[1])
+
+    def color(self, pos, RGB):
+        self.put16(pos, self.palette.lookup(RGB))
+
+    ## Command without arguments.
+    def simple(self, opcode):
+        self.buf[1] = opcode
+        return self.view[:2]
+
+    def set_curser_xy(self, xpos, ypos):
+        self.buf[1] = 0x18
+        self.put16(2, xpos)
+        self.put16(4, ypos)
+        return self.view[:6]
+
+    def set_color(self, RGB):
+        self.buf[1] = 0x07
+        self.color(2, RGB)
+        return self.view[:4]
+
+    def set_font_size(self, size):
+        self.buf[1] = 0x06
+        self.buf[2] = size
+        return self.view[:3]
+
+    def draw_line(self, start, end, RGB):
+        self.buf[1] = 0x0C
+        self.point(2, start)
+        self.point(6, end)
+        self.color(10, RGB)
+        return self.view[:12]
+
+    def draw_pixel(self, position, RGB):
+        self.buf[1] = 0x10
+        self.point(2, position)
+        self.color(6, RGB)
+        return self.view[:8]
+
+    def draw_circle(self, center, radius, RGB, fill):
+        self.buf[1] = 0x43 if fill == True else 0x03
+        self.point(2, center)
+        self.buf[6] = radius
+        self.color(7, RGB)
+        return self.view[:9]
+
+    def draw_rectangle(self, topleft, width, hight, radius, RGB, fill):
+        self.point(2, topleft)
+        self.put16(6, width)
+        self.put16(8, hight)
+        if radius == 0:
+            self.buf[1] = 0x4F if fill == True else 0x0F
+            self.color(10, RGB)
+            return self.view[:12]
+        self.buf[1] = 0x59 if fill == True else 0x19
+        self.buf[10] = radius
+        self.color(11, RGB)
+        return self.view[:13]
+
+    def draw_triangle(self, vertex1, vertex2, vertex3, RGB, fill):
+        self.buf[1] = 0x4E if fill == True else 0x0E
+        self.point(2, vertex1)
+        self.point(6, vertex2)
+        self.point(10, vertex3)
+        self.color(14, RGB)
+        return self.view[:16]
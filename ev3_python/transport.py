@@ -0,0 +1,24 @@
+#!/usr/bin/env pybricks-micropython
+
+# transport: the device and timing classes used by all drivers.
+# On the EV3 these are the pybricks ones, anywhere pybricks is missing the
+# simulated backend from sim.py is used, so the drivers run unchanged on a
+# Linux machine against the simulated register files.
+
+try:
+    from pybricks.hubs import EV3Brick
+    from pybricks.iodevices import I2CDevice
+    from pybricks.iodevices import AnalogSensor
+    from pybricks.iodevices import UARTDevice
+    from pybricks.parameters import Port, Stop, Direction, Button, Color
+    from pybricks.tools import wait, StopWatch, DataLog
+    from pybricks.media.ev3dev import Font
+    from utime import ticks_us, ticks_diff
+    SIMULATED = False
+except ImportError:
+    from sim import EV3Brick, I2CDevice, AnalogSensor, UARTDevice
+    from sim import Port, Stop, Direction, Button, Color
+    from sim import wait, StopWatch, DataLog, Font
+    from sim import clock, ticks_diff
+    ticks_us = clock.now_us
+    SIMULATED = True